@@ -1,6 +1,12 @@
+import asyncio
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from threading import Lock
+from typing import NamedTuple, Optional
+
+from cachetools import TTLCache
 
 from fastapi import (
     APIRouter,
@@ -9,6 +15,7 @@ from fastapi import (
     status,
     Response,
     Cookie,
+    Request,
 )
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 # Passlib est utilisé pour le hachage et la vérification sécurisés des mots de passe.
@@ -17,6 +24,7 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from pydantic import BaseModel, constr
 from sqlmodel import Session, select, delete
+from starlette.concurrency import run_in_threadpool
 
 from app.db import SessionLocal
 from app.models import (
@@ -29,7 +37,11 @@ from app.models import (
     DocumentHistory,
     DocumentImage, TeamMembership, Team,
 )
+from app.utils.cache import bump_scopes, read_versions
+from app.utils.doc_history import forget_document
 from app.utils.files import purge_project_storage
+from app.utils import telemetry
+from app.utils.ratelimit import TokenBucketLimiter, client_ip
 
 # ─── CONFIGURATION JWT ET SÉCURITÉ ───────────────────────────────────────────
 # BLOC DE CONFIGURATION
@@ -41,8 +53,34 @@ JWT_SECRET = os.getenv("JWT_SECRET",
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")  # Algorithme de signature.
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))  # Durée de validité du token.
 
+# Cache des utilisateurs authentifiés : (id) -> (username, token_version). Le token porte l'id et le
+# nom d'utilisateur ; seul `token_version` (la révocation) est vérifié, dans ce cache du processus.
+# Toute révocation (changement de mot de passe ou de nom, suppression du compte) incrémente, dans la
+# même transaction, le compteur partagé `DataVersion` du périmètre `auth` (AUTH_SCOPE). Chaque worker
+# relit ce compteur au plus toutes les AUTH_REVOCATION_POLL secondes et vide son cache s'il a changé :
+# une révocation est vue partout en AUTH_REVOCATION_POLL secondes au plus, quel que soit USER_CACHE_TTL.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+AUTH_SCOPE = "auth"
+AUTH_REVOCATION_POLL = float(os.getenv("AUTH_REVOCATION_POLL", "2"))
+
+# Coût bcrypt (2^rounds itérations) : à ajuster selon le matériel, 12 reste la valeur conseillée.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Pool dédié au hachage : bcrypt est volontairement lent et ne doit pas occuper le threadpool
+# partagé par toutes les routes synchrones. Au-delà de PASSWORD_MAX_QUEUE travaux en attente,
+# la requête est refusée (503) plutôt que d'allonger la file indéfiniment.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_MAX_QUEUE = int(os.getenv("PASSWORD_MAX_QUEUE", "64"))
+# Limiteurs de tentatives (token bucket) : par adresse IP, et par couple (nom d'utilisateur, adresse IP).
+# Le second seau n'est jamais partagé entre adresses : inonder de tentatives le nom d'un utilisateur
+# depuis d'autres adresses ne l'empêche pas de se connecter depuis la sienne.
+LOGIN_RATE_PER_MINUTE = float(os.getenv("LOGIN_RATE_PER_MINUTE", "10"))
+LOGIN_BURST = int(os.getenv("LOGIN_BURST", "10"))
+LOGIN_USER_RATE_PER_MINUTE = float(os.getenv("LOGIN_USER_RATE_PER_MINUTE", "5"))
+LOGIN_USER_BURST = int(os.getenv("LOGIN_USER_BURST", "5"))
+
 # Contexte pour le hachage des mots de passe utilisant l'algorithme bcrypt.
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 # Schéma de sécurité OAuth2 standard de FastAPI pour la gestion des tokens.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -69,13 +107,142 @@ def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def create_access_token(subject: str) -> str:
-    """Crée un nouveau JSON Web Token (JWT) pour un sujet donné (ici, l'ID de l'utilisateur)."""
+# BLOC DU POOL DE HACHAGE
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_password_lock = Lock()
+_password_queued = 0    # travaux soumis, pas encore démarrés
+_password_running = 0   # travaux en cours d'exécution
+
+telemetry.register_gauge("password_hash_queue_depth", lambda: _password_queued,
+                         help="Travaux bcrypt en attente d'un thread du pool dédié")
+telemetry.register_gauge("password_hash_running", lambda: _password_running,
+                         help="Travaux bcrypt en cours")
+
+
+def _run_password_job(fn, *args):
+    global _password_queued, _password_running
+    with _password_lock:
+        _password_queued -= 1
+        _password_running += 1
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        telemetry.observe("password_hash_seconds", time.perf_counter() - start,
+                          help="Durée d'un hachage ou d'une vérification bcrypt")
+        with _password_lock:
+            _password_running -= 1
+
+
+def _release_cancelled_job(future: Future) -> None:
+    # Travail annulé avant d'avoir démarré (client déconnecté pendant l'attente) : il ne passera
+    # jamais par `_run_password_job`, sa place dans la file est libérée ici.
+    global _password_queued
+    if future.cancelled():
+        with _password_lock:
+            _password_queued -= 1
+
+
+async def _submit_password_job(fn, *args):
+    """Exécute `fn(*args)` sur le pool bcrypt sans bloquer la boucle d'événements."""
+    global _password_queued
+    with _password_lock:
+        if _password_queued >= PASSWORD_MAX_QUEUE:
+            telemetry.inc("password_hash_rejected_total", help="Travaux bcrypt refusés (file pleine)")
+            raise HTTPException(status_code=503, detail="Serveur occupé, réessayez dans un instant",
+                                headers={"Retry-After": "1"})
+        _password_queued += 1
+    future = _password_executor.submit(_run_password_job, fn, *args)
+    future.add_done_callback(_release_cancelled_job)
+    return await asyncio.wrap_future(future)
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    """`verify_password` exécuté sur le pool bcrypt dédié."""
+    return await _submit_password_job(verify_password, plain, hashed)
+
+
+async def hash_password_async(password: str) -> str:
+    """`hash_password` exécuté sur le pool bcrypt dédié."""
+    return await _submit_password_job(hash_password, password)
+
+
+login_ip_limiter = TokenBucketLimiter("login_ip", LOGIN_RATE_PER_MINUTE / 60.0, LOGIN_BURST)
+login_user_limiter = TokenBucketLimiter("login_user", LOGIN_USER_RATE_PER_MINUTE / 60.0, LOGIN_USER_BURST)
+
+
+def create_access_token(subject: str, username: Optional[str] = None, token_version: int = 0) -> str:
+    """Crée un nouveau JSON Web Token (JWT) pour un sujet donné (ici, l'ID de l'utilisateur).
+    Le token porte aussi le nom d'utilisateur et la version de token (`tv`) servant à la révocation."""
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode = {"sub": subject, "exp": expire}  # Le "payload" du token
+    to_encode = {"sub": subject, "exp": expire, "tv": token_version}  # Le "payload" du token
+    if username is not None:
+        to_encode["username"] = username
     return jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
 
 
+def issue_token(user: User) -> str:
+    """Token d'accès pour `user`, avec ses claims courants."""
+    return create_access_token(str(user.id), user.username, user.token_version)
+
+
+class CachedUser(NamedTuple):
+    """Ce que les routes utilisent de l'utilisateur courant (jamais le hash du mot de passe)."""
+    id: int
+    username: str
+    token_version: int
+
+
+_user_cache: TTLCache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_user_cache_lock = Lock()
+_user_generation = 0          # incrémenté à chaque vidage du cache
+_auth_version: Optional[int] = None
+_auth_checked = 0.0
+
+
+def _sync_revocations() -> None:
+    """Vide le cache des utilisateurs si le compteur partagé `auth` a changé (relu au plus toutes les
+    AUTH_REVOCATION_POLL secondes : une requête par worker et par intervalle, pas par utilisateur)."""
+    global _auth_checked, _auth_version, _user_generation
+    now = time.monotonic()
+    with _user_cache_lock:
+        if now - _auth_checked < AUTH_REVOCATION_POLL:
+            return
+        _auth_checked = now
+    with SessionLocal() as db:
+        version = read_versions(db, [AUTH_SCOPE])[AUTH_SCOPE]
+    with _user_cache_lock:
+        if version != _auth_version:
+            _auth_version = version
+            _user_generation += 1
+            _user_cache.clear()
+
+
+def _load_cached_user(user_id: int) -> Optional[CachedUser]:
+    """Lit l'utilisateur dans le cache, ou en base (une requête sur 3 colonnes) en cas d'absence."""
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        generation = _user_generation
+    if cached is not None:
+        return cached
+    with SessionLocal() as db:
+        row = db.exec(select(User.id, User.username, User.token_version).where(User.id == user_id)).first()
+    if row is None:
+        return None
+    cached = CachedUser(row[0], row[1], row[2] or 0)
+    with _user_cache_lock:
+        # Une lecture antérieure à un vidage (révocation concurrente) n'est pas mise en cache.
+        if generation == _user_generation:
+            _user_cache[user_id] = cached
+    return cached
+
+
+def invalidate_user(user_id: int) -> None:
+    """Retire un utilisateur du cache (à appeler après toute modification du compte)."""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
 # ─── SCHÉMAS DE DONNÉES (PAYLOADS) ───────────────────────────────────────
 class UpdateUser(BaseModel):
     """Schéma Pydantic pour la mise à jour des informations utilisateur."""
@@ -87,8 +254,34 @@ class UpdateUser(BaseModel):
 # BLOC DE GESTION DE L'INSCRIPTION ET DE LA CONNEXION
 # Ces routes constituent le point d'entrée pour les utilisateurs dans l'application.
 
+# Ces routes sont asynchrones : le hachage bcrypt part sur le pool dédié (voir plus haut), et les
+# rafales de tentatives sont limitées par adresse IP et par (nom d'utilisateur, IP) (429 + Retry-After).
+# Les accès à la base sont synchrones : ils passent par `run_in_threadpool` (helpers ci-dessous)
+# pour ne jamais bloquer la boucle d'événements.
+
+def _find_user(db: Session, username: str) -> Optional[User]:
+    return db.exec(select(User).where(User.username == username)).first()
+
+
+def _save_user(db: Session, user: User) -> User:
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def _revoke_and_save(db: Session, user: User) -> User:
+    # même transaction : les autres workers voient la révocation en même temps que la ligne
+    db.add(user)
+    bump_scopes(db, AUTH_SCOPE)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
 @router.post("/signup", status_code=status.HTTP_201_CREATED)
-def signup(
+async def signup(
+        request: Request,
         form_data: OAuth2PasswordRequestForm = Depends(),  # Utilise le format standard pour les formulaires de login.
         db: Session = Depends(get_db),
 ):
@@ -96,22 +289,22 @@ def signup(
     # 1. Vérifie si le nom d'utilisateur existe déjà pour éviter les doublons.
     # 2. Hache le mot de passe fourni avant de le stocker.
     # 3. Crée et sauvegarde le nouvel utilisateur en base de données.
-    existing = db.exec(select(User).where(User.username == form_data.username)).first()
-    if existing:
+    login_ip_limiter.check(client_ip(request))
+    if await run_in_threadpool(_find_user, db, form_data.username):
         raise HTTPException(status_code=400, detail="Username already registered")
 
     user = User(
         username=form_data.username,
-        password_hash=hash_password(form_data.password),
+        password_hash=await hash_password_async(form_data.password),
         role_id=1,  # `role_id=1` est probablement le rôle par défaut.
     )
-    db.add(user)
-    db.commit()
+    await run_in_threadpool(_save_user, db, user)
     return {"msg": "User created"}
 
 
 @router.post("/login")
-def login(
+async def login(
+        request: Request,
         response: Response,  # La réponse FastAPI est injectée pour pouvoir y ajouter un cookie.
         form_data: OAuth2PasswordRequestForm = Depends(),
         db: Session = Depends(get_db),
@@ -124,15 +317,18 @@ def login(
     #    l'accès au token via JavaScript côté client, protégeant contre les attaques XSS.
     # 5. Retourne également le token dans le corps de la réponse pour les clients
     #    qui ne gèrent pas les cookies (ex: applications mobiles).
-    user = db.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    ip = client_ip(request)
+    login_ip_limiter.check(ip)
+    login_user_limiter.check(f"{form_data.username.lower()}|{ip}")
+    user = await run_in_threadpool(_find_user, db, form_data.username)
+    if not user or not await verify_password_async(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    token = create_access_token(str(user.id))
+    token = issue_token(user)
 
     response.set_cookie(
         key="smia_token",
@@ -148,13 +344,18 @@ def login(
 # BLOC DE LA DÉPENDANCE D'AUTHENTIFICATION
 # La fonction `get_current_user` est le pilier de la sécurité de l'API. Injectée
 # dans la plupart des autres routes, elle est responsable de valider le token
-# et de récupérer l'utilisateur correspondant en base de données.
+# et de retrouver l'utilisateur correspondant.
+# CHEMIN RAPIDE : la signature et l'expiration sont vérifiées sans état ; l'id et le nom viennent
+# des claims signés. Seule la version de token (`tv`) est comparée à celle du cache des utilisateurs,
+# tenu à jour entre workers par le compteur de révocations (cf. AUTH_SCOPE) : pas de requête SQL par
+# requête HTTP, une lecture par utilisateur après chaque révocation ou à l'expiration du cache.
+# L'objet `User` retourné est détaché : les routes qui modifient le compte le relisent en base.
 def get_current_user(
+        request: Request,
         # Tente de récupérer le token depuis l'en-tête "Authorization: Bearer <token>"
         header_token: str | None = Depends(oauth2_scheme),
         # Si non trouvé, tente de le récupérer depuis un cookie nommé "smia_token"
         cookie_token: str | None = Cookie(None),
-        db: Session = Depends(get_db),
 ):
     # 1. Stratégie de récupération du token flexible (Header ou Cookie).
     token = header_token or cookie_token
@@ -172,6 +373,8 @@ def get_current_user(
         user_id: str = payload.get("sub")
         if not user_id:
             raise JWTError()
+        token_version = int(payload.get("tv", 0))
+        username = payload.get("username")
     except JWTError:
         # Cette erreur est levée si le token est malformé, expiré ou si la signature est invalide.
         raise HTTPException(
@@ -179,13 +382,27 @@ def get_current_user(
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    # 4. Récupération de l'utilisateur en base de données.
-    user = db.get(User, int(user_id))
-    if not user:
+    # 4. Version de token courante de l'utilisateur (cache, puis base de données si absent).
+    _sync_revocations()
+    cached = _load_cached_user(int(user_id))
+    if not cached:
         # Ce cas peut arriver si l'utilisateur a été supprimé après l'émission du token.
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    # 5. Révocation : un token émis avant le dernier changement de mot de passe n'est plus accepté.
+    if cached.token_version != token_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
-    # 5. Retourne l'objet User complet, qui sera disponible dans la route qui utilise cette dépendance.
+    # 6. Retourne un objet User détaché (id, username), disponible dans la route qui utilise cette dépendance.
+    #    Il est aussi exposé dans `request.state.user` pour les middlewares (journalisation, métriques).
+    #    Un renommage révoque les tokens : le nom signé d'un token accepté est donc toujours le nom courant
+    #    (les tokens émis avant l'ajout du claim retombent sur le nom en cache).
+    user = User(id=cached.id, username=username or cached.username, password_hash="",
+                token_version=cached.token_version)
+    request.state.user = user
     return user
 
 
@@ -200,26 +417,39 @@ def read_me(current_user: User = Depends(get_current_user)):
 
 
 @router.put("/me", response_model=UserRead)
-def update_me(
+async def update_me(
         payload: UpdateUser,
+        response: Response,
         db: Session = Depends(get_db),
         current_user: User = Depends(get_current_user),
 ):
     # Route pour mettre à jour son nom d'utilisateur ou son mot de passe.
+    # L'utilisateur courant est détaché (voir `get_current_user`) : on relit la ligne en base.
+    # Un changement de mot de passe ou de nom incrémente `token_version`, ce qui révoque tous les tokens
+    # existants (leur nom signé serait périmé) ; un nouveau token est renvoyé (cookie + en-tête
+    # `X-Access-Token`) pour cette session.
+    user = await run_in_threadpool(db.get, User, current_user.id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     updated = False
-    if payload.username and payload.username != current_user.username:
-        if db.exec(select(User).where(User.username == payload.username)).first():
+    if payload.username and payload.username != user.username:
+        if await run_in_threadpool(_find_user, db, payload.username):
             raise HTTPException(status_code=400, detail="Username already taken")
-        current_user.username = payload.username
+        user.username = payload.username
         updated = True
     if payload.password:
-        current_user.password_hash = hash_password(payload.password)
+        user.password_hash = await hash_password_async(payload.password)
         updated = True
     if not updated:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No changes detected.")
-    db.commit()
-    db.refresh(current_user)
-    return current_user
+    user.token_version = (user.token_version or 0) + 1
+    await run_in_threadpool(_revoke_and_save, db, user)
+    invalidate_user(user.id)
+
+    token = issue_token(user)
+    response.set_cookie(key="smia_token", value=token, httponly=True, samesite="lax")
+    response.headers["X-Access-Token"] = token
+    return user
 
 
 @router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
@@ -232,7 +462,13 @@ def delete_me(
     # La logique effectue une suppression en cascade manuelle et explicite pour garantir
     # que toutes les données (en base et sur disque) sont bien nettoyées.
 
+    # L'utilisateur courant est détaché (voir `get_current_user`) : on relit la ligne en base.
+    current_user = db.get(User, current_user.id)
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
     # 0. Supprime les appartenances aux équipes et les équipes dont l'utilisateur est propriétaire.
+    team_ids = db.exec(select(TeamMembership.team_id).where(TeamMembership.user_id == current_user.id)).all()
     db.exec(delete(TeamMembership).where(TeamMembership.user_id == current_user.id))
     owned_teams = db.exec(select(Team).where(Team.owner_id == current_user.id)).all()
     for team in owned_teams:
@@ -250,12 +486,22 @@ def delete_me(
 
     # 2. Supprime tous les documents, leur historique et leurs images.
     docs = db.exec(select(Document).where(Document.created_by == current_user.username)).all()
+    doc_ids = [doc.id for doc in docs]
     for doc in docs:
         db.exec(delete(DocumentHistory).where(DocumentHistory.document_id == doc.id))
         db.exec(delete(DocumentImage).where(DocumentImage.document_id == doc.id))
         db.delete(doc)
 
-    # 3. Finalement, supprime l'utilisateur lui-même.
+    # 3. Finalement, supprime l'utilisateur lui-même (et signale la révocation aux autres workers).
     db.delete(current_user)
+    bump_scopes(db, AUTH_SCOPE)
     db.commit()
+
+    # 4. Invalide les caches : les tokens encore en circulation seront refusés ("User not found").
+    from app.utils.dependencies import invalidate_membership  # import local : dependencies importe ce module
+    invalidate_user(current_user.id)
+    for team_id in set(team_ids) | {t.id for t in owned_teams}:
+        invalidate_membership(team_id)
+    for doc_id in doc_ids:
+        forget_document(doc_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
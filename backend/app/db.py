@@ -50,4 +50,18 @@ def init_db():
     et crée les tables correspondantes si elles n'existent pas déjà.
     Elle est généralement appelée une seule fois au démarrage de l'application.
     """
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    SQLModel.metadata.create_all(engine)
+
+
+# BLOC DES INSERTIONS AVEC GESTION DES CONFLITS
+# `INSERT ... ON CONFLICT` n'est pas du SQL standard : la construction dépend du dialecte.
+def dialect_insert(dialect, table):
+    """
+    `insert(table)` du dialecte donné (`connection.dialect`), qui offre `on_conflict_do_nothing`
+    et `on_conflict_do_update`. SQLite, sinon la variante PostgreSQL.
+    """
+    if dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(table)
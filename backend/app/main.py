@@ -13,9 +13,15 @@ from app.routers.models import router as models_router
 from app.routers.teams import router as teams_router
 from app.routers.notifications import router as notification_router
 from app.routers.report import router as report_router # Renommé pour éviter conflit de nom
+from app.routers.monitoring import router as monitoring_router
+from app.routers.search import router as search_router
 # Imports des tâches planifiées
 from app.tasks.cleanup import start_scheduler as cleanup_scheduler
+from app.tasks.leader import start_leader_election, stop_leader_election
 from app.tasks.scheduler import start_scheduler as notif_scheduler
+from app.tasks.migrations import run_migrations_exclusive
+from app.utils.pdf_render import shutdown_pools as shutdown_pdf_pools
+from app.utils.pdf_import import shutdown_pool as shutdown_pdf_import_pool
 
 # ─── CONFIGURATION GLOBALE DU LOGGING ───────────────────────────────────
 # BLOC DE CONFIGURATION DU LOGGING
@@ -63,6 +69,8 @@ app.add_middleware(
   allow_methods=["*"], # Autorise toutes les méthodes HTTP (GET, POST, etc.)
   allow_headers=["*"], # Autorise tous les en-têtes
   allow_credentials=True, # Autorise l'envoi de cookies (pour l'authentification)
+  # Nouveau token renvoyé après un changement de mot de passe ; en-têtes des téléchargements partiels.
+  expose_headers=["X-Access-Token", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
 # ─── ÉVÉNEMENTS DE DÉMARRAGE ─────────────────────────────────────────────
@@ -73,9 +81,19 @@ app.add_middleware(
 def on_startup():
     """Initialise la base de données et lance les tâches planifiées."""
     init_db() # Crée les tables de la BDD si elles n'existent pas.
-    cleanup_scheduler() # Démarre le planificateur pour les tâches de nettoyage.
-    notif_scheduler() # Démarre le planificateur pour les notifications.
-    logger.info("Database initialized and schedulers started.")
+    run_migrations_exclusive() # Met à niveau les données existantes (un worker à la fois, migrations idempotentes).
+    # Planificateurs de nettoyage et de notifications : démarrés uniquement dans le worker
+    # qui obtient le bail des tâches planifiées (un seul parmi les workers uvicorn).
+    start_leader_election([cleanup_scheduler, notif_scheduler])
+    logger.info("Database initialized and scheduler leader election started.")
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    """Libère le bail des tâches planifiées et arrête les workers de rendu et d'import PDF éventuellement démarrés."""
+    stop_leader_election()
+    shutdown_pdf_pools()
+    shutdown_pdf_import_pool()
 
 
 # ─── INCLUSION DES ROUTEURS ─────────────────────────────────────────────
@@ -93,4 +111,6 @@ app.include_router(templates.router)
 app.include_router(artifacts.router)
 app.include_router(notification_router)
 app.include_router(report_router)
-app.include_router(dashboard.router)
\ No newline at end of file
+app.include_router(dashboard.router)
+app.include_router(monitoring_router)
+app.include_router(search_router)
\ No newline at end of file
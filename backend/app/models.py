@@ -4,7 +4,7 @@ from typing import Optional, List, Dict, Any, Callable
 from uuid import uuid4
 
 from pydantic import BaseModel
-from sqlalchemy import Column, LargeBinary, UniqueConstraint, ForeignKey
+from sqlalchemy import Column, Index, LargeBinary, UniqueConstraint, ForeignKey, event
 from sqlalchemy.dialects.sqlite import JSON as SQLiteJSON
 from sqlalchemy.ext.mutable import MutableList
 from sqlmodel import Field, SQLModel, Relationship
@@ -27,6 +27,8 @@ class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True, unique=True, nullable=False)
     password_hash: str
+    # Incrémenté pour révoquer tous les tokens déjà émis (changement de mot de passe, suppression).
+    token_version: int = Field(default=0, nullable=False)
     role_id: Optional[int] = Field(foreign_key="role.id", default=None)
     role: Optional[Role] = Relationship(back_populates="users")
     owned_teams: List["Team"] = Relationship(back_populates="owner")
@@ -69,26 +71,60 @@ class TeamMembership(SQLModel, table=True):
 
 class DocumentBase(SQLModel): title: str; content: str
 class Document(DocumentBase, table=True):
+    # index de la pagination par curseur de la liste (team_id, updated_at DESC, id DESC)
+    __table_args__ = (Index("ix_document_team_id_updated_at_id", "team_id", "updated_at", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     version: int = Field(default=1)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     created_by: str
     team_id: int = Field(foreign_key="team.id", nullable=False, index=True)
+    size: int = Field(default=0)  # longueur du contenu (caractères), tenue à jour à l'écriture
     team: "Team" = Relationship(back_populates="documents")
+
+@event.listens_for(Document, "before_insert")
+@event.listens_for(Document, "before_update")
+def _document_size(mapper, connection, doc: Document) -> None:
+    # La liste des documents lit `size` au lieu de mesurer `content` à chaque requête.
+    doc.size = len(doc.content or "")
 class DocumentImage(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     document_id: int = Field(foreign_key="document.id", index=True)
     filename: str; mime_type: str = Field(default="image/png")
     data: bytes = Field(sa_column=Column(LargeBinary)) # Stockage binaire
+class DocumentImport(SQLModel, table=True):
+    """Import d'un PDF en arrière-plan (cf. `app.utils.pdf_import`) : une ligne par document, lisible par
+    n'importe quel worker de l'API. Un document dont l'import est actif ne peut être ni modifié ni supprimé."""
+    document_id: int = Field(foreign_key="document.id", primary_key=True)
+    team_id: int = Field(nullable=False)
+    status: str = "pending"; total_pages: int = 0; pages_done: int = 0; images: int = 0
+    error: Optional[str] = None
+    started_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
 class DocumentCreate(DocumentBase): pass
 class DocumentRead(DocumentBase):
     id: int; version: int; created_at: datetime; updated_at: datetime; created_by: str
     class Config: from_attributes = True
 class DocumentHistory(DocumentRead, table=True):
+    """Version archivée d'un document : copie complète (image clé) ou delta par rapport à la version
+    précédente (`content` vide, opérations dans `delta`). Voir `app.utils.doc_history`."""
     id: Optional[int] = Field(default=None, primary_key=True)
-    document_id: int = Field(foreign_key="document.id")
+    document_id: int = Field(foreign_key="document.id", index=True)
     changed_at: datetime = Field(default_factory=datetime.utcnow)
+    is_keyframe: bool = Field(default=True, nullable=False)
+    delta: Optional[str] = None
+class DocumentHistoryMeta(SQLModel):
+    """Métadonnées d'une version (liste de l'historique, sans le contenu)."""
+    version: int; title: str; created_at: datetime; updated_at: datetime; created_by: str; changed_at: datetime
+class DocumentVersionRead(DocumentHistoryMeta):
+    content: str
+class DocumentSummary(SQLModel):
+    """Ligne de la liste des documents : métadonnées et taille (en caractères), sans le contenu."""
+    id: int; title: str; version: int; created_at: datetime; updated_at: datetime; created_by: str; size: int
+class DocumentPage(SQLModel):
+    """Page de la liste des documents ; `next_cursor` est à renvoyer pour obtenir la page suivante."""
+    items: List[DocumentSummary]; next_cursor: Optional[str] = None
 
 # ─────── SCHÉMAS DE LECTURE (DTOs) PUBLICS ───────
 class UserRead(SQLModel):
@@ -142,6 +178,8 @@ class AIProject(AIProjectBase, table=True):
     artifacts: List["ModelArtifact"] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete-orphan", "single_parent": True})
     comments: List[Comment] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     notifications: List["Notification"] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
+    compliance_summaries: List["ProjectComplianceSummary"] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
+    storage_usage: Optional["StorageUsage"] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete-orphan", "uselist": False})
 
 class AIProjectCreate(AIProjectBase): pass
 class AIProjectRead(AIProjectBase):
@@ -157,9 +195,9 @@ class NonConformite(SQLModel, table=True):
     checklist_item_id: int = Field(foreign_key="iso42001checklistitem.id", nullable=False, index=True)
     question_index: int = Field(nullable=False, index=True)
     type_nc: TypeNonConformite = Field(nullable=False)
-    deadline_correction: Optional[datetime] = None
+    deadline_correction: Optional[datetime] = Field(default=None, index=True)
     statut: StatutNonConformite = Field(default=StatutNonConformite.non_corrigee)
-    created_at: datetime = Field(default_factory=datetime.utcnow); updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow); updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     checklist_item: "ISO42001ChecklistItem" = Relationship(back_populates="non_conformites")
     actions_correctives: List["ActionCorrective"] = Relationship(back_populates="non_conformite", sa_relationship_kwargs={"cascade": "all, delete-orphan", "single_parent": True})
 # ... (DTOs pour NonConformite)
@@ -173,7 +211,7 @@ class NonConformiteRead(BaseModel):
 class ISO42001ChecklistItem(SQLModel, table=True):
     """Table des items de la checklist de conformité, un par point de contrôle de la norme."""
     id: Optional[int] = Field(default=None, primary_key=True)
-    project_id: int = Field(foreign_key="aiproject.id")
+    project_id: int = Field(foreign_key="aiproject.id", index=True)
     control_id: str; control_name: str; description: str
     audit_questions: List[Dict[str, Any]] = Field(default_factory=list, sa_column=Column(SQLiteJSON))
     evidence_required: List[Dict[str, Any]] = Field(default_factory=list, sa_column=Column(SQLiteJSON))
@@ -187,6 +225,67 @@ class ISO42001ChecklistItem(SQLModel, table=True):
     actions_correctives: List["ActionCorrective"] = Relationship(back_populates="checklist_item", sa_relationship_kwargs={"cascade": "all, delete-orphan", "single_parent": True})
     non_conformites: List[NonConformite] = Relationship(back_populates="checklist_item", sa_relationship_kwargs={"cascade": "all, delete-orphan", "single_parent": True})
 
+class DataVersion(SQLModel, table=True):
+    """Compteur de version par périmètre ("project:<id>", "team:<id>"), incrémenté à chaque écriture
+    sur les données du périmètre. Sert de clé d'invalidation au cache de réponses."""
+    scope: str = Field(primary_key=True)
+    version: int = Field(default=0, nullable=False)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SchedulerLease(SQLModel, table=True):
+    """Bail de l'instance qui exécute les tâches planifiées (un seul processus à la fois, cf. `app.tasks.leader`)."""
+    name: str = Field(primary_key=True)
+    holder: str = Field(nullable=False)
+    expires_at: datetime = Field(nullable=False)
+    acquired_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ReportJob(SQLModel, table=True):
+    """Génération d'un rapport PDF en arrière-plan (cf. `app.utils.report_jobs`) : l'état est en base,
+    lisible par n'importe quel worker de l'API, pas seulement celui qui exécute la tâche."""
+    id: str = Field(primary_key=True)
+    team_id: int = Field(nullable=False); project_id: int = Field(nullable=False, index=True)
+    version_key: str = Field(nullable=False, index=True)
+    status: str = "pending"; stage: str = "queued"; progress: int = 0
+    error: Optional[str] = None; data_hash: Optional[str] = None; cached: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+class ProjectComplianceSummary(SQLModel, table=True):
+    """Résumé matérialisé de la conformité : une ligne par item de checklist (point de contrôle),
+    maintenue dans la même transaction que les réponses et les non-conformités. Le tableau de bord
+    et les rapports lisent ces compteurs au lieu de reparcourir les `results` de chaque item."""
+    __table_args__ = (UniqueConstraint("checklist_item_id", name="uq_summary_item"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    project_id: int = Field(foreign_key="aiproject.id", nullable=False, index=True)
+    checklist_item_id: int = Field(foreign_key="iso42001checklistitem.id", nullable=False)
+    control_id: str
+    total: int = 0; compliant: int = 0; not_compliant: int = 0; not_assessed: int = 0
+    open_nc: int = 0; major_open_nc: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    project: AIProject = Relationship(back_populates="compliance_summaries")
+
+class StorageUsage(SQLModel, table=True):
+    """Registre de l'espace occupé par un projet (octets par catégorie et nombre de runs), mis à jour
+    par incréments à chaque écriture et recalé périodiquement sur le disque (cf. `app.utils.storage_usage`)."""
+    project_id: int = Field(foreign_key="aiproject.id", primary_key=True)
+    team_id: int = Field(foreign_key="team.id", nullable=False, index=True)
+    models_bytes: int = 0; data_bytes: int = 0; logs_bytes: int = 0; blob_bytes: int = 0
+    run_count: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    reconciled_at: Optional[datetime] = None
+    project: AIProject = Relationship(back_populates="storage_usage")
+
+class ProjectUsageRead(SQLModel):
+    project_id: int; title: str
+    models_bytes: int; data_bytes: int; logs_bytes: int; blob_bytes: int; total_bytes: int
+    run_count: int; quota_bytes: Optional[int]; run_quota: int
+    reconciled_at: Optional[datetime]
+
+class TeamUsageRead(SQLModel):
+    team_id: int; total_bytes: int; run_count: int
+    projects: List[ProjectUsageRead]
+
 class Proof(SQLModel, table=True):
     """Table des preuves (fichiers) uploadées pour un item de checklist."""
     __table_args__ = (UniqueConstraint("checklist_item_id", "evidence_id", "filename", name="uq_item_evidence_file"),)
@@ -223,10 +322,19 @@ class Notification(SQLModel, table=True):
     non_conformite: Optional["NonConformite"] = Relationship()
 
 #----------MODÈLES MLOPS (RUNS, DATASETS, ARTÉFACTS)-------------
+class CodeSnapshot(SQLModel, table=True):
+    """Version immuable du code d'un modèle : manifeste {chemin relatif: empreinte SHA-256 du fichier}.
+    L'id est l'empreinte du manifeste : un code inchangé donne le même instantané (cf. `app.utils.code_snapshots`)."""
+    id: str = Field(primary_key=True)
+    manifest: Dict[str, str] = Field(default_factory=dict, sa_column=Column(SQLiteJSON))
+    file_count: int = 0; size_bytes: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class ModelRun(SQLModel, table=True):
     """Table pour tracer un entraînement de modèle (un "run")."""
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="aiproject.id", index=True)
+    snapshot_id: Optional[str] = Field(default=None, foreign_key="codesnapshot.id", index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow); started_at: Optional[datetime] = None; finished_at: Optional[datetime] = None
     status: str; logs: Optional[str] = None
     project: AIProject = Relationship(back_populates="model_runs")
@@ -266,11 +374,13 @@ class EvaluationRun(SQLModel, table=True):
     project: "AIProject" = Relationship(back_populates="evaluation_runs")
 
 class ModelArtifact(SQLModel, table=True):
-    """Table des artéfacts produits par un run, typiquement le fichier du modèle entraîné."""
+    """Table des artéfacts produits par un run, typiquement le fichier du modèle entraîné.
+    `sha256` : empreinte du fichier, stocké sous ce nom dans le magasin d'artéfacts (cf. `app.utils.artifacts`)."""
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(foreign_key="aiproject.id", index=True)
     model_run_id: int = Field(foreign_key="modelrun.id")
     path: str; format: str; size_bytes: int; created_at: datetime = Field(default_factory=datetime.utcnow)
+    sha256: Optional[str] = Field(default=None, index=True)
     metrics: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(SQLiteJSON))
     project: "AIProject" = Relationship(back_populates="artifacts")
     run: "ModelRun" = Relationship(back_populates="artifacts")
\ No newline at end of file
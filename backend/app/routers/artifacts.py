@@ -1,34 +1,28 @@
 # app/routers/artifacts.py
 from __future__ import annotations
 
+import os
 from pathlib import Path
-from typing import List
+from typing import Iterator, List
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlmodel import Session, select
 
 from app.auth import User, get_current_user
-from app.models import AIProject, ModelArtifact, TeamMembership
-from app.utils.dependencies import get_session
-
-# ───────────────────────── helpers ──────────────────────────────────────────
-
-def _assert_member(sess: Session, team_id: int, user: User) -> None:
-    # BLOC DE VÉRIFICATION D'APPARTENANCE
-    # Cette fonction sert de garde de sécurité. Elle vérifie si l'utilisateur
-    # courant est bien un membre dont l'invitation à l'équipe a été acceptée.
-    # Si la recherche en base de données ne retourne aucun résultat,
-    # une erreur 403 (Accès Interdit) est levée, stoppant l'exécution.
-    mem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == user.id,
-            TeamMembership.accepted_at.is_not(None),
-        )
-    ).first()
-    if not mem:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+from app.models import AIProject, ModelArtifact
+from app.utils.artifacts import ARTIFACT_STORE, artifact_filename, project_dir
+from app.utils.cache import not_modified
+from app.utils.dependencies import get_session, assert_member
+
+try:
+    import zstandard  # compression optionnelle des téléchargements (Accept-Encoding: zstd)
+except ImportError:
+    zstandard = None
+
+# Taille à partir de laquelle un artéfact est compressé pour un client qui accepte zstd.
+ARTIFACT_ZSTD_MIN_SIZE = int(os.getenv("ARTIFACT_ZSTD_MIN_SIZE", str(1024 * 1024)))
+ARTIFACT_ZSTD_LEVEL = int(os.getenv("ARTIFACT_ZSTD_LEVEL", "3"))
 
 # ───────────────────────── Router ───────────────────────────────────────────
 
@@ -53,7 +47,7 @@ def list_artifacts(
 ):
     # BLOC DE LOGIQUE POUR LISTER LES ARTEFACTS
     # 1. Sécurité : On vérifie d'abord que l'utilisateur a le droit d'accéder à l'équipe.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
 
     # 2. Validation : On s'assure que le projet demandé existe et qu'il appartient bien
     #    à l'équipe spécifiée dans l'URL. C'est pour éviter qu'un utilisateur n'accède
@@ -70,11 +64,30 @@ def list_artifacts(
 
 # ═════════════════════ Télécharger un artefact ═════════════════════════════
 
+def _accepts_zstd(request: Request) -> bool:
+    for token in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = token.partition(";")
+        if name.strip().lower() == "zstd":
+            q = params.strip().removeprefix("q=")
+            try:
+                return not params.strip() or float(q) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def _zstd_chunks(path: Path) -> Iterator[bytes]:
+    compressor = zstandard.ZstdCompressor(level=ARTIFACT_ZSTD_LEVEL)
+    with path.open("rb") as f:
+        yield from compressor.read_to_iter(f, read_size=1024 * 1024)
+
+
 @router.get("/{artifact_id}", response_class=FileResponse)
 def download_artifact(
     team_id: int,
     project_id: int,
     artifact_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
     sess: Session = Depends(get_session),
 ):
@@ -82,7 +95,7 @@ def download_artifact(
     # 1. Sécurité et Validation : Comme pour la liste, on vérifie l'appartenance
     #    à l'équipe, puis on s'assure que l'artefact demandé existe et qu'il
     #    appartient bien au bon projet.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
     art = sess.get(ModelArtifact, artifact_id)
     if not art or art.project_id != project_id:
         raise HTTPException(404, "Artefact introuvable")
@@ -95,21 +108,36 @@ def download_artifact(
 
     # 3. Sécurité Fichier : C'est une vérification cruciale contre les attaques de
     #    type "Path Traversal". On s'assure que le chemin du fichier demandé se
-    #    trouve bien dans le dossier de stockage attendu pour ce projet. Cela empêche
-    #    de télécharger des fichiers système sensibles.
-    base_dir = (
-        Path(__file__).resolve().parents[2]
-        / "storage"
-        / "models"
-        / f"project_{project_id}"
-    )
-    if base_dir not in file_path.resolve().parents:
+    #    trouve bien dans le dossier de stockage attendu pour ce projet (ou dans le
+    #    magasin d'artéfacts). Cela empêche de télécharger des fichiers système sensibles.
+    parents = file_path.resolve().parents
+    if project_dir(project_id).resolve() not in parents and ARTIFACT_STORE.resolve() not in parents:
         raise HTTPException(403, "Accès interdit")
 
-    # 4. Action : Si toutes les vérifications passent, on retourne le fichier
-    #    en utilisant FileResponse, ce qui permet un téléchargement efficace.
+    # 4. Action : L'empreinte SHA-256 sert d'ETag (304 si le client a déjà le fichier).
+    #    FileResponse gère les requêtes partielles (Range / If-Range) : un téléchargement
+    #    interrompu reprend où il s'est arrêté. Un client qui accepte zstd reçoit les gros
+    #    fichiers compressés à la volée (réponse complète uniquement, sans Range).
+    filename = artifact_filename(art)
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    compress = (
+        zstandard is not None and "range" not in request.headers and _accepts_zstd(request)
+        and art.size_bytes >= ARTIFACT_ZSTD_MIN_SIZE
+    )
+    if art.sha256:
+        # Une représentation compressée est une autre représentation : ETag distinct.
+        headers["ETag"] = f'"{art.sha256}.zst"' if compress else f'"{art.sha256}"'
+        if not_modified(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    if compress:
+        return StreamingResponse(
+            _zstd_chunks(file_path), media_type="application/octet-stream",
+            headers={**headers, "Content-Encoding": "zstd",
+                     "Content-Disposition": f'attachment; filename="{filename}"'},
+        )
     return FileResponse(
         path=str(file_path),
         media_type="application/octet-stream",
-        filename=file_path.name,
+        filename=filename,
+        headers=headers,
     )
\ No newline at end of file
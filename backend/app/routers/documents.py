@@ -1,9 +1,10 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, timezone
 from io import BytesIO
-from typing import List, Dict
-import io, uuid
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import List, Dict, Optional, Tuple
+import base64, io, os, tempfile, uuid
 
 from PIL import Image
 from fastapi import (
@@ -15,8 +16,13 @@ from fastapi import (
     status,
     Response,
     Form,
+    Query,
+    Request,
 )
-from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import and_, or_
 from sqlmodel import Session, select, delete
 
 from app.db import SessionLocal
@@ -25,34 +31,42 @@ from app.models import (
     DocumentCreate,
     DocumentRead,
     DocumentHistory,
+    DocumentHistoryMeta,
     DocumentImage,
-    TeamMembership,
+    DocumentImport,
+    DocumentPage,
+    DocumentSummary,
+    DocumentVersionRead,
 )
 from app.auth import get_current_user, User
+from app.utils.cache import not_modified
+from app.utils.dependencies import assert_member
+from app.utils.doc_history import forget_document, record_version, version_content
 # Fonctions utilitaires pour la conversion de PDF
-from app.utils.pdf import pdf_to_markdown_and_images, markdown_to_pdf
+from app.utils.pdf import markdown_to_pdf
+from app.utils.pdf_import import (
+    PDF_IMPORT_MAX_BYTES,
+    count_pages,
+    get_import_job,
+    import_active,
+    import_state,
+    submit_pdf_import,
+)
 
 # BLOC 1 : CONFIGURATION ET FONCTIONS D'AIDE (HELPERS)
 # Initialisation du router avec un préfixe commun et un tag pour la documentation.
 router = APIRouter(prefix="/teams/{team_id}/documents", tags=["team-documents"])
 
-def _assert_member(sess: Session, team_id: int, user: User):
-    """Helper de sécurité : Vérifie que l'utilisateur courant est un membre actif de l'équipe."""
-    mem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == user.id,
-            TeamMembership.accepted_at.is_not(None), # L'invitation doit être acceptée
-        )
-    ).first()
-    if not mem:
-        raise HTTPException(status_code=403, detail="Accès interdit à cette équipe")
-
 def _assert_doc_team(doc: Document, team_id: int):
     """Helper de validation : Vérifie que le document appartient bien à l'équipe spécifiée dans l'URL."""
     if doc.team_id != team_id:
         raise HTTPException(status_code=404, detail="Document not found")
 
+def _assert_no_import(sess: Session, doc_id: int):
+    """Helper de validation : refuse la modification d'un document dont l'import PDF est en cours."""
+    if import_active(sess, doc_id):
+        raise HTTPException(status.HTTP_409_CONFLICT, "Import PDF en cours : document non modifiable")
+
 # ───────────────────────── CRUD : Création de Documents ───────────────────────────
 
 @router.post("/", response_model=DocumentRead, status_code=status.HTTP_201_CREATED)
@@ -67,7 +81,7 @@ def create_document(
     # 2. Crée l'objet `Document` en base de données.
     # 3. Crée une première entrée dans la table `DocumentHistory` pour sauvegarder la version initiale.
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
+        assert_member(sess, team_id, current_user, fresh=True)
         doc = Document(
             title=payload.title, content=payload.content,
             created_by=current_user.username, team_id=team_id,
@@ -76,95 +90,198 @@ def create_document(
         sess.commit()
         sess.refresh(doc)
 
-        sess.add(DocumentHistory(
-            document_id=doc.id, title=doc.title, content=doc.content,
-            version=doc.version, created_at=doc.created_at,
-            updated_at=doc.updated_at, created_by=doc.created_by,
-        ))
+        record_version(sess, doc)
         sess.commit()
         return DocumentRead.from_orm(doc)
 
-@router.post("/upload-pdf", response_model=DocumentRead, status_code=status.HTTP_201_CREATED)
+@router.post("/upload-pdf", response_model=DocumentRead, status_code=status.HTTP_202_ACCEPTED)
 async def upload_pdf(
     team_id: int,
     file: UploadFile = File(...), # Création à partir d'un fichier uploadé
     current_user: User = Depends(get_current_user),
 ):
     # BLOC DE CRÉATION DE DOCUMENT PAR IMPORT PDF
-    # Cette route plus complexe gère l'upload d'un fichier PDF.
-    # 1. Valide le type de fichier.
-    # 2. Lit le contenu du PDF et le convertit en Markdown grâce à l'utilitaire `pdf_to_markdown_and_images`.
-    #    Cette fonction extrait également les images et les sauvegarde dans la table `DocumentImage`.
-    # 3. Crée le document et sa première entrée d'historique.
+    # Cette route gère l'upload d'un fichier PDF ; la conversion se fait en arrière-plan.
+    # 1. Valide le type de fichier puis l'enregistre dans un fichier temporaire (par blocs, 413 au-delà
+    #    de PDF_IMPORT_MAX_MB).
+    # 2. Vérifie que le PDF est lisible et compte ses pages.
+    # 3. Crée le document (vide) et lance la tâche d'import (`pdf_import`) : le texte et les images
+    #    des pages sont ajoutés au fur et à mesure, l'historique est créé à la fin de l'import.
+    # 4. Retourne le document tout de suite (202) ; la progression se lit sur `GET /{doc_id}/import`.
     if file.content_type != "application/pdf":
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Only PDF uploads supported")
-    pdf_bytes = await file.read()
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
+        assert_member(sess, team_id, current_user, fresh=True)
+
+    fd, pdf_path = tempfile.mkstemp(prefix="smia-import-", suffix=".pdf")
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(1024 * 1024):
+                size += len(chunk)
+                if size > PDF_IMPORT_MAX_BYTES:
+                    raise HTTPException(413, f"PDF trop volumineux (max {PDF_IMPORT_MAX_BYTES // 2**20} MiB)")
+                out.write(chunk)
+        total_pages = await run_in_threadpool(count_pages, pdf_path)
+    except ValueError:
+        os.remove(pdf_path)
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid PDF file")
+    except Exception:
+        os.remove(pdf_path)
+        raise
+
+    with SessionLocal() as sess:
         doc = Document(
             title=file.filename, content="",
             created_by=current_user.username, team_id=team_id,
         )
         sess.add(doc)
-        sess.flush()  # `flush` permet d'obtenir doc.id avant le commit final
-
-        doc.content = pdf_to_markdown_and_images(pdf_bytes, sess, doc)
         sess.commit()
         sess.refresh(doc)
-        sess.add(DocumentHistory(
-            document_id=doc.id, title=doc.title, content=doc.content,
-            version=doc.version, created_at=doc.created_at,
-            updated_at=doc.updated_at, created_by=doc.created_by,
-        ))
-        sess.commit()
+        # Le fichier temporaire appartient désormais à la tâche, qui le supprime à la fin.
+        submit_pdf_import(sess, doc, pdf_path, total_pages)
         return DocumentRead.from_orm(doc)
 
+
+@router.get("/{doc_id}/import")
+def pdf_import_status(
+    team_id: int,
+    doc_id: int,
+    current_user: User = Depends(get_current_user),
+):
+    # BLOC DE SUIVI D'UN IMPORT PDF
+    # Retourne l'état de la tâche d'import (pages traitées, images distinctes, erreur éventuelle),
+    # lu en base : l'import peut s'exécuter dans un autre worker.
+    with SessionLocal() as sess:
+        assert_member(sess, team_id, current_user)
+    job = get_import_job(doc_id)
+    if not job or job.team_id != team_id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Aucun import pour ce document")
+    return import_state(job)
+
 # ─────────────────── CRUD : Lecture de Documents et Images ─────────────────────
 
-@router.get("/", response_model=List[DocumentRead])
+def _encode_cursor(updated_at: datetime, doc_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{doc_id}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, doc_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(updated_at), int(doc_id)
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Curseur invalide")
+
+
+def _document_validators(doc_id: int, version: int, updated_at: datetime) -> Dict[str, str]:
+    # La version change à chaque modification ; `updated_at` couvre aussi le remplissage
+    # progressif d'un document pendant un import PDF (même version).
+    etag = f'"doc-{doc_id}-v{version}-{int(updated_at.timestamp() * 1000)}"'
+    return {
+        "ETag": etag,
+        "Last-Modified": format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+
+
+def _not_modified_since(request: Request, updated_at: datetime) -> bool:
+    # `If-Modified-Since` n'est consulté qu'en l'absence de `If-None-Match` (RFC 9110).
+    ims = request.headers.get("if-modified-since")
+    if not ims or request.headers.get("if-none-match"):
+        return False
+    try:
+        since = parsedate_to_datetime(ims)
+    except (TypeError, ValueError):
+        return False
+    return updated_at.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+
+@router.get("/", response_model=DocumentPage)
 def list_documents(
     team_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, gt=0, le=200),
     current_user: User = Depends(get_current_user),
 ):
     # BLOC DE LISTAGE DES DOCUMENTS
-    # Récupère et retourne la liste de tous les documents appartenant à l'équipe.
+    # Retourne les documents de l'équipe, du plus récemment modifié au plus ancien, sans leur contenu :
+    # la taille de la réponse ne dépend plus du volume des documents.
+    # La pagination se fait par curseur (updated_at, id) : `next_cursor` est absent sur la dernière page.
+    # Index (team_id, updated_at, id) ; la taille vient de la colonne `size`, le contenu n'est jamais lu.
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
-        docs = sess.exec(select(Document).where(Document.team_id == team_id)).all()
-        return [DocumentRead.from_orm(d) for d in docs]
+        assert_member(sess, team_id, current_user)
+        query = (
+            select(
+                Document.id, Document.title, Document.version, Document.created_at,
+                Document.updated_at, Document.created_by, Document.size,
+            )
+            .where(Document.team_id == team_id)
+            .order_by(Document.updated_at.desc(), Document.id.desc())
+            .limit(limit + 1)
+        )
+        if cursor:
+            after_updated_at, after_id = _decode_cursor(cursor)
+            query = query.where(or_(
+                Document.updated_at < after_updated_at,
+                and_(Document.updated_at == after_updated_at, Document.id < after_id),
+            ))
+        rows = sess.exec(query).all()
+    items = [DocumentSummary(**r._mapping) for r in rows[:limit]]
+    next_cursor = _encode_cursor(items[-1].updated_at, items[-1].id) if len(rows) > limit else None
+    return DocumentPage(items=items, next_cursor=next_cursor)
 
 @router.get("/{doc_id}", response_model=DocumentRead)
 def read_document(
     team_id: int,
     doc_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
 ):
     # BLOC DE LECTURE D'UN DOCUMENT SPÉCIFIQUE
     # Récupère un document par son ID, après avoir vérifié les droits d'accès.
+    # La réponse porte un ETag et un Last-Modified : un client à jour reçoit un 304 et
+    # le contenu n'est même pas lu en base.
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
-        doc = sess.get(Document, doc_id)
-        if not doc:
+        assert_member(sess, team_id, current_user)
+        meta = sess.exec(
+            select(Document.team_id, Document.version, Document.updated_at).where(Document.id == doc_id)
+        ).first()
+        if not meta or meta.team_id != team_id: # le doc doit appartenir à l'équipe (cf. `_assert_doc_team`)
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Document not found")
-        _assert_doc_team(doc, team_id) # Vérifie que le doc appartient bien à l'équipe
-        return DocumentRead.from_orm(doc)
+        headers = _document_validators(doc_id, meta.version, meta.updated_at)
+        if not_modified(request, headers["ETag"]) or _not_modified_since(request, meta.updated_at):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        doc = sess.get(Document, doc_id)
+        return JSONResponse(jsonable_encoder(DocumentRead.from_orm(doc)), headers=headers)
 
 @router.get("/{doc_id}/images/{img_id}")
 def get_image(
     team_id: int,
     doc_id: int,
     img_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user),
 ):
     # BLOC DE RÉCUPÉRATION D'IMAGE
     # Cette route sert à afficher les images qui ont été extraites des PDF.
     # Elle retourne directement les données binaires de l'image avec le bon type MIME.
+    # Une image n'est jamais modifiée après son insertion : son ETag ne dépend que de son id,
+    # et le navigateur peut la garder en cache (revalidation par 304 sans relire les données).
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
-        img = sess.get(DocumentImage, img_id)
-        if not img or img.document_id != doc_id:
+        assert_member(sess, team_id, current_user)
+        meta = sess.exec(
+            select(DocumentImage.mime_type, Document.team_id)
+            .join(Document, Document.id == DocumentImage.document_id)
+            .where(DocumentImage.id == img_id, DocumentImage.document_id == doc_id)
+        ).first()
+        if not meta or meta.team_id != team_id:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Image not found")
-        return Response(content=img.data, media_type=img.mime_type)
+        headers = {"ETag": f'"img-{img_id}"', "Cache-Control": "private, max-age=86400"}
+        if not_modified(request, headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        data = sess.exec(select(DocumentImage.data).where(DocumentImage.id == img_id)).one()
+        return Response(content=data, media_type=meta.mime_type, headers=headers)
 
 # ─────────────────── CRUD : Mise à Jour, Suppression et Autres Actions ───────────────────
 
@@ -183,7 +300,7 @@ def download_pdf(
     #    entièrement en mémoire. Le header `Content-Disposition` indique au navigateur
     #    de proposer le téléchargement du fichier avec un nom approprié.
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
+        assert_member(sess, team_id, current_user)
         doc = sess.get(Document, doc_id)
         if not doc:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Document not found")
@@ -210,48 +327,84 @@ def update_document(
     # 1. Vérifie les droits et récupère le document.
     # 2. Applique les modifications du `payload`.
     # 3. Incrémente le numéro de version du document.
-    # 4. Crée une nouvelle entrée dans `DocumentHistory` pour archiver cette nouvelle version.
+    # 4. Archive cette nouvelle version dans `DocumentHistory` (delta ou image clé, cf. `doc_history`).
+    # Refusée (409) pendant un import PDF : l'import réécrit le contenu après chaque tranche.
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
+        assert_member(sess, team_id, current_user, fresh=True)
         doc = sess.get(Document, doc_id)
         if not doc:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Not found")
         _assert_doc_team(doc, team_id)
+        _assert_no_import(sess, doc_id)
 
+        previous_content = doc.content
         doc.title = payload.title
         doc.content = payload.content
         doc.version += 1
         doc.updated_at = datetime.utcnow()
         sess.add(doc)
+        # La version et son entrée d'historique (delta par rapport au contenu précédent)
+        # sont enregistrées dans la même transaction.
+        record_version(sess, doc, previous_content)
         sess.commit()
         sess.refresh(doc)
-
-        sess.add(DocumentHistory(
-            document_id=doc.id, title=doc.title, content=doc.content,
-            version=doc.version, created_at=doc.created_at,
-            updated_at=doc.updated_at, created_by=doc.created_by,
-        ))
-        sess.commit()
         return DocumentRead.from_orm(doc)
 
 
-@router.get("/{doc_id}/history", response_model=List[DocumentHistory])
+_HISTORY_META = (
+    DocumentHistory.version, DocumentHistory.title, DocumentHistory.created_at,
+    DocumentHistory.updated_at, DocumentHistory.created_by, DocumentHistory.changed_at,
+)
+
+
+@router.get("/{doc_id}/history", response_model=List[DocumentHistoryMeta])
 def history_document(
     team_id: int,
     doc_id: int,
     current_user: User = Depends(get_current_user),
 ):
     # BLOC DE LECTURE DE L'HISTORIQUE D'UN DOCUMENT
-    # Récupère toutes les versions archivées d'un document depuis la table
-    # `DocumentHistory`, ordonnées par numéro de version.
+    # Liste les versions archivées d'un document, ordonnées par numéro de version.
+    # Seules les métadonnées sont lues : le contenu d'une version s'obtient via `.../history/{version}`.
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
+        assert_member(sess, team_id, current_user)
+        doc = sess.get(Document, doc_id)
+        if not doc:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Not found")
+        _assert_doc_team(doc, team_id)
         rows = sess.exec(
-            select(DocumentHistory)
+            select(*_HISTORY_META)
             .where(DocumentHistory.document_id == doc_id)
             .order_by(DocumentHistory.version)
         ).all()
-        return [DocumentHistory.from_orm(r) for r in rows]
+        return [DocumentHistoryMeta(**r._mapping) for r in rows]
+
+
+@router.get("/{doc_id}/history/{version}", response_model=DocumentVersionRead)
+def read_document_version(
+    team_id: int,
+    doc_id: int,
+    version: int,
+    current_user: User = Depends(get_current_user),
+):
+    # BLOC DE LECTURE D'UNE VERSION ARCHIVÉE
+    # Reconstruit le contenu de la version demandée à partir de l'image clé la plus proche
+    # et des deltas suivants (les versions récemment lues restent en cache).
+    with SessionLocal() as sess:
+        assert_member(sess, team_id, current_user)
+        doc = sess.get(Document, doc_id)
+        if not doc:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Not found")
+        _assert_doc_team(doc, team_id)
+        meta = sess.exec(
+            select(*_HISTORY_META)
+            .where(DocumentHistory.document_id == doc_id, DocumentHistory.version == version)
+            .order_by(DocumentHistory.id.desc())
+        ).first()
+        content = version_content(sess, doc, version) if meta else None
+        if content is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Version not found")
+        return DocumentVersionRead(**meta._mapping, content=content)
 
 
 @router.delete("/{doc_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -268,17 +421,21 @@ def delete_document(
     #    - Supprime toutes les images associées.
     #    - Supprime le document lui-même.
     # 3. Retourne une réponse 204 (No Content), pratique standard pour un DELETE réussi.
+    # Refusée (409) pendant un import PDF.
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
+        assert_member(sess, team_id, current_user, fresh=True)
         doc = sess.get(Document, doc_id)
         if not doc:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Not found")
         _assert_doc_team(doc, team_id)
+        _assert_no_import(sess, doc_id)
 
         sess.exec(delete(DocumentHistory).where(DocumentHistory.document_id == doc_id))
         sess.exec(delete(DocumentImage).where(DocumentImage.document_id == doc_id))
+        sess.exec(delete(DocumentImport).where(DocumentImport.document_id == doc_id))
         sess.delete(doc)
         sess.commit()
+    forget_document(doc_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -312,7 +469,7 @@ async def upload_document_image(
         filename = f"{uuid.uuid4().hex}.png"
 
     with SessionLocal() as sess:
-        _assert_member(sess, team_id, current_user)
+        assert_member(sess, team_id, current_user, fresh=True)
         doc = sess.get(Document, doc_id)
         if not doc:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Document not found")
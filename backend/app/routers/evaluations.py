@@ -3,7 +3,9 @@ from __future__ import annotations
 import asyncio
 import json as js
 import queue
+import shutil
 import subprocess
+import tempfile
 from datetime import datetime
 from pathlib import Path
 from typing import List
@@ -26,29 +28,19 @@ from app.auth import User, get_current_user
 from app.db import SessionLocal
 from app.models import (
     AIProject,
+    CodeSnapshot,
     DataConfig,
     DataSet,
     EvaluationRun,
     ModelArtifact,
     ModelRun,
-    TeamMembership,
 )
-from app.utils.dependencies import get_session, assert_owner
+from app.utils.artifacts import artifact_filename, project_dir
+from app.utils.code_snapshots import materialize
+from app.utils.dependencies import get_session, Membership, require_manager, team_membership, assert_member
 
 # ───────────────────────── Helpers & Configuration Globale ───────────────────────────────────
 
-def _assert_member(sess: Session, team_id: int, user: User) -> None:
-    """Helper de sécurité : 403 si l’utilisateur n’est pas un membre actif de l'équipe."""
-    mem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == user.id,
-            TeamMembership.accepted_at.is_not(None),
-        )
-    ).first()
-    if not mem:
-        raise HTTPException(403, "Accès interdit à cette équipe")
-
 def to_docker_path(p: Path) -> str:
     """Helper de compatibilité : Convertit un chemin de fichier Windows (avec `\`)
     en un chemin compatible avec les systèmes Unix/Docker (avec `/`)."""
@@ -87,6 +79,7 @@ def launch_evaluation(
     payload: EvaluateRequest,
     background_tasks: BackgroundTasks, # Dépendance FastAPI pour exécuter des tâches après avoir envoyé la réponse.
     current_user: User = Depends(get_current_user),
+    membership: Membership = Depends(team_membership),
     sess: Session = Depends(get_session),
 ):
     # BLOC DE LANCEMENT D'UNE ÉVALUATION ASYNCHRONE
@@ -98,8 +91,8 @@ def launch_evaluation(
     #    que le client pourra utiliser pour suivre l'avancement.
 
     # 1. Contrôles de sécurité et de propriété
-    _assert_member(sess, team_id, current_user)
-    assert_owner(sess, project_id, current_user, team_id)
+    #    (appartenance résolue une seule fois par la dépendance `team_membership`, rôle compris)
+    require_manager(membership)
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
@@ -204,25 +197,45 @@ def _do_evaluation(
             eval_log_channels.pop(eval_id, None)
             return
 
-        model_dir = Path(art.path).parent.parent
+        model_dir = project_dir(project_id)
+        model_name = artifact_filename(art)
         ds = sess.get(DataSet, test_data_id)
         cfg = sess.get(DataConfig, data_config_id)
+        # Code de l'instantané du run évalué ; les runs antérieurs aux instantanés utilisent le dossier du projet.
+        train_run = sess.get(ModelRun, model_run_id)
+        snapshot = sess.get(CodeSnapshot, train_run.snapshot_id) if train_run and train_run.snapshot_id else None
+
+    output_dir = model_dir / "output"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    metrics_json = output_dir / "metrics.json"
+    work_dir = None
+    if snapshot:
+        # `evaluate.py` lit `config_data.json` et `ref_stats.csv` à côté de `config.yaml` : l'instantané
+        # étant en lecture seule, ces fichiers et une copie de `config.yaml` sont placés dans un dossier de travail.
+        code_dir = materialize(snapshot)
+        work_dir = Path(tempfile.mkdtemp(prefix=f"smia-eval-{eval_id}-"))
+        shutil.copyfile(code_dir / "config.yaml", work_dir / "config.yaml")
+        if (model_dir / "ref_stats.csv").exists():
+            shutil.copyfile(model_dir / "ref_stats.csv", work_dir / "ref_stats.csv")
+        mounts = ["-v", f"{to_docker_path(code_dir)}:/code:ro", "-v", f"{to_docker_path(work_dir)}:/work"]
+        config_arg, cd_path = "/work/config.yaml", work_dir / "config_data.json"
+    else:
+        mounts = ["-v", f"{to_docker_path(model_dir)}:/code"]
+        config_arg, cd_path = "/code/config.yaml", model_dir / "config_data.json"
+    # Le modèle évalué est le fichier de l'artéfact du run (et non le dernier modèle écrit dans le projet).
+    mounts += ["-v", f"{to_docker_path(Path(art.path))}:/model/{model_name}:ro"]
 
     cfg_data = {"features": cfg.features, "sensitive_attrs": cfg.sensitive_attrs}
-    cd_path = model_dir / "config_data.json"
     cd_path.write_text(js.dumps(cfg_data, indent=2), encoding="utf-8")
     push(f"Config data dumped → {cd_path.name}")
 
     # 3. Construction de la commande Docker
-    output_dir = model_dir / "output"
-    metrics_json = output_dir / "metrics.json"
-
     host_app_dir = Path(__file__).resolve().parents[2]
     cmd = [
         "docker", "run", "--rm", "--cpus=2.0", "--memory=4g", "--network=none",
         "--entrypoint", "/bin/sh",
         "-v", f"{to_docker_path(host_app_dir)}:/app",
-        "-v", f"{to_docker_path(model_dir)}:/code",
+        *mounts,
         "-v", f"{to_docker_path(Path(ds.path))}:/data/test.csv",
         "-v", f"{to_docker_path(output_dir)}:/output",
         "smia-runtime:latest",
@@ -230,9 +243,9 @@ def _do_evaluation(
         (
             "pip install --no-cache-dir -r /code/requirements.txt && "
             "python /code/evaluate.py "
-            "--model  /code/output/model.pt "
+            f"--model  /model/{model_name} "
             "--test   /data/test.csv "
-            "--config /code/config.yaml "
+            f"--config {config_arg} "
             "--out    /output"
         ),
     ]
@@ -253,6 +266,8 @@ def _do_evaluation(
         exit_code = -1
 
     push(f"Docker exited with code {exit_code}")
+    if work_dir is not None:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
     # 5. Gestion des résultats (échec)
     if exit_code != 0 or not metrics_json.exists():
@@ -322,7 +337,7 @@ def list_evaluations(
     # BLOC LISTAGE DES ÉVALUATIONS
     # Route standard pour lister toutes les évaluations (passées et en cours)
     # d'un projet, après avoir vérifié que l'utilisateur est bien membre de l'équipe.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
     return sess.exec(
         select(EvaluationRun).where(EvaluationRun.project_id == project_id)
     ).all()
@@ -339,7 +354,7 @@ def get_evaluation(
     # BLOC LECTURE D'UNE ÉVALUATION
     # Route standard pour récupérer les détails complets (statut, logs, métriques)
     # d'une seule évaluation par son ID.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
     er = sess.get(EvaluationRun, eval_id)
     if not er or er.project_id != project_id:
         raise HTTPException(404, "Évaluation non trouvée")
@@ -362,9 +377,8 @@ def get_evaluation_plot(
     # BLOC RÉCUPÉRATION DES GRAPHIQUES
     # Permet de télécharger un fichier image (un graphique, ex: matrice de confusion)
     # qui a été généré par le script d'évaluation dans le conteneur Docker.
-    # La logique consiste à retrouver le chemin de l'artéfact du modèle pour
-    # en déduire le chemin du dossier `output` où les graphiques sont stockés.
-    _assert_member(sess, team_id, current_user)
+    # Les graphiques sont écrits dans le dossier `output` du projet par le script d'évaluation.
+    assert_member(sess, team_id, current_user)
     er = sess.get(EvaluationRun, eval_id)
     if not er or er.project_id != project_id:
         raise HTTPException(404, "Évaluation non trouvée")
@@ -377,7 +391,7 @@ def get_evaluation_plot(
     if not art:
         raise HTTPException(404, "Artifact introuvable pour cette évaluation")
 
-    host_plot = Path(art.path).parent.parent / "output" / f"{plot_name}.png"
+    host_plot = project_dir(project_id) / "output" / f"{plot_name}.png"
     if not host_plot.exists():
         raise HTTPException(404, "Plot introuvable")
 
@@ -406,7 +420,7 @@ async def stream_eval_logs(
     #    dans la file (`q.get`). Dès qu'un message arrive (poussé par `_do_evaluation`),
     #    il l'envoie au client.
     # 3. `EventSourceResponse` gère le protocole SSE pour cette communication temps réel.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
 
     q = eval_log_channels.get(eval_id)
     if q is None:
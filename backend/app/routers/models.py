@@ -1,13 +1,17 @@
 # app/routers/models.py
 from __future__ import annotations
 
-import os, shutil, zipfile, ast, queue, asyncio, traceback, subprocess
+import os, shutil, zipfile, ast, queue, asyncio, tempfile, threading, traceback, subprocess
+from contextlib import contextmanager
 from io import BytesIO
 from datetime import datetime
-from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import List, Literal, Optional
+from pathlib import Path, PurePosixPath
+from typing import Iterator, List, Literal, Optional
 
+try:
+    import fcntl   # verrou de fichier POSIX
+except ImportError:  # Windows : verrou limité au processus
+    fcntl = None
 import pandas as pd
 from fastapi import (
     APIRouter, BackgroundTasks, Depends, File, HTTPException,
@@ -17,22 +21,34 @@ from fastapi.responses import JSONResponse, Response, PlainTextResponse
 from pydantic import BaseModel, ValidationError, Field, model_validator
 from ruamel.yaml import YAML
 from sse_starlette.sse import EventSourceResponse
+from starlette.concurrency import run_in_threadpool
 from sqlmodel import Session, select
 
 from app.template_files import EVALUATE_PY
 from app.auth import User, get_current_user
 from app.db import SessionLocal
 from app.models import (
-    AIProject, ModelRun, DataSet, DataConfig, DataConfigCreate,
-    ModelArtifact, TeamMembership
+    AIProject, CodeSnapshot, ModelRun, DataSet, DataConfig, DataConfigCreate,
+)
+from app.utils.artifacts import register_artifacts, run_output_dir
+from app.utils.code_snapshots import NOT_CODE, create_snapshot, materialize
+from app.utils.dependencies import (
+    get_session, assert_owner, assert_member,  # assert_owner = “propriétaire”
+    Membership, require_manager, team_membership,
+)
+from app.utils.storage_usage import (
+    PROJECT_RUN_QUOTA, add_usage, check_storage_quota, dir_size, reserve_run, text_bytes,
 )
-from app.utils.dependencies import get_session, assert_owner  # assert_owner = “propriétaire”
 
 # ---------------------------------------------------------------------------
 
 # BLOC DE CONFIGURATION
 # Définit des constantes utilisées à travers le module pour la validation.
 MAX_ZIP_SIZE = 50 * 1024 * 1024  # Taille max de l'archive ZIP (50 MiB)
+# Garde-fous contre les « bombes ZIP », vérifiés sur le répertoire central avant toute extraction.
+MAX_UNZIPPED_SIZE = int(os.getenv("MODEL_ZIP_MAX_UNZIPPED_MB", "200")) * 1024 * 1024
+MAX_ZIP_ENTRIES = int(os.getenv("MODEL_ZIP_MAX_ENTRIES", "5000"))
+MAX_ZIP_RATIO = int(os.getenv("MODEL_ZIP_MAX_RATIO", "100"))  # taille décompressée / compressée d'une entrée
 # Fichiers requis à la racine de l'archive ZIP pour que le code soit considéré comme valide.
 REQUIRED_TEMPLATE_FILES = {"train.py", "model.py", "config.yaml", "requirements.txt"}
 
@@ -40,24 +56,119 @@ REQUIRED_TEMPLATE_FILES = {"train.py", "model.py", "config.yaml", "requirements.
 # ───────────────────────── helpers ─────────────────────────────────────────
 # BLOC DES FONCTIONS D'AIDE
 # Fonctions utilitaires réutilisées dans plusieurs routes pour la sécurité et la compatibilité.
-def _assert_member(sess: Session, team_id: int, user: User) -> None:
-    """403 si l’utilisateur n’est pas membre (invitation acceptée)."""
-    mem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == user.id,
-            TeamMembership.accepted_at.is_not(None),
-        )
-    ).first()
-    if not mem:
-        raise HTTPException(403, "Accès interdit à cette équipe")
-
 
 def to_docker_path(p: Path) -> str:
     # Convertit les backslashes en slashes pour Windows, sans ajouter de guillemets
     return str(p).replace("\\", "/")
 
 
+def _inspect_zip(zip_path: str) -> tuple[set[str], int]:
+    """
+    Valide l'archive en un seul passage sur son répertoire central (chemins, nombre d'entrées,
+    taille décompressée, taux de compression) ; retourne les fichiers de la racine et la taille décompressée.
+    """
+    try:
+        with zipfile.ZipFile(zip_path) as z:
+            infos = z.infolist()
+    except zipfile.BadZipFile:
+        raise HTTPException(400, "ZIP corrompu ou invalide")
+    if len(infos) > MAX_ZIP_ENTRIES:
+        raise HTTPException(413, f"Archive trop volumineuse (max {MAX_ZIP_ENTRIES} fichiers)")
+
+    root_files, total = set(), 0
+    for info in infos:
+        parts = PurePosixPath(info.filename.replace("\\", "/")).parts
+        if not parts or info.filename.startswith(("/", "\\")) or ".." in parts or ":" in parts[0]:
+            raise HTTPException(400, f"Chemin invalide dans l'archive : {info.filename}")
+        if info.is_dir():
+            continue
+        if info.flag_bits & 0x1:
+            raise HTTPException(400, "Les archives chiffrées ne sont pas acceptées")
+        total += info.file_size
+        if total > MAX_UNZIPPED_SIZE:
+            raise HTTPException(413, f"Archive trop volumineuse une fois décompressée (max {MAX_UNZIPPED_SIZE // 2**20} MiB)")
+        if info.file_size > 1024 * 1024 and info.file_size > MAX_ZIP_RATIO * max(info.compress_size, 1):
+            raise HTTPException(413, f"Taux de compression suspect : {info.filename}")
+        if len(parts) == 1:
+            root_files.add(parts[0])
+    return root_files, total
+
+
+# Un seul remplacement de dossier de code à la fois par projet, tous workers confondus : verrou de
+# fichier (`flock`) à côté du dossier. Sans `fcntl` (Windows), le verrou ne vaut que pour le processus.
+_code_swap_thread_lock = threading.Lock()
+
+
+@contextmanager
+def _code_swap_lock(dest: Path) -> Iterator[None]:
+    if fcntl is None:
+        with _code_swap_thread_lock:
+            yield
+        return
+    with open(dest.parent / f".{dest.name}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)   # libéré à la fermeture du fichier
+        yield
+
+
+def _kept_size(dest: Path) -> int:
+    """Taille des entrées `NOT_CODE` du dossier, reprises lors du remplacement du code."""
+    total = 0
+    for name in NOT_CODE:
+        path = dest / name
+        if path.is_dir():
+            total += dir_size(path)
+        elif path.is_file():
+            total += path.stat().st_size
+    return total
+
+
+def _install_model_code(zip_path: str, dest: Path) -> int:
+    """
+    Extrait l'archive dans un dossier temporaire voisin de `dest`, puis le met en place par renommage :
+    un entraînement qui démarre voit l'ancien code complet ou le nouveau, jamais une extraction partielle.
+    Les fichiers produits dans le dossier (`NOT_CODE` : snapshot de données, sorties des évaluations)
+    sont repris de l'ancien dossier. Retourne la variation de taille du dossier.
+    En cas d'échec du remplacement, l'ancien dossier et ses fichiers produits sont remis en place.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{dest.name}.new-", dir=dest.parent))
+    try:
+        with zipfile.ZipFile(zip_path) as z:
+            z.extractall(staging)
+        (staging / "evaluate.py").write_text(EVALUATE_PY, encoding="utf-8")
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    delta = dir_size(staging)
+    old = None
+    moved: List[str] = []
+    with _code_swap_lock(dest):
+        try:
+            if dest.exists():
+                for name in NOT_CODE:
+                    if (dest / name).exists() and not (staging / name).exists():
+                        os.replace(dest / name, staging / name)
+                        moved.append(name)
+                old = Path(tempfile.mkdtemp(prefix=f".{dest.name}.old-", dir=dest.parent))
+                os.replace(dest, old / dest.name)
+            os.replace(staging, dest)
+        except Exception:
+            # remise en place avant de supprimer `staging`, qui contient les fichiers repris
+            if old is not None and (old / dest.name).exists() and not dest.exists():
+                os.replace(old / dest.name, dest)
+            if dest.exists():
+                for name in moved:
+                    os.replace(staging / name, dest / name)
+            shutil.rmtree(staging, ignore_errors=True)
+            if old is not None:
+                shutil.rmtree(old, ignore_errors=True)
+            raise
+    if old is not None:
+        delta -= dir_size(old)   # ancien code seul : les entrées reprises n'y sont plus
+        shutil.rmtree(old, ignore_errors=True)
+    return delta
+
+
 # ───────────────────────── Router ──────────────────────────────────────────
 # BLOC D'INITIALISATION DU ROUTER
 # Toutes les routes de ce fichier seront préfixées par `/teams/{team_id}/projects/{project_id}/model`
@@ -76,62 +187,54 @@ async def upload_model_code(
         project_id: int,
         zip_file: UploadFile = File(...),
         current_user: User = Depends(get_current_user),
+        membership: Membership = Depends(team_membership),
         sess: Session = Depends(get_session),
 ):
     # BLOC DE GESTION DE L'UPLOAD DU MODÈLE
     # Cette fonction gère la réception et le traitement d'une archive ZIP contenant le code du modèle.
     # 1.  Validation des droits : Vérifie que l'utilisateur est membre et a un rôle autorisé.
-    # 2.  Validation du Fichier : S'assure que le fichier est un ZIP valide et non corrompu.
-    # 3.  Validation du Contenu : Vérifie la présence des fichiers requis à la racine.
-    # 4.  Stockage : Extrait le contenu de l'archive dans le dossier de stockage du projet.
-    # 5.  Ajout de Fichiers : Ajoute le script `evaluate.py` standard au code de l'utilisateur.
-    _assert_member(sess, team_id, current_user)
+    # 2.  Réception : L'archive est écrite par blocs dans un fichier temporaire (taille limitée au fil de l'eau).
+    # 3.  Validation : Un seul passage sur le répertoire central du ZIP (chemins, tailles, taux de
+    #     compression) et présence des fichiers requis à la racine.
+    # 4.  Stockage : Extrait l'archive à côté du dossier du projet puis le remplace par renommage,
+    #     hors de la boucle d'événements. Le script `evaluate.py` standard est ajouté au code.
+    # Appartenance résolue une seule fois par la dépendance `team_membership` (rôle compris).
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
         raise HTTPException(404, "Projet introuvable")
 
-    mymem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == current_user.id
-        )
-    ).first()
-    if not mymem or mymem.role not in ("owner", "manager"):
-        raise HTTPException(403, "Seul le propriétaire de l'equipe peut uploader le code")
+    require_manager(membership, "Seul le propriétaire de l'equipe peut uploader le code")
 
     if zip_file.content_type not in ("application/zip", "application/x-zip-compressed"):
         raise HTTPException(400, "Il faut un fichier ZIP valide")
 
-    tmp = NamedTemporaryFile(delete=False, suffix=".zip")
+    fd, zip_path = tempfile.mkstemp(prefix="smia-model-", suffix=".zip")
     try:
-        raw = await zip_file.read()
-        if len(raw) > MAX_ZIP_SIZE:
-            raise HTTPException(413, "Archive trop volumineuse (max 50 MiB)")
-
-        try:
-            zipfile.ZipFile(BytesIO(raw))
-        except zipfile.BadZipFile:
-            raise HTTPException(400, "ZIP corrompu ou invalide")
-
-        tmp.write(raw);
-        tmp.flush()
-
-        with zipfile.ZipFile(tmp.name) as z:
-            root_files = {Path(f).name for f in z.namelist() if "/" not in f.strip("/")}
-            missing = REQUIRED_TEMPLATE_FILES - root_files
-            if missing:
-                return JSONResponse({"ok": False, "missing": sorted(missing)}, status_code=400)
-
-            dest = Path(__file__).resolve().parents[2] / "storage" / "models" / f"project_{project_id}"
-            if dest.exists():
-                shutil.rmtree(dest)
-            dest.mkdir(parents=True, exist_ok=True)
-            z.extractall(dest)
-            (dest / "evaluate.py").write_text(EVALUATE_PY, encoding="utf-8")
+        size = 0
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await zip_file.read(1024 * 1024):
+                size += len(chunk)
+                if size > MAX_ZIP_SIZE:
+                    raise HTTPException(413, "Archive trop volumineuse (max 50 MiB)")
+                out.write(chunk)
+
+        root_files, unzipped = await run_in_threadpool(_inspect_zip, zip_path)
+        missing = REQUIRED_TEMPLATE_FILES - root_files
+        if missing:
+            return JSONResponse({"ok": False, "missing": sorted(missing)}, status_code=400)
+
+        dest = Path(__file__).resolve().parents[2] / "storage" / "models" / f"project_{project_id}"
+        # Quota : le nouveau code (taille décompressée) remplace l'ancien (fichiers conservés exclus).
+        previous = await run_in_threadpool(dir_size, dest)
+        kept = await run_in_threadpool(_kept_size, dest)
+        check_storage_quota(sess, project_id, unzipped + len(EVALUATE_PY), released=previous - kept)
+        delta = await run_in_threadpool(_install_model_code, zip_path, dest)
     finally:
-        tmp.close();
-        Path(tmp.name).unlink(missing_ok=True)
+        Path(zip_path).unlink(missing_ok=True)
+
+    add_usage(sess, project_id, models_bytes=delta)
+    sess.commit()
 
     files = sorted(p.name for p in dest.iterdir() if p.is_file() and p.name != "evaluate.py")
     return {"ok": True, "files": files}
@@ -164,7 +267,7 @@ async def check_model_template(
     #     et de la classe `MyModel`, qui sont les points d'entrée pour l'entraînement.
     # 4.  Retourne un objet structuré (`TemplateCheckResult`) indiquant si le template
     #     est conforme et listant précisément les éléments manquants.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user, fresh=True)
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
         raise HTTPException(404, "Projet introuvable")
@@ -207,40 +310,43 @@ def launch_training(
         payload: TrainRequest,
         background_tasks: BackgroundTasks,
         current_user: User = Depends(get_current_user),
+        membership: Membership = Depends(team_membership),
         sess: Session = Depends(get_session),
 ):
     # BLOC DE LANCEMENT DE L'ENTRAÎNEMENT (API ENDPOINT)
     # Cette route reçoit une demande d'entraînement, la valide, et la planifie.
     # 1.  Validation des permissions et des quotas : Vérifie les droits de l'utilisateur,
     #     le projet, le dataset, et s'assure que le quota de "runs" n'est pas dépassé.
-    # 2.  Création du Run : Crée une entrée `ModelRun` en base de données avec le statut "pending".
+    # 2.  Création du Run : Crée une entrée `ModelRun` en base de données avec le statut "pending",
+    #     rattachée à un instantané immuable du code du projet (app.utils.code_snapshots) : un upload
+    #     ou une modification de `config.yaml` pendant l'entraînement n'affecte pas le run.
     # 3.  Planification asynchrone : Utilise `background_tasks.add_task` pour déléguer
     #     le long processus d'entraînement à la fonction `_do_training`, permettant
     #     de retourner immédiatement une réponse 202 (Accepted) au client.
-    _assert_member(sess, team_id, current_user)
+    # Appartenance résolue une seule fois par la dépendance `team_membership` (rôle compris).
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
         raise HTTPException(404, "Projet introuvable")
 
-    mymem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == current_user.id
-        )
-    ).first()
-    if not mymem or mymem.role not in ("owner", "manager"):
-        raise HTTPException(403, "Seul le propriétaire de l'equipe peut lancer l'entraînement")
-
-    n_runs = sess.exec(select(ModelRun.id).where(ModelRun.project_id == project_id)).all()
-    if len(n_runs) >= 10:
-        raise HTTPException(403, "Quota de 10 runs atteint")
+    require_manager(membership, "Seul le propriétaire de l'equipe peut lancer l'entraînement")
 
     ds = sess.get(DataSet, payload.dataset_id)
     if not ds or ds.project_id != project_id:
         raise HTTPException(400, "dataset_id invalide")
 
-    run = ModelRun(project_id=project_id, status="pending")
+    # Quotas lus dans le registre d'espace du projet (une ligne) ; le run est compté dans la même transaction.
+    check_storage_quota(sess, project_id, 0)
+    if not reserve_run(sess, project_id):
+        raise HTTPException(403, f"Quota de {PROJECT_RUN_QUOTA} runs atteint")
+
+    code_dir = Path(__file__).resolve().parents[2] / "storage" / "models" / f"project_{project_id}"
+    try:
+        snapshot = create_snapshot(sess, code_dir)
+    except FileNotFoundError:
+        raise HTTPException(400, "Aucun code modèle : uploadez d'abord l'archive du modèle")
+
+    run = ModelRun(project_id=project_id, status="pending", snapshot_id=snapshot.id)
     sess.add(run);
     sess.commit();
     sess.refresh(run)
@@ -257,7 +363,7 @@ def _do_training(project_id: int, run_id: int, train_data_path: str):
     """
     Tâche lancée en arrière-plan :
     - copie un snapshot des données pour la drift
-    - démarre le conteneur Docker (image préinstallée smia-runtime:latest)
+    - démarre le conteneur Docker (image préinstallée smia-runtime:latest) sur l'instantané du code du run
     - pousse chaque ligne de stdout dans une SimpleQueue
     - met à jour ModelRun à la fin
     """
@@ -271,14 +377,29 @@ def _do_training(project_id: int, run_id: int, train_data_path: str):
         run.status = "running"
         sess.add(run)
         sess.commit()
+        snapshot = sess.get(CodeSnapshot, run.snapshot_id) if run.snapshot_id else None
+        # Arborescence en lecture seule de l'instantané (déjà construite si le code n'a pas changé).
+        try:
+            code_tree = materialize(snapshot) if snapshot else None
+        except OSError as exc:
+            run.finished_at = datetime.utcnow()
+            run.status = "failed"
+            run.logs = f"Error: instantané du code {run.snapshot_id} indisponible: {exc}"
+            sess.add(run)
+            sess.commit()
+            return
 
     base_dir = Path(__file__).resolve().parents[2] / "storage" / "models" / f"project_{project_id}"
-    output_dir = base_dir / "output"
-    output_dir.mkdir(exist_ok=True)
+    # Dossier de sortie propre au run : deux entraînements n'écrivent jamais le même fichier modèle.
+    output_dir = run_output_dir(project_id, run_id)
+    output_dir.mkdir(parents=True, exist_ok=True)
 
     # 1) Snapshot des données : Crée une copie du dataset d'entraînement. Ce snapshot
     #    servira de référence pour les futures analyses de dérive des données (data drift).
     ref_stats = base_dir / "ref_stats.csv"
+    # Seule la variation de taille du snapshot est ajoutée au registre d'espace pour `base_dir` : un
+    # upload du code pendant l'entraînement compte déjà ses propres octets (`upload_model_code`).
+    ref_stats_delta = 0
     q = log_channels.setdefault(run_id, queue.SimpleQueue())
     if not os.access(train_data_path, os.R_OK):
         q.put(f"Error: impossible de lire {train_data_path} (permission denied)")
@@ -286,7 +407,9 @@ def _do_training(project_id: int, run_id: int, train_data_path: str):
         q.put(f"Error: impossible d’écrire dans {base_dir} (permission denied)")
     else:
         try:
+            ref_stats_before = ref_stats.stat().st_size if ref_stats.is_file() else 0
             shutil.copy(train_data_path, ref_stats)
+            ref_stats_delta = ref_stats.stat().st_size - ref_stats_before
             q.put(f"Snapshot ref_stats créé: {ref_stats.name}")
         except Exception:
             tb = traceback.format_exc()
@@ -296,9 +419,9 @@ def _do_training(project_id: int, run_id: int, train_data_path: str):
 
     # 2) Construction de la commande Docker : Prépare une commande `docker run` qui
     #    exécutera le script `train.py` de l'utilisateur dans un conteneur isolé.
-    #    - Les volumes (-v) montent le code, les données et un dossier de sortie.
+    #    - Les volumes (-v) montent le code (instantané, en lecture seule), les données et un dossier de sortie.
     #    - Les options de sécurité limitent les ressources (CPU, mémoire) et désactivent le réseau.
-    code_path = to_docker_path(base_dir)
+    code_path = to_docker_path(code_tree or base_dir)
     data_path = to_docker_path(Path(train_data_path))
     output_path = to_docker_path(output_dir)
 
@@ -306,7 +429,7 @@ def _do_training(project_id: int, run_id: int, train_data_path: str):
         "docker", "run", "--rm",
         "--cpus=2.0", "--memory=4g", "--network=none",
         "--entrypoint", "/bin/sh",
-        "-v", f"{code_path}:/code",
+        "-v", f"{code_path}:/code:ro" if code_tree else f"{code_path}:/code",
         "-v", f"{data_path}:/data/train.csv",
         "-v", f"{output_path}:/output",
         "smia-runtime:latest",
@@ -337,26 +460,16 @@ def _do_training(project_id: int, run_id: int, train_data_path: str):
 
     q.put(f"Training finished, exit code = {ret_code}")
 
-    # 4) Recherche de l'artéfact : Après l'exécution, cherche un fichier modèle
-    #    (.pt, .joblib, .onnx) dans le dossier de sortie. Si trouvé, crée une
-    #    entrée `ModelArtifact` en base de données.
-    artifact_path = None
-    for name in ("model.pt", "model.joblib", "model.onnx"):
-        candidate = output_dir / name
-        if candidate.exists():
-            artifact_path = candidate
-            break
-
-    if artifact_path:
-        size = artifact_path.stat().st_size
-        basic_metrics = {"exit_code": ret_code}
-        with SessionLocal() as sess:
-            sess.add(ModelArtifact(
-                project_id=project_id, model_run_id=run_id,
-                path=str(artifact_path.resolve()), format=artifact_path.suffix.lstrip("."),
-                size_bytes=size, metrics=basic_metrics,
-            ))
-            sess.commit()
+    # 4) Enregistrement des artéfacts : Les fichiers modèle (.pt, .joblib, .onnx) du dossier
+    #    de sortie du run sont déplacés dans le magasin adressé par contenu (app.utils.artifacts)
+    #    et une entrée `ModelArtifact` (chemin, taille, SHA-256) est créée pour chacun.
+    with SessionLocal() as sess:
+        artifacts, stored_bytes = register_artifacts(sess, project_id, run_id, output_dir, {"exit_code": ret_code})
+        for art in artifacts:
+            q.put(f"Artefact enregistré: {art.format} ({art.size_bytes} octets, sha256 {art.sha256[:12]})")
+        # Sorties restantes du run (métriques, graphiques…) : son dossier n'existait pas avant l'entraînement.
+        add_usage(sess, project_id, models_bytes=ref_stats_delta + dir_size(output_dir) + stored_bytes)
+        sess.commit()
 
     # 5) Finalisation : Collecte tous les logs depuis la file `q`, supprime la file
     #    du dictionnaire global, et met à jour l'enregistrement `ModelRun` avec
@@ -372,6 +485,7 @@ def _do_training(project_id: int, run_id: int, train_data_path: str):
         run.logs = "\n".join(collected)
         run.status = "succeeded" if ret_code == 0 else "failed"
         sess.add(run)
+        add_usage(sess, project_id, logs_bytes=text_bytes(run.logs))
         sess.commit()
 
     # Met à jour les détails du projet avec la durée de l'entraînement.
@@ -406,7 +520,7 @@ def list_runs(
         sess: Session = Depends(get_session),
 ):
     # Route pour lister tous les "runs" (tentatives d'entraînement) d'un projet.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
     return sess.exec(
         select(ModelRun).where(ModelRun.project_id == project_id)
     ).all()
@@ -421,7 +535,7 @@ def get_run(
         sess: Session = Depends(get_session),
 ):
     # Route pour récupérer les détails d'un "run" spécifique par son ID (statut, logs, etc.).
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
     run = sess.get(ModelRun, run_id)
     if not run or run.project_id != project_id:
         raise HTTPException(404, "Run introuvable")
@@ -439,6 +553,7 @@ async def upload_dataset(
         kind: str = "train",  # Paramètre pour spécifier s'il s'agit d'un jeu de train ou de test.
         file: UploadFile = File(...),
         current_user: User = Depends(get_current_user),
+        membership: Membership = Depends(team_membership),
         sess: Session = Depends(get_session),
 ):
     # Cette fonction orchestre la réception, la validation et le stockage des datasets.
@@ -450,7 +565,7 @@ async def upload_dataset(
     #    et la liste des colonnes extraites de l'en-tête du CSV.
     # 5. Retourne l'ID du nouveau dataset et la liste de ses colonnes, ce qui est utile
     #    pour l'interface utilisateur (ex: peupler des menus de sélection de features).
-    _assert_member(sess, team_id, current_user)
+    # Appartenance résolue une seule fois par la dépendance `team_membership` (rôle compris).
 
     if kind not in {"train", "test"}:
         raise HTTPException(400, "kind doit être 'train' ou 'test'")
@@ -459,14 +574,7 @@ async def upload_dataset(
     if not proj or proj.team_id != team_id:
         raise HTTPException(404)
 
-    mymem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == current_user.id
-        )
-    ).first()
-    if not mymem or mymem.role not in ("owner", "manager"):
-        raise HTTPException(403, "Seul le propriétaire de l'equipe peut uploader le dataset")
+    require_manager(membership, "Seul le propriétaire de l'equipe peut uploader le dataset")
 
     data_dir = Path(__file__).resolve().parents[2] / "storage" / "data" / f"project_{project_id}"
     data_dir.mkdir(parents=True, exist_ok=True)
@@ -483,6 +591,8 @@ async def upload_dataset(
         raise HTTPException(400, "Ce n'est pas un CSV valide")
 
     dest = data_dir / file.filename
+    previous = dest.stat().st_size if dest.is_file() else 0
+    check_storage_quota(sess, project_id, len(data), released=previous)
     dest.write_bytes(data)
 
     try:
@@ -498,6 +608,7 @@ async def upload_dataset(
         columns=list(df.columns),
     )
     sess.add(ds)
+    add_usage(sess, project_id, data_bytes=len(data) - previous)
     sess.commit()
     sess.refresh(ds)
 
@@ -548,7 +659,7 @@ def read_config_yaml(
     # BLOC DE LECTURE DU FICHIER config.yaml
     # Route simple qui permet de lire et de retourner le contenu brut du fichier
     # `config.yaml` associé au projet, tel qu'il est stocké sur le serveur.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
     path = _config_path(project_id)
     if not path.exists():
         raise HTTPException(404, "config.yaml introuvable")
@@ -645,7 +756,7 @@ def get_data_config(
 ):
     # Route simple pour récupérer la configuration des données (`DataConfig`)
     # actuellement sauvegardée pour un projet.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
     dc = sess.exec(
         select(DataConfig).join(DataSet).where(DataSet.project_id == project_id)
     ).first()
@@ -671,7 +782,7 @@ async def stream_logs(
     # 3. Dès qu'un log est poussé dans la file par la tâche de fond `_do_training`,
     #    le générateur le reçoit et l'envoie (`yield`) immédiatement au client.
     # 4. Gère la déconnexion du client pour arrêter proprement le streaming.
-    _assert_member(sess, team_id, current_user)
+    assert_member(sess, team_id, current_user)
 
     q = log_channels.get(run_id)
     if q is None:
@@ -0,0 +1,34 @@
+# app/routers/monitoring.py
+import ipaddress
+import os
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from app.utils.telemetry import render_prometheus
+
+# BLOC D'EXPOSITION DES MÉTRIQUES DE FONCTIONNEMENT
+# `/metrics` sert le registre de `app.utils.telemetry` au format Prometheus. Si METRICS_TOKEN
+# est défini, le collecteur doit l'envoyer dans l'en-tête `Authorization: Bearer <token>`.
+# Sans METRICS_TOKEN, seules les connexions directes depuis la machine locale sont acceptées
+# (pas de requête relayée par un proxy, reconnue à ses en-têtes `X-Forwarded-*`/`Forwarded`).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+router = APIRouter(tags=["monitoring"])
+
+
+def _is_local(request: Request) -> bool:
+    if any(h in request.headers for h in ("x-forwarded-for", "x-real-ip", "forwarded")):
+        return False
+    try:
+        return request.client is not None and ipaddress.ip_address(request.client.host).is_loopback
+    except ValueError:
+        return False
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics(request: Request, authorization: str | None = Header(None)):
+    allowed = authorization == f"Bearer {METRICS_TOKEN}" if METRICS_TOKEN else _is_local(request)
+    if not allowed:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -4,8 +4,8 @@ from datetime import datetime
 from typing import List
 
 from app.auth import get_current_user, User
-from app.models import Notification, TeamMembership
-from app.utils.dependencies import get_session
+from app.models import Notification
+from app.utils.dependencies import get_session, assert_member
 from sqlmodel import Session
 
 # BLOC D'INITIALISATION DU ROUTER
@@ -28,14 +28,7 @@ def list_team_notifications(
     # 3.  Les trie par date de création, de la plus récente à la plus ancienne.
 
     # Vérifier appartenance à l'équipe
-    mem = sess.exec(
-        select(TeamMembership)
-        .where(TeamMembership.team_id == team_id,
-               TeamMembership.user_id == current_user.id,
-               TeamMembership.accepted_at.is_not(None))
-    ).first()
-    if not mem:
-        raise HTTPException(status_code=403, detail="Accès interdit")
+    assert_member(sess, team_id, current_user)
 
     # Ne renvoyer que les non-lues
     notifs = sess.exec(
@@ -1,7 +1,8 @@
 # app/routers/projects.py
+import json
 from datetime import datetime, timedelta
-from pathlib import Path as FSPath
-from typing import List, Optional, Dict, Any
+from itertools import groupby
+from typing import List, Optional, Dict, Any, Tuple
 
 from fastapi import (
     APIRouter,
@@ -15,9 +16,10 @@ from fastapi import (
     Path,
     Form,
 )
-from fastapi.responses import Response, FileResponse
+from fastapi.responses import Response, FileResponse, StreamingResponse
 from pydantic import BaseModel
 from sqlmodel import Session, select, delete
+from sqlalchemy import insert
 
 from app.auth import get_current_user, User
 from app.db import SessionLocal
@@ -35,9 +37,12 @@ from app.models import (
     NonConformiteRead,
     NonConformiteUpdate, StatutNonConformite, TeamMemberResponse, Team,
 )
-from config.iso42001_requirements import ISO42001_REQUIREMENTS
-from app.utils.dependencies import get_session
+from app.utils.dependencies import get_session, assert_member, get_membership
 from app.utils.files import purge_project_storage
+from app.utils.compliance import refresh_item_summary, refresh_item_summaries, refresh_item_summary_by_id
+from app.utils.checklist import repair_item_lengths, seed_project_checklist
+from app.utils.iso_index import CONTROL_EVIDENCE, evidence_ref
+from app.utils.storage_usage import add_usage, check_storage_quota
 from sqlalchemy.orm import selectinload  # pour charger les enfants en une requête
 
 # BLOC D'INITIALISATION DU ROUTER
@@ -55,17 +60,10 @@ def verify_access(
         item_id: int,
         current_user: User,
         sess: Session,
+        fresh: bool = False,
 ) -> ISO42001ChecklistItem:
-    # 1. Vérifie que l'utilisateur est un membre actif de l'équipe.
-    mem = sess.exec(
-        select(TeamMembership).where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == current_user.id,
-            TeamMembership.accepted_at.is_not(None),
-        )
-    ).first()
-    if not mem:
-        raise HTTPException(status_code=403, detail="Accès interdit à cette équipe")
+    # 1. Vérifie que l'utilisateur est un membre actif de l'équipe (relu en base avant une écriture).
+    assert_member(sess, team_id, current_user, fresh=fresh)
 
     # 2. Vérifie que le projet appartient bien à l'équipe spécifiée.
     proj = sess.get(AIProject, project_id)
@@ -94,20 +92,15 @@ def create_project(
     # 1.  Vérifie que l'utilisateur est bien membre de l'équipe dans laquelle il essaie de créer le projet.
     # 2.  Crée l'instance du projet en s'assurant que le `team_id` de l'URL est bien celui qui est utilisé.
     # 3.  Définit l'utilisateur courant comme propriétaire (`owner`) du projet.
-    mem = sess.exec(
-        select(TeamMembership)
-        .where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == current_user.id,
-            TeamMembership.accepted_at.is_not(None),
-        )
-    ).first()
-    if not mem:
-        raise HTTPException(status_code=403, detail="Accès interdit à cette équipe")
+    # 4.  Initialise la checklist de conformité à partir de `ISO42001_REQUIREMENTS`.
+    assert_member(sess, team_id, current_user, fresh=True)
 
     proj = AIProject(**payload.dict(), team_id=team_id)
     proj.owner = current_user.username
     sess.add(proj)
+    # 4.  Crée la checklist ISO 42001 du projet dans la même transaction (INSERT groupé).
+    sess.flush()
+    seed_project_checklist(sess, proj.id)
     sess.commit()
     sess.refresh(proj)
     return proj
@@ -133,16 +126,7 @@ def list_projects(
     # 5.  Construit manuellement la réponse pour y injecter la liste des membres (`team_members`)
     #     dans chaque projet, car ce champ n'est pas directement dans le modèle de BDD `AIProject`.
 
-    membership = sess.exec(
-        select(TeamMembership)
-        .where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == current_user.id,
-            TeamMembership.accepted_at.is_not(None),
-        )
-    ).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user)
 
     query = select(AIProject).where(AIProject.team_id == team_id)
     if status:
@@ -201,16 +185,7 @@ def read_project(
     # 3.  Comme pour `list_projects`, elle effectue une requête séparée pour
     #     récupérer les membres de l'équipe et les injecte manuellement dans la
     #     réponse pour correspondre au schéma `AIProjectRead`.
-    membership = sess.exec(
-        select(TeamMembership)
-        .where(
-            TeamMembership.team_id == team_id,
-            TeamMembership.user_id == current_user.id,
-            TeamMembership.accepted_at.is_not(None),
-        )
-    ).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user)
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
@@ -249,12 +224,7 @@ def update_project(
     # La boucle `for key, val in payload.dict(exclude_unset=True).items()` est
     # une façon efficace de n'appliquer que les changements présents dans la
     # requête (mise à jour partielle) plutôt que d'écraser tous les champs.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))
-    ).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
@@ -287,11 +257,7 @@ def delete_project(
     #     a. `sess.delete(proj)`: Supprime l'objet et ses relations de la base de données.
     #     b. `purge_project_storage()`: Appelle une fonction utilitaire pour supprimer
     #        tous les fichiers associés au projet sur le disque dur (datasets, modèles, etc.).
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     proj = sess.exec(
         select(AIProject)
@@ -324,11 +290,7 @@ def delete_project(
 def list_comments(team_id: int, project_id: int, current_user: User = Depends(get_current_user),
                   sess: Session = Depends(get_session)):
     # Récupère la liste de tous les commentaires d'un projet, triés par date.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user)
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
@@ -347,11 +309,7 @@ def create_comment(
         sess: Session = Depends(get_session),
 ):
     # Crée un nouveau commentaire. L'auteur est automatiquement défini comme l'utilisateur courant.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id:
@@ -376,11 +334,7 @@ def update_comment(
     # Met à jour le contenu d'un commentaire existant.
     # Note : un contrôle supplémentaire pourrait être ajouté pour s'assurer que
     # seul l'auteur original du commentaire peut le modifier.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     comment = sess.get(Comment, comment_id)
     if not comment or comment.project_id != project_id:
@@ -401,11 +355,7 @@ def delete_comment(
 ):
     # BLOC DE SUPPRESSION D'UN COMMENTAIRE
     # Finalise le CRUD des commentaires en permettant leur suppression.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     comment = sess.get(Comment, comment_id)
     if not comment or comment.project_id != project_id:
@@ -423,42 +373,46 @@ def delete_comment(
 @router.get("/{project_id}/checklist", response_model=List[ISO42001ChecklistItem])
 def list_checklist_items(team_id: int, project_id: int, current_user: User = Depends(get_current_user),
                          sess: Session = Depends(get_session)):
-    # Cette route a une double responsabilité :
-    # 1.  Lister les items de la checklist pour un projet.
-    # 2.  AUTO-INITIALISATION : Si la checklist est vide pour un projet, elle la peuple
-    #     automatiquement à partir d'une configuration prédéfinie (`ISO42001_REQUIREMENTS`).
-    #     C'est une étape cruciale pour initialiser un nouveau projet.
-    # 3.  AUTO-CORRECTION : Elle s'assure que la structure de chaque item (nombre de statuts,
-    #     résultats, etc.) correspond bien au nombre de questions, et la corrige si besoin.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
-    items = sess.exec(select(ISO42001ChecklistItem).where(ISO42001ChecklistItem.project_id == project_id)).all()
-
-    if not items:
-        for req in ISO42001_REQUIREMENTS:
-            n = len(req["audit_questions"])
-            sess.add(ISO42001ChecklistItem(
-                project_id=project_id, control_id=req["control_id"], control_name=req["control_name"],
-                description=req["description"], audit_questions=req["audit_questions"],
-                evidence_required=req["evidence_required"], statuses=["to-do"] * n,
-                results=["not-assessed"] * n, observations=[None] * n,
-                status="to-do", result="not-assessed", observation=None,
-            ))
-        sess.commit()
-        items = sess.exec(select(ISO42001ChecklistItem).where(ISO42001ChecklistItem.project_id == project_id)).all()
+    # Lecture seule de la checklist d'un projet.
+    # 1.  La checklist est créée avec le projet (`create_project`) et les items existants sont
+    #     réparés par une migration au démarrage : cette route n'écrit donc jamais en base.
+    # 2.  Une seule requête (index sur `project_id`) ramène les items et, par jointure externe,
+    #     les métadonnées de leurs preuves (sans le contenu binaire).
+    # 3.  Les lignes sont lues par lots sur un curseur (`yield_per`), sérialisées item par item et
+    #     envoyées en flux, sans construire d'objets ORM. Le curseur appartient à une session ouverte
+    #     par le générateur : celle de la requête est fermée avant l'envoi de la réponse.
+    assert_member(sess, team_id, current_user)
+    proj_team = sess.exec(select(AIProject.team_id).where(AIProject.id == project_id)).first()
+    if proj_team != team_id:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    columns = [c for c in ISO42001ChecklistItem.__table__.columns]
+    query = (
+        select(*columns, Proof.id.label("proof_id"), Proof.evidence_id.label("proof_evidence_id"),
+               Proof.filename.label("proof_filename"))
+        .outerjoin(Proof, Proof.checklist_item_id == ISO42001ChecklistItem.id)
+        .where(ISO42001ChecklistItem.project_id == project_id)
+        .order_by(ISO42001ChecklistItem.id, Proof.id)
+        .execution_options(yield_per=200)
+    )
 
-    updated = False
-    for it in items:
-        q = len(it.audit_questions)
-        if len(it.statuses) != q: it.statuses = [it.status] * q; updated = True
-        if len(it.results) != q: it.results = [it.result] * q; updated = True
-        if len(it.observations) != q: it.observations = [it.observation] * q; updated = True
-        if updated: sess.add(it)
-    if updated: sess.commit()
-    return items
+    def _stream():
+        with SessionLocal() as stream_sess:
+            yield "["
+            for n, (_, group) in enumerate(groupby(stream_sess.exec(query), key=lambda r: r.id)):
+                group = list(group)
+                item = {c.name: getattr(group[0], c.name) for c in columns}
+                for key in ("created_at", "updated_at"):
+                    if item[key] is not None: item[key] = item[key].isoformat()
+                item["proofs"] = [
+                    {"proof_id": r.proof_id, "evidence_id": r.proof_evidence_id, "filename": r.proof_filename,
+                     "download_url": f"/teams/{team_id}/projects/{project_id}/proofs/{r.proof_id}"}
+                    for r in group if r.proof_id is not None
+                ]
+                yield ("," if n else "") + json.dumps(item, ensure_ascii=False)
+            yield "]"
+
+    return StreamingResponse(_stream(), media_type="application/json")
 
 
 @router.post("/{project_id}/checklist", response_model=ISO42001ChecklistItem, status_code=status.HTTP_201_CREATED)
@@ -466,11 +420,7 @@ def create_checklist_item(team_id: int, project_id: int, item: ISO42001Checklist
                           current_user: User = Depends(get_current_user), sess: Session = Depends(get_session)):
     # Permet de créer manuellement un nouvel item de checklist pour un projet.
     # Utile pour ajouter des contrôles personnalisés non présents dans la norme de base.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership:
-        raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
     n = len(item.audit_questions)
     new_item = ISO42001ChecklistItem(
         project_id=project_id, control_id=item.control_id, control_name=item.control_name,
@@ -479,65 +429,139 @@ def create_checklist_item(team_id: int, project_id: int, item: ISO42001Checklist
         results=[item.result] * n, observations=[item.observation] * n,
         status=item.status, result=item.result, observation=item.observation,
     )
-    sess.add(new_item);
-    sess.commit();
+    sess.add(new_item)
+    sess.flush()
+    refresh_item_summary(sess, new_item)
+    sess.commit()
     sess.refresh(new_item)
     return new_item
 
 
+def apply_checklist_answers(sess: Session, project_id: int,
+                            updates: List[Tuple[ISO42001ChecklistItem, Dict[str, Any]]]) -> None:
+    # HELPER PARTAGÉ : applique une ou plusieurs réponses (item, payload) dans la transaction courante.
+    # Les requêtes sont groupées quel que soit le nombre de réponses :
+    # 1.  Règle métier : un résultat "compliant" exige au moins une preuve pour la question ;
+    #     toutes les preuves des items concernés sont lues en UNE requête `IN`.
+    # 2.  AUTOMATISATION : un résultat "not-compliant" crée une `NonConformite` ; toute autre
+    #     réponse supprime la non-conformité existante. Les NC existantes sont lues en une requête,
+    #     les créations et suppressions sont faites en masse.
+    # 3.  Le résumé de conformité de chaque item touché est recalculé, puis le score du projet une fois.
+    # Ne fait pas de commit : l'appelant valide (ou annule) l'ensemble.
+    for item, payload in updates:
+        idx = payload.get("questionIndex")
+        if not isinstance(idx, int) or idx < 0 or idx >= len(item.audit_questions):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"questionIndex invalide : {idx!r} (item {item.id})")
+        repair_item_lengths(item)
+
+    item_ids = list({item.id for item, _ in updates})
+    compliant_ids = {item.id for item, payload in updates if payload.get("result") == "compliant"}
+    uploaded = set()
+    if compliant_ids:
+        uploaded = set(sess.exec(
+            select(Proof.checklist_item_id, Proof.evidence_id).where(Proof.checklist_item_id.in_(compliant_ids))
+        ).all())
+    for item, payload in updates:
+        if payload.get("result") == "compliant":
+            evidence_ids = item.audit_questions[payload["questionIndex"]]["evidence_refs"]
+            if not any((item.id, ev) in uploaded for ev in evidence_ids):
+                raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                                    detail="Au moins une preuve est requise pour déclarer 'compliant'")
+
+    existing_ncs: Dict[Tuple[int, int], NonConformite] = {}
+    for nc in sess.exec(select(NonConformite).where(NonConformite.checklist_item_id.in_(item_ids))).all():
+        existing_ncs.setdefault((nc.checklist_item_id, nc.question_index), nc)
+
+    new_ncs, removed_nc_ids = set(), set()
+    for item, payload in updates:
+        idx = payload["questionIndex"]
+        old_result = item.results[idx]
+        new_result = payload.get("result", old_result)
+        if "result" in payload: item.results[idx] = new_result
+
+        key = (item.id, idx)
+        if new_result == "not-compliant":
+            if key not in existing_ncs:
+                new_ncs.add(key)
+        else:
+            new_ncs.discard(key)
+            if key in existing_ncs:
+                removed_nc_ids.add(existing_ncs.pop(key).id)
+
+        if "status" in payload: item.statuses[idx] = payload["status"]
+        if "observation" in payload: item.observations[idx] = payload["observation"]
+        item.updated_at = datetime.utcnow()
+        sess.add(item)
+
+    if removed_nc_ids:
+        # Équivalent en masse de la cascade ORM : les actions correctives des NC supprimées partent avec elles.
+        sess.execute(delete(ActionCorrective).where(ActionCorrective.non_conformite_id.in_(removed_nc_ids)))
+        sess.execute(delete(NonConformite).where(NonConformite.id.in_(removed_nc_ids)))
+    if new_ncs:
+        now = datetime.utcnow()
+        sess.execute(insert(NonConformite), [
+            {"checklist_item_id": item_id, "question_index": idx, "type_nc": "mineure",
+             "statut": StatutNonConformite.non_corrigee, "created_at": now, "updated_at": now}
+            for item_id, idx in sorted(new_ncs)
+        ])
+    sess.flush()
+
+    # Le résumé de conformité est mis à jour dans la même transaction que les réponses et les NC.
+    refresh_item_summaries(sess, list({item.id: item for item, _ in updates}.values()))
+
+
 @router.put("/{project_id}/checklist/{item_id}", response_model=ISO42001ChecklistItem)
 def update_checklist_item(team_id: int, project_id: int, item_id: int, payload: Dict[str, Any] = Body(...),
                           current_user: User = Depends(get_current_user), sess: Session = Depends(get_session)):
-    # Route complexe pour mettre à jour UNE SEULE question au sein d'un item de checklist.
-    # Elle contient une logique métier importante :
-    # 1.  Cible une question précise via le `questionIndex` fourni dans le payload.
-    # 2.  Règle métier : Si le résultat d'une question passe à "compliant", elle vérifie
-    #     qu'au moins une preuve (`Proof`) a été uploadée pour ce point de contrôle.
-    # 3.  AUTOMATISATION : Si le résultat passe à "not-compliant", une `NonConformite`
-    #     est automatiquement créée. Inversement, si une non-conformité existait et que
-    #     le statut change, elle est automatiquement supprimée.
-    item = verify_access(team_id, project_id, item_id, current_user, sess)  # Utilise le helper
-    idx = payload.get("questionIndex")
-    if not isinstance(idx, int) or idx < 0 or idx >= len(item.audit_questions):
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"questionIndex invalide")
-
-    if len(item.statuses) != len(item.audit_questions): item.statuses = [item.status] * len(item.audit_questions)
-    if len(item.results) != len(item.audit_questions): item.results = [item.result] * len(item.audit_questions)
-    if len(item.observations) != len(item.audit_questions): item.observations = [item.observation] * len(
-        item.audit_questions)
-
-    if payload.get("result") == "compliant":
-        evidence_ids = item.audit_questions[idx]["evidence_refs"]
-        has_proof = sess.exec(select(Proof.id).where(Proof.checklist_item_id == item_id,
-                                                     Proof.evidence_id.in_(evidence_ids))).first() is not None
-        if not has_proof:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST,
-                                detail="Au moins une preuve est requise pour déclarer 'compliant'")
-
-    old_result = item.results[idx]
-    new_result = payload.get("result", old_result)
-    if "result" in payload: item.results[idx] = new_result
-
-    existing_nc = sess.exec(select(NonConformite).where(NonConformite.checklist_item_id == item_id,
-                                                        NonConformite.question_index == idx)).first()
-    if new_result == "not-compliant":
-        if not existing_nc:
-            nc = NonConformite(checklist_item_id=item_id, question_index=idx, type_nc="mineure",
-                               statut=StatutNonConformite.non_corrigee)
-            sess.add(nc)
-    elif existing_nc:
-        sess.delete(existing_nc)
-
-    if "status" in payload: item.statuses[idx] = payload["status"]
-    if "observation" in payload: item.observations[idx] = payload["observation"]
-
-    item.updated_at = datetime.utcnow()
-    sess.add(item);
-    sess.commit();
+    # Route pour mettre à jour UNE SEULE question au sein d'un item de checklist.
+    # La question est ciblée par le `questionIndex` fourni dans le payload ; les règles métier
+    # (preuve obligatoire pour "compliant", NC automatique pour "not-compliant") sont
+    # appliquées par `apply_checklist_answers`, partagé avec la route de mise à jour groupée.
+    item = verify_access(team_id, project_id, item_id, current_user, sess, fresh=True)  # Utilise le helper
+    apply_checklist_answers(sess, project_id, [(item, payload)])
+    sess.commit()
     sess.refresh(item)
     return item
 
 
+class ChecklistAnswerUpdate(BaseModel):
+    """Une réponse de la mise à jour groupée : la question `questionIndex` de l'item `item_id`."""
+    item_id: int
+    questionIndex: int
+    status: Optional[str] = None
+    result: Optional[str] = None
+    observation: Optional[str] = None
+
+
+@router.post("/{project_id}/checklist/batch", response_model=List[ISO42001ChecklistItem])
+def update_checklist_items_batch(team_id: int, project_id: int, updates: List[ChecklistAnswerUpdate] = Body(...),
+                                 current_user: User = Depends(get_current_user),
+                                 sess: Session = Depends(get_session)):
+    # Route de mise à jour GROUPÉE : plusieurs réponses (item, question, status/result/observation)
+    # en un seul appel. Les droits sont vérifiés une fois, les items sont chargés en une requête,
+    # et tout est validé en UN seul commit : si une réponse est invalide, aucune n'est enregistrée.
+    assert_member(sess, team_id, current_user, fresh=True)
+    proj_team = sess.exec(select(AIProject.team_id).where(AIProject.id == project_id)).first()
+    if proj_team != team_id:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if not updates:
+        return []
+
+    wanted = {u.item_id for u in updates}
+    items = {
+        it.id: it for it in sess.exec(
+            select(ISO42001ChecklistItem).where(ISO42001ChecklistItem.id.in_(wanted),
+                                                ISO42001ChecklistItem.project_id == project_id)
+        ).all()
+    }
+    if len(items) != len(wanted):
+        raise HTTPException(status_code=404, detail="Checklist item not found")
+
+    apply_checklist_answers(sess, project_id, [(items[u.item_id], u.dict(exclude_unset=True)) for u in updates])
+    sess.commit()
+    return [items[i] for i in sorted(wanted)]
+
+
 # ─────────────────────── GESTION DES ACTIONS CORRECTIVES ─────────────────────────────────
 # BLOC DE GESTION DES ACTIONS CORRECTIVES
 # Cette section gère la création d'actions pour remédier aux non-conformités.
@@ -561,8 +585,9 @@ def update_nonconformite_statut(sess: Session, nc: NonConformite) -> None:
         else:
             nc.statut = StatutNonConformite.non_corrigee
     nc.updated_at = datetime.utcnow()
-    sess.add(nc);
-    sess.commit();
+    sess.add(nc)
+    refresh_item_summary_by_id(sess, nc.checklist_item_id)
+    sess.commit()
     sess.refresh(nc)
 
 
@@ -574,10 +599,7 @@ def create_action_corrective(team_id: int, project_id: int, item_id: int, action
     # 2.  Crée l'action corrective en base de données.
     # 3.  AUTOMATISATION : Appelle le helper `update_nonconformite_statut` pour que le statut
     #     de la non-conformité parente reflète immédiatement l'ajout de cette nouvelle action.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership: raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     item = sess.get(ISO42001ChecklistItem, item_id)
     if not item or item.project_id != project_id: raise HTTPException(404, "Checklist item not found")
@@ -589,10 +611,8 @@ def create_action_corrective(team_id: int, project_id: int, item_id: int, action
     if action.responsible_user_id is not None:
         resp_user = sess.get(User, action.responsible_user_id)
         if not resp_user: raise HTTPException(400, "Utilisateur responsable introuvable")
-        resp_mem = sess.exec(select(TeamMembership).where(TeamMembership.team_id == team_id,
-                                                          TeamMembership.user_id == action.responsible_user_id,
-                                                          TeamMembership.accepted_at.is_not(None))).first()
-        if not resp_mem: raise HTTPException(400, "Utilisateur responsable n'est pas membre de l'équipe")
+        resp_mem = get_membership(sess, team_id, action.responsible_user_id)
+        if not resp_mem or not resp_mem.accepted: raise HTTPException(400, "Utilisateur responsable n'est pas membre de l'équipe")
 
     deadline = action.deadline
     if isinstance(deadline, str): deadline = datetime.fromisoformat(deadline.replace('Z', '+00:00'))
@@ -628,10 +648,7 @@ def update_action_corrective(
     # 2.  Applique les modifications du payload à l'objet `ActionCorrective`.
     # 3.  AUTOMATISATION : Tout comme lors de la création, elle appelle `update_nonconformite_statut`
     #     après la mise à jour pour recalculer et synchroniser le statut de la non-conformité parente.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership: raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     item = sess.get(ISO42001ChecklistItem, item_id)
     if not item or item.project_id != project_id: raise HTTPException(404, "Checklist item not found")
@@ -665,10 +682,7 @@ def update_action_corrective(
 def get_actions_for_item(team_id: int, project_id: int, item_id: int, current_user: User = Depends(get_current_user),
                          sess: Session = Depends(get_session)):
     # Route simple pour lister toutes les actions correctives associées à un item de checklist.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership: raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user)
 
     item = sess.get(ISO42001ChecklistItem, item_id)
     if not item or item.project_id != project_id: raise HTTPException(status_code=404,
@@ -686,10 +700,7 @@ def delete_action_corrective(
     # AUTOMATISATION : Après la suppression, elle recalcule le statut de la non-conformité
     # parente, car la suppression d'une action peut changer l'état global (par exemple,
     # passer de "en cours" à "non corrigée").
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership: raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     item = sess.get(ISO42001ChecklistItem, item_id)
     if not item or item.project_id != project_id: raise HTTPException(status_code=404,
@@ -731,15 +742,17 @@ async def upload_proof(
     #     - Sinon, une nouvelle entrée `Proof` est créée.
     #     Ceci permet aux utilisateurs de facilement remplacer une preuve par une version plus récente.
     # 3.  Retourne l'ID de la preuve et une URL de téléchargement que le front-end peut utiliser.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership: raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user, fresh=True)
 
     item = sess.get(ISO42001ChecklistItem, item_id)
     if not item or item.project_id != project_id: raise HTTPException(404, "Checklist item not found")
 
-    if evidence_id not in {e["id"] for e in item.evidence_required}:
+    # Les preuves attendues des contrôles de la norme viennent de l'index précalculé ; un item ajouté
+    # manuellement (contrôle hors référentiel) garde sa propre liste.
+    expected = CONTROL_EVIDENCE.get(item.control_id)
+    if expected is None:
+        expected = {e["id"] for e in item.evidence_required}
+    if evidence_id not in expected:
         raise HTTPException(400, "evidence_id inconnu pour cet item")
 
     content = await file.read()
@@ -747,6 +760,11 @@ async def upload_proof(
     existing = sess.exec(select(Proof).where(Proof.checklist_item_id == item_id, Proof.evidence_id == evidence_id,
                                              Proof.filename == file.filename)).first()
 
+    # Les preuves sont stockées en base : elles comptent dans le registre d'espace du projet.
+    previous = len(existing.content or b"") if existing else 0
+    check_storage_quota(sess, project_id, len(content), released=previous)
+    add_usage(sess, project_id, blob_bytes=len(content) - previous)
+
     if existing:
         existing.content = content
         existing.created_at = datetime.utcnow()
@@ -784,10 +802,7 @@ def list_proofs_for_question(
     # 3.  Interroge la base de données pour trouver toutes les preuves uploadées
     #     qui correspondent à ces IDs de référence.
     # 4.  Retourne une liste formatée incluant une URL de téléchargement pour chaque preuve.
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership: raise HTTPException(403, "Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user)
 
     item = sess.get(ISO42001ChecklistItem, item_id)
     if not item or item.project_id != project_id: raise HTTPException(status_code=404,
@@ -843,12 +858,11 @@ def download_blank_proof(
     # Route complexe qui ne sert pas une preuve uploadée par l'utilisateur, mais un
     # fichier modèle (.docx) prédéfini, stocké sur le serveur.
     # La logique principale consiste à mapper un `evidence_id` à un nom de fichier (ex: "15.docx").
-    # 1.  Trouve l'index local de la question (`question_index`) qui requiert cet `evidence_id`.
-    # 2.  Calcule le "numéro global" de cette question sur l'ensemble de la checklist du projet.
-    #     Pour cela, elle trie tous les items de la checklist selon l'ordre canonique de la norme,
-    #     puis compte le nombre de questions précédentes pour trouver un offset.
-    # 3.  Construit le chemin du fichier (ex: `/config/documents/15.docx`) à partir de ce numéro global.
-    # 4.  Sert le fichier .docx correspondant à l'aide de `FileResponse`.
+    # 1.  Le "numéro global" de la question qui requiert cet `evidence_id` (rang de la question sur
+    #     l'ensemble de la norme, dans l'ordre canonique des contrôles) et le chemin du modèle
+    #     (ex: `/config/documents/15.docx`) sont lus dans l'index précalculé `iso_index`,
+    #     sans charger les autres items de la checklist.
+    # 2.  Sert le fichier .docx correspondant à l'aide de `FileResponse`.
 
     # ... (Vérifications d'accès)
 
@@ -856,25 +870,11 @@ def download_blank_proof(
     if not item or item.project_id != project_id: raise HTTPException(status_code=404,
                                                                       detail="Checklist item not found")
 
-    question_index = None
-    for idx, q in enumerate(item.audit_questions):
-        if evidence_id in q["evidence_refs"]: question_index = idx; break
-    if question_index is None: raise HTTPException(status_code=404, detail="Evidence ID non trouvé pour cet item")
-
-    req_order = {req["control_id"]: i for i, req in enumerate(ISO42001_REQUIREMENTS)}
-    items = sess.exec(select(ISO42001ChecklistItem).where(ISO42001ChecklistItem.project_id == project_id)).all()
-    items_sorted = sorted(items, key=lambda it: req_order.get(it.control_id, float("inf")))
-
-    offset = 0
-    for it in items_sorted:
-        if it.id == item_id: break
-        offset += len(it.audit_questions)
-    global_number = offset + question_index + 1
-
-    base_dir = FSPath(__file__).resolve().parents[2]
-    docs_dir = base_dir / "config" / "documents"
-    filename = f"{global_number}.docx"
-    file_path = docs_dir / filename
+    ref = evidence_ref(item.control_id, evidence_id)
+    if ref is None: raise HTTPException(status_code=404, detail="Evidence ID non trouvé pour cet item")
+
+    file_path = ref.template_path
+    filename = file_path.name
     if not file_path.exists(): raise HTTPException(status_code=404, detail="Template not found")
 
     return FileResponse(path=str(file_path),
@@ -909,7 +909,7 @@ def update_nonconformite(
 ):
     # Route pour mettre à jour une non-conformité existante.
     # Utile pour modifier manuellement son type (ex: de mineure à majeure) ou sa description.
-    verify_access(team_id, project_id, item_id, current_user, sess)
+    verify_access(team_id, project_id, item_id, current_user, sess, fresh=True)
     nc = sess.get(NonConformite, nc_id)
     if not nc or nc.checklist_item_id != item_id:
         raise HTTPException(status_code=404, detail="NonConformite not found")
@@ -917,8 +917,10 @@ def update_nonconformite(
     update_data = payload.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(nc, key, value)
+    nc.updated_at = datetime.utcnow()
 
     sess.add(nc)
+    refresh_item_summary_by_id(sess, item_id)
     sess.commit()
     sess.refresh(nc)
     return nc
@@ -931,12 +933,14 @@ def delete_nonconformite(
 ):
     # Route pour supprimer manuellement une non-conformité.
     # Peut être utilisé si une non-conformité a été créée par erreur.
-    verify_access(team_id, project_id, item_id, current_user, sess)
+    verify_access(team_id, project_id, item_id, current_user, sess, fresh=True)
     nc = sess.get(NonConformite, nc_id)
     if not nc or nc.checklist_item_id != item_id:
         raise HTTPException(status_code=404, detail="NonConformite not found")
 
     sess.delete(nc)
+    sess.flush()
+    refresh_item_summary_by_id(sess, item_id)
     sess.commit()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -971,10 +975,7 @@ def get_nc_notifications(
     #    soit arrive dans les 7 prochains jours.
     # Le résultat est trié par date limite pour afficher les plus urgentes en premier.
 
-    membership = sess.exec(
-        select(TeamMembership).where(TeamMembership.team_id == team_id, TeamMembership.user_id == current_user.id,
-                                     TeamMembership.accepted_at.is_not(None))).first()
-    if not membership: raise HTTPException(status_code=403, detail="Accès interdit à cette équipe")
+    assert_member(sess, team_id, current_user)
 
     proj = sess.get(AIProject, project_id)
     if not proj or proj.team_id != team_id: raise HTTPException(status_code=404, detail="Projet non trouvé")
@@ -1,69 +1,176 @@
-import os
+import asyncio
+import json
 import traceback
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response
-# pdfkit est une librairie Python qui sert d'interface à l'outil en ligne de commande wkhtmltopdf.
-import pdfkit
-# Ces fonctions sont définies ailleurs et servent à récupérer les données et à générer le HTML.
-from app.utils.report_generator import get_audit_data_for_project, get_risk_analysis_for_project, generate_report_html
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from sqlmodel import Session
+from sse_starlette.sse import EventSourceResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.auth import get_current_user
+from app.models import AIProject, User
+from app.utils.cache import cache_key, not_modified, project_scope, team_scope
+from app.utils.dependencies import assert_member, get_session
+# La collecte des données, le rendu HTML et la conversion PDF sont regroupés dans `report_jobs`.
+from app.utils.report_jobs import (
+    DONE,
+    ERROR,
+    get_report_job,
+    job_state,
+    known_report_hash,
+    report_etag,
+    report_path,
+    run_report,
+    submit_report_job,
+)
 
 # BLOC D'INITIALISATION DU ROUTER
 # Le router est configuré pour toutes les routes liées aux rapports d'une équipe.
 router = APIRouter(prefix="/teams/{team_id}/reports", tags=["reports"])
 
 
+def _report_version(sess: Session, team_id: int, project_id: int, user: User, fresh: bool = False):
+    # Vérifie l'accès puis retourne la clé de version des données du rapport.
+    # `fresh=True` relit l'appartenance en base (création d'une tâche de rapport).
+    assert_member(sess, team_id, user, fresh=fresh)
+    project = sess.get(AIProject, project_id)
+    if not project or project.team_id != team_id:
+        raise HTTPException(status_code=404, detail="Projet introuvable")
+    return cache_key(sess, "audit-risk-pdf", project_scope(project_id), team_scope(team_id))
+
+
+def _job_or_404(job_id: str, team_id: int, project_id: int):
+    job = get_report_job(job_id)
+    if not job or job.team_id != team_id or job.project_id != project_id:
+        raise HTTPException(status_code=404, detail="Tâche de rapport introuvable")
+    return job
+
+
+def _pdf_response(request: Request, project_id: int, data_hash: str) -> Response:
+    etag = report_etag(data_hash)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        str(report_path(data_hash)),
+        media_type="application/pdf",
+        filename=f"rapport_projet_{project_id}.pdf",
+        headers=headers,
+    )
+
+
+# ─── Génération asynchrone ───────────────────────────────────────────────────
+# BLOC DES TÂCHES DE RAPPORT
+# 1. POST .../jobs : crée (ou réutilise) la tâche pour la version courante des données ; 202.
+# 2. GET .../jobs/{job_id} ou .../events (SSE) : progression (étape, pourcentage, erreur).
+# 3. GET .../jobs/{job_id}/download : le PDF, avec l'empreinte des données comme ETag.
+
+@router.post("/{project_id}/audit-risk-report/jobs", status_code=202)
+def create_report_job(
+    team_id: int,
+    project_id: int,
+    current_user: User = Depends(get_current_user),
+    sess: Session = Depends(get_session),
+):
+    ck = _report_version(sess, team_id, project_id, current_user, fresh=True)
+    job = submit_report_job(sess, team_id, project_id, ck.key)
+    return JSONResponse(job_state(job), status_code=200 if job.status == DONE else 202)
+
+
+@router.get("/{project_id}/audit-risk-report/jobs/{job_id}")
+def get_report_job_status(
+    team_id: int,
+    project_id: int,
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    sess: Session = Depends(get_session),
+):
+    assert_member(sess, team_id, current_user)
+    return job_state(_job_or_404(job_id, team_id, project_id))
+
+
+@router.get("/{project_id}/audit-risk-report/jobs/{job_id}/events", response_class=EventSourceResponse)
+async def stream_report_job(
+    team_id: int,
+    project_id: int,
+    job_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    sess: Session = Depends(get_session),
+):
+    # Envoie l'état de la tâche à chaque changement, jusqu'à sa fin (succès ou erreur).
+    # L'état est relu en base : la tâche peut s'exécuter dans un autre worker.
+    assert_member(sess, team_id, current_user)
+    _job_or_404(job_id, team_id, project_id)
+
+    async def event_generator():
+        last = None
+        while True:
+            if await request.is_disconnected():
+                break
+            job = await run_in_threadpool(get_report_job, job_id)
+            state = job_state(job) if job else {"job_id": job_id, "status": ERROR, "error": "Tâche expirée"}
+            if state != last:
+                yield {"event": "progress", "data": json.dumps(state)}
+                last = state
+            if state["status"] in (DONE, ERROR):
+                break
+            await asyncio.sleep(0.5)
+
+    return EventSourceResponse(event_generator())
+
+
+@router.get("/{project_id}/audit-risk-report/jobs/{job_id}/download")
+def download_report_job(
+    team_id: int,
+    project_id: int,
+    job_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    sess: Session = Depends(get_session),
+):
+    assert_member(sess, team_id, current_user)
+    job = _job_or_404(job_id, team_id, project_id)
+    state = job_state(job)
+    if state["status"] == ERROR:
+        raise HTTPException(status_code=500, detail=state["error"] or "Échec de la génération du rapport")
+    if state["status"] != DONE or not job.data_hash or not report_path(job.data_hash).is_file():
+        raise HTTPException(status_code=409, detail="Rapport en cours de génération")
+    return _pdf_response(request, project_id, job.data_hash)
+
+
+# ─── Route historique (synchrone) ────────────────────────────────────────────
 @router.get("/{project_id}/audit-risk-report.pdf")
-def get_audit_risk_report_pdf(team_id: int, project_id: int):
+def get_audit_risk_report_pdf(
+    team_id: int,
+    project_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    sess: Session = Depends(get_session),
+):
     """
-    team_id est ici reçu mais non utilisé côté logique métier,
-    il sert surtout à matcher l’URL et à respecter la structure REST.
+    Génère le rapport dans la requête (conservé pour les anciens clients) ;
+    préférer les routes `.../audit-risk-report/jobs`.
     """
     # BLOC DE GÉNÉRATION DU RAPPORT PDF D'AUDIT ET DE RISQUES
-    # Cette fonction est un pipeline complet pour créer un rapport PDF à la demande.
-    # 1.  Configuration de l'outil : Elle configure `pdfkit` pour utiliser un exécutable
-    #     spécifique de `wkhtmltopdf`, qui est l'outil qui effectue la conversion de HTML en PDF.
-    #     Le chemin est codé en dur, ce qui suppose un déploiement contrôlé.
-    # 2.  Collecte des données : Elle appelle des fonctions externes (`get_audit_data...`,
-    #     `get_risk_analysis...`) pour rassembler toutes les informations nécessaires au rapport.
-    # 3.  Génération du HTML : Ces données sont passées à `generate_report_html` qui
-    #     construit une page HTML complète représentant le rapport.
-    # 4.  Conversion en PDF : `pdfkit.from_string` prend le HTML généré et le convertit
-    #     en une séquence d'octets (bytes) représentant le fichier PDF.
-    # 5.  Envoi de la réponse : Elle retourne une `Response` FastAPI contenant les bytes du PDF,
-    #     avec le type de média approprié et un en-tête `Content-Disposition` qui
-    #     indique au navigateur de télécharger le fichier avec un nom spécifique.
-    #
-    # Note de sécurité importante : Cette route ne contient actuellement aucune vérification
-    # d'authentification ou d'autorisation. N'importe qui connaissant un `project_id` valide
-    # pourrait potentiellement générer un rapport. L'ajout d'un contrôle d'accès est recommandé.
-
-    # Chemin vers wkhtmltopdf (suppose un environnement Windows/WSL)
-    WKHTMLTOPDF_PATH = os.path.join(
-        os.getcwd(), "app", "utils", "wkhtmltopdf", "bin", "wkhtmltopdf.exe"
-    )
-    if not os.path.isfile(WKHTMLTOPDF_PATH):
-        raise RuntimeError(f"Cannot find wkhtmltopdf at {WKHTMLTOPDF_PATH}")
-    PDFKIT_CONFIG = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+    # Même pipeline que les tâches asynchrones (`build_report`), exécuté dans la requête :
+    # 0.  Cache HTTP : l'ETag est l'empreinte des données (le même que pour les tâches). Si la version
+    #     courante des données a déjà produit un PDF et que le navigateur le possède, on répond 304
+    #     sans rien régénérer.
+    # 1.  Collecte des données d'audit et de risques, puis empreinte de ces données.
+    # 2.  Si un PDF existe déjà pour cette empreinte, il est renvoyé tel quel ; sinon le HTML est
+    #     généré, converti par wkhtmltopdf et stocké sous l'empreinte.
+    ck = _report_version(sess, team_id, project_id, current_user)
+    known_hash = known_report_hash(sess, ck.key)
+    if known_hash and not_modified(request, report_etag(known_hash)):
+        return Response(status_code=304, headers={"ETag": report_etag(known_hash)})
 
     try:
-        print("got it")
-        audit_data = get_audit_data_for_project(project_id)
-        risk_data = get_risk_analysis_for_project(project_id)
-        report_html = generate_report_html(audit_data, risk_data)
-
-        # Conversion du HTML en bytes PDF sans passer par un fichier temporaire.
-        pdf_bytes = pdfkit.from_string(report_html, False, configuration=PDFKIT_CONFIG)
-
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=rapport_projet_{project_id}.pdf"
-            },
-        )
+        data_hash = known_hash or run_report(sess, team_id, project_id, ck.key)
     except Exception as e:
         # En cas d'erreur, affiche la trace dans la console et retourne une exception HTTP.
-        # Une erreur 500 (Internal Server Error) serait peut-être plus appropriée qu'une 404.
         traceback.print_tb(e.__traceback__)
-        raise HTTPException(status_code=404, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return _pdf_response(request, project_id, data_hash)
@@ -0,0 +1,38 @@
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from app.auth import get_current_user, User
+from app.db import SessionLocal
+from app.utils.dependencies import assert_member
+from app.utils.search import search, search_available
+
+# BLOC DE LA RECHERCHE PLEIN TEXTE
+# Une seule route, `/teams/{team_id}/search`, interroge l'index FTS5 (cf. `app.utils.search`)
+# sur les documents, l'historique, les observations de la checklist, les commentaires et les preuves.
+router = APIRouter(prefix="/teams/{team_id}/search", tags=["search"])
+
+SearchKind = Literal["document", "history", "observation", "comment", "proof"]
+
+
+@router.get("/")
+def search_team(
+    team_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[List[SearchKind]] = Query(None),
+    project_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+):
+    # BLOC DE RECHERCHE DANS UNE ÉQUIPE
+    # 1. Vérifie que l'utilisateur est membre de l'équipe (les résultats sont filtrés par équipe).
+    # 2. Le dernier mot de `q` est cherché comme préfixe ; `kind` (répétable) et `project_id` restreignent les sources.
+    # 3. Retourne `total` et une page de résultats classés, avec titre et extrait surlignés (<mark>).
+    if not search_available():
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Recherche indisponible sur cette base de données")
+    with SessionLocal() as sess:
+        assert_member(sess, team_id, current_user)
+        result = search(sess.connection(), team_id, q, kinds=kind, project_id=project_id,
+                        limit=limit, offset=offset)
+    return {**result, "limit": limit, "offset": offset}
@@ -8,8 +8,11 @@ from fastapi import Body
 from app.db import SessionLocal
 from app.models import Team, TeamMembership, User
 # on importe aussi le schéma de lecture UserRead
-from app.models import UserRead
+from app.models import TeamUsageRead, UserRead
 from app.auth import get_current_user  # correct import
+# Cache des appartenances : chaque écriture ci-dessous invalide l'entrée concernée (write-through).
+from app.utils.dependencies import assert_member, get_membership, get_session, invalidate_membership
+from app.utils.storage_usage import team_usage
 # `selectinload` est utilisé pour optimiser les requêtes en chargeant
 # les relations en même temps (eager loading).
 from sqlalchemy.orm import selectinload
@@ -76,6 +79,7 @@ def create_team(
         )
         db.add(membership)
         db.commit()
+        invalidate_membership(team.id, current_user.id)
 
         return TeamRead.from_orm(team)
     finally:
@@ -122,6 +126,13 @@ def get_team(team_id: int, current_user: User = Depends(get_current_user)):
     finally:
         db.close()
 
+@router.get("/{team_id}/usage", response_model=TeamUsageRead, summary="Espace de stockage occupé par les projets de l'équipe")
+def get_team_usage(team_id: int, current_user: User = Depends(get_current_user),
+                   sess: Session = Depends(get_session)):
+    # Lu dans le registre d'espace (une ligne par projet, cf. app.utils.storage_usage) : aucun parcours du disque.
+    assert_member(sess, team_id, current_user)
+    return team_usage(sess, team_id)
+
 # ═════════════════════ Gestion des Membres et Invitations ════════════════════════════
 
 @router.get("/invitations", response_model=list[MembershipRead], summary="Liste mes invitations en attente")
@@ -199,12 +210,7 @@ def invite_member(
         if not team:
             raise HTTPException(404, "Team not found")
 
-        mymem = db.exec(
-            select(TeamMembership).where(
-                TeamMembership.team_id == team_id,
-                TeamMembership.user_id == current_user.id
-            )
-        ).first()
+        mymem = get_membership(db, team_id, current_user.id, fresh=True)
         if not mymem or mymem.role not in ("owner", "manager"):
             raise HTTPException(403, "Not authorized to invite")
 
@@ -220,6 +226,7 @@ def invite_member(
         )
         db.add(invite)
         db.commit()
+        invalidate_membership(team_id, user.id)
         db.refresh(invite)
         return MembershipRead.from_orm(invite)
     finally:
@@ -247,6 +254,7 @@ def accept_invite(team_id: int, current_user: User = Depends(get_current_user)):
         mem.accepted_at = datetime.utcnow()
         db.add(mem)
         db.commit()
+        invalidate_membership(team_id, current_user.id)
         db.refresh(mem)
         return MembershipRead.from_orm(mem)
     finally:
@@ -270,6 +278,7 @@ def refuse_my_invite(team_id: int, current_user: User = Depends(get_current_user
             raise HTTPException(404, "Invitation introuvable")
         db.delete(mem)
         db.commit()
+        invalidate_membership(team_id, current_user.id)
     finally:
         db.close()
 
@@ -288,12 +297,7 @@ def remove_member(
         if not db.get(Team, team_id):
             raise HTTPException(404, "Team not found")
 
-        mymem = db.exec(
-            select(TeamMembership).where(
-                TeamMembership.team_id == team_id,
-                TeamMembership.user_id == current_user.id
-            )
-        ).first()
+        mymem = get_membership(db, team_id, current_user.id, fresh=True)
         if not mymem or mymem.role not in ("owner", "manager"):
             raise HTTPException(403, "Not authorized to remove members")
 
@@ -308,6 +312,7 @@ def remove_member(
 
         db.delete(mem)
         db.commit()
+        invalidate_membership(team_id, user_id)
     finally:
         db.close()
 
@@ -344,6 +349,7 @@ def delete_team(team_id: int, current_user: User = Depends(get_current_user)):
 
         db.delete(team)
         db.commit()
+        invalidate_membership(team_id)
     finally:
         db.close()
 
@@ -1,16 +1,32 @@
 # app/tasks/cleanup.py
 import os
 import gzip
+import json
+import logging
 import shutil
 import subprocess
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from sqlmodel import Session, select
+from sqlalchemy import and_, func, or_
+from sqlmodel import Session, delete, select
 
 from app.db import SessionLocal
 from app.models import ModelRun, EvaluationRun, ModelArtifact
+from app.tasks.leader import leader_only
+from app.utils import telemetry
+from app.utils.artifacts import run_output_dir
+from app.utils.code_snapshots import prune_snapshots
+from app.utils.pdf import prune_print_images
+from app.utils.report_jobs import prune_reports
+from app.utils.storage_usage import db_bytes, add_usage, reconcile_usage
+
+logger = logging.getLogger(__name__)
 
 # ------- CONFIG ------------
 # nombre de jours au-delà duquel on purge
@@ -20,41 +36,250 @@ RETENTION_DAYS = 7
 BASE_STORAGE = Path(__file__).resolve().parents[2] / "storage"
 
 
-def purge_old_runs():
-    """Supprime les ModelRun/EvaluationRun > RETENTION_DAYS et leurs artefacts."""
-    cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
-    with SessionLocal() as sess:
-        # 1) ModelRun
-        runs = sess.exec(
-            select(ModelRun).where(ModelRun.finished_at != None, ModelRun.finished_at < cutoff)
-        ).all()
-        for run in runs:
-            # supprimer les artefacts sur le disque
-            arts = sess.exec(select(ModelArtifact).where(ModelArtifact.model_run_id == run.id)).all()
-            for art in arts:
-                try:
-                    os.remove(art.path)
-                except OSError:
-                    pass
-                sess.delete(art)
-            sess.delete(run)
-
-        # 2) EvaluationRun
-        evals = sess.exec(
-            select(EvaluationRun).where(EvaluationRun.finished_at != None, EvaluationRun.finished_at < cutoff)
-        ).all()
-        for er in evals:
-            # si des images ou metrics existent en storage
-            # on suppose er.metrics contient éventuellement des chemins
-            m = er.metrics or {}
-            for sub in m.get("explainability", {}).values():
-                try:
-                    os.remove(sub)
-                except Exception:
-                    pass
-            sess.delete(er)
+# ------- PURGE DES RUNS ------------
+# Les runs expirés sont supprimés par lots (pagination par id croissant), chaque lot dans une
+# transaction courte : le verrou d'écriture n'est jamais tenu pendant toute la purge.
+# Un run n'est purgé qu'une fois toutes ses évaluations expirées elles aussi : un run expiré dont une
+# évaluation est récente (ou en cours) est conservé jusqu'à l'expiration de celle-ci, puisque
+# l'évaluation n'est plus exploitable sans l'artefact du run.
+# Les fichiers ne sont supprimés qu'après le commit du lot, en parallèle. Un fichier du magasin
+# d'artéfacts encore référencé par un artefact conservé (même contenu produit par un autre run)
+# n'est pas supprimé. Les fichiers communs à tous les runs d'un projet (`ref_stats.csv`, graphiques
+# et rapport de dérive de `output/`) ne partent qu'avec le dernier run du projet.
+# Le registre d'espace (app.utils.storage_usage) est décrémenté avec chaque lot : runs et logs en base
+# dans la transaction du lot, octets des fichiers une fois ceux-ci supprimés.
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "200"))
+PURGE_IO_WORKERS = int(os.getenv("PURGE_IO_WORKERS", "4"))
+PURGE_DRY_RUN = os.getenv("PURGE_DRY_RUN", "0") == "1"
+
+
+class PurgeReport:
+    """Bilan d'une purge : lignes supprimées par table, fichiers et octets récupérés."""
+
+    def __init__(self, cutoff: datetime, dry_run: bool):
+        self.cutoff = cutoff
+        self.dry_run = dry_run
+        self.rows: Dict[str, int] = {"modelrun": 0, "evaluationrun": 0, "modelartifact": 0}
+        self.files = 0
+        self.bytes = 0
+        self.errors: List[str] = []
+        self.seconds = 0.0
+
+    def add_files(self, results: Iterable[Tuple[Path, int, Optional[str]]]) -> None:
+        for path, size, error in results:
+            if error:
+                self.errors.append(f"{path}: {error}")
+            elif size >= 0:
+                self.files += 1
+                self.bytes += size
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "cutoff": self.cutoff.isoformat(), "dry_run": self.dry_run, "rows": self.rows,
+            "files": self.files, "bytes": self.bytes, "errors": self.errors[:50],
+            "seconds": round(self.seconds, 3),
+        }
+
 
+def _remove_file(path: Path, dry_run: bool) -> Tuple[Path, int, Optional[str]]:
+    # Retourne (chemin, taille, erreur) ; taille -1 si le fichier n'existe pas.
+    try:
+        size = path.stat().st_size
+        if not dry_run:
+            path.unlink()
+        return path, size, None
+    except FileNotFoundError:
+        return path, -1, None
+    except OSError as e:
+        return path, 0, str(e)
+
+
+def _remove_files(pool: ThreadPoolExecutor, paths: Iterable[Path], dry_run: bool):
+    return list(pool.map(lambda p: _remove_file(p, dry_run), sorted(set(paths))))
+
+
+def _release_file_usage(results: Iterable[Tuple[Path, int, Optional[str]]], owners: Dict[Path, int]) -> None:
+    """Retire du registre d'espace les octets des fichiers supprimés (`owners` : fichier -> projet)."""
+    released: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for path, size, error in results:
+        if size > 0 and not error:
+            category = "logs_bytes" if path.parent == BASE_STORAGE / "logs" else "models_bytes"
+            released[owners[path]][category] -= size
+    if released:
+        with SessionLocal() as sess:
+            for project_id, deltas in released.items():
+                add_usage(sess, project_id, **deltas)
+            sess.commit()
+
+
+def _run_files(run_id: int) -> List[Path]:
+    logs = BASE_STORAGE / "logs"
+    return [logs / f"run_{run_id}.log", logs / f"run_{run_id}.log.gz"]
+
+
+def _run_output_files(project_id: int, run_id: int) -> List[Path]:
+    run_dir = run_output_dir(project_id, run_id)
+    return [p for p in run_dir.rglob("*") if p.is_file()] if run_dir.is_dir() else []
+
+
+def _remove_empty_dirs(path: Path) -> None:
+    # Dossiers de sortie des runs, une fois leurs fichiers supprimés (les plus profonds d'abord).
+    if not path.is_dir():
+        return
+    for d in sorted((p for p in path.rglob("*") if p.is_dir()), key=lambda p: len(p.parts), reverse=True):
+        try:
+            d.rmdir()
+        except OSError:
+            pass
+    try:
+        path.rmdir()
+    except OSError:
+        pass
+
+
+def _project_shared_files(project_id: int) -> List[Path]:
+    base = BASE_STORAGE / "models" / f"project_{project_id}"
+    output = base / "output"
+    plots = list(output.glob("*.png")) if output.is_dir() else []
+    return [base / "ref_stats.csv", base / "drift_report.html", output / "drift_report.html", *plots]
+
+
+def _purge_model_run_batch(sess: Session, runs: Dict[int, int], dry_run: bool, report: PurgeReport,
+                           simulated: Set[int]) -> Dict[Path, int]:
+    """
+    Supprime un lot de ModelRun (`runs` : run -> projet) avec leurs artefacts et évaluations ;
+    retourne les fichiers à supprimer et leur projet.
+    `simulated` : runs des lots précédents d'une simulation, considérés comme déjà supprimés.
+    """
+    run_ids = list(runs)
+    artifacts = sess.exec(
+        select(ModelArtifact.id, ModelArtifact.path, ModelArtifact.project_id)
+        .where(ModelArtifact.model_run_id.in_(run_ids))
+    ).all()
+    paths = {a.path for a in artifacts}
+    # Chemins encore utilisés par un artefact d'un autre run : conservés.
+    gone = simulated.union(run_ids)
+    kept = set(sess.exec(
+        select(ModelArtifact.path).where(ModelArtifact.path.in_(paths), ModelArtifact.model_run_id.not_in(gone))
+    ).all()) if paths else set()
+    eval_ids = sess.exec(select(EvaluationRun.id).where(EvaluationRun.model_run_id.in_(run_ids))).all()
+
+    report.rows["modelartifact"] += len(artifacts)
+    report.rows["evaluationrun"] += len(eval_ids)
+    report.rows["modelrun"] += len(run_ids)
+    if not dry_run:
+        _release_row_usage(sess, ModelRun, ModelRun.id.in_(run_ids), run_count=True)
+        _release_row_usage(sess, EvaluationRun, EvaluationRun.model_run_id.in_(run_ids))
+        # Les évaluations du run (toutes expirées, cf. la sélection des lots) partent avec lui.
+        sess.exec(delete(ModelArtifact).where(ModelArtifact.model_run_id.in_(run_ids)))
+        sess.exec(delete(EvaluationRun).where(EvaluationRun.model_run_id.in_(run_ids)))
+        sess.exec(delete(ModelRun).where(ModelRun.id.in_(run_ids)))
         sess.commit()
+    else:
+        simulated.update(run_ids)
+    owners = {a.path: a.project_id for a in artifacts}
+    files = {Path(p): owners[p] for p in paths - kept}
+    for run_id, project_id in runs.items():
+        files.update(dict.fromkeys(_run_files(run_id) + _run_output_files(project_id, run_id), project_id))
+    return files
+
+
+def _release_row_usage(sess: Session, model, condition, run_count: bool = False) -> None:
+    """Retire du registre d'espace les logs (et le nombre) des runs ou évaluations sur le point d'être supprimés."""
+    rows = sess.exec(
+        select(model.project_id, db_bytes(model.logs), func.count()).where(condition).group_by(model.project_id)
+    ).all()
+    for project_id, log_bytes, count in rows:
+        add_usage(sess, project_id, logs_bytes=-int(log_bytes), run_count=-count if run_count else 0)
+
+
+def purge_old_runs(dry_run: Optional[bool] = None, batch_size: int = PURGE_BATCH_SIZE) -> PurgeReport:
+    """
+    Supprime les ModelRun/EvaluationRun terminés depuis plus de RETENTION_DAYS et leurs fichiers.
+    En mode `dry_run`, rien n'est supprimé : le bilan indique ce qui le serait.
+    """
+    dry_run = PURGE_DRY_RUN if dry_run is None else dry_run
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    report = PurgeReport(cutoff, dry_run)
+    purged_by_project: Dict[int, int] = defaultdict(int)
+    simulated: Set[int] = set()   # mode simulation : runs comptés comme supprimés
+
+    with ThreadPoolExecutor(max_workers=PURGE_IO_WORKERS, thread_name_prefix="purge") as pool:
+        # 1) ModelRun expirés (et dont aucune évaluation n'est récente), par lots
+        recent_evaluations = select(EvaluationRun.model_run_id).where(or_(
+            EvaluationRun.finished_at >= cutoff,
+            and_(EvaluationRun.finished_at == None, EvaluationRun.created_at >= cutoff),  # noqa: E711
+        ))
+        last_id = 0
+        while True:
+            with SessionLocal() as sess:
+                batch = sess.exec(
+                    select(ModelRun.id, ModelRun.project_id)
+                    .where(ModelRun.finished_at != None, ModelRun.finished_at < cutoff, ModelRun.id > last_id,
+                           ModelRun.id.not_in(recent_evaluations))
+                    .order_by(ModelRun.id)
+                    .limit(batch_size)
+                ).all()
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                for r in batch:
+                    purged_by_project[r.project_id] += 1
+                files = _purge_model_run_batch(sess, {r.id: r.project_id for r in batch}, dry_run, report, simulated)
+            results = _remove_files(pool, files, dry_run)
+            report.add_files(results)
+            if not dry_run:
+                _release_file_usage(results, files)
+                for r in batch:
+                    _remove_empty_dirs(run_output_dir(r.project_id, r.id))
+
+        # 2) EvaluationRun expirés restants (leurs graphiques sont partagés au niveau du projet)
+        last_id = 0
+        while True:
+            with SessionLocal() as sess:
+                query = (
+                    select(EvaluationRun.id)
+                    .where(EvaluationRun.finished_at != None, EvaluationRun.finished_at < cutoff,
+                           EvaluationRun.id > last_id)
+                    .order_by(EvaluationRun.id)
+                    .limit(batch_size)
+                )
+                if simulated:
+                    query = query.where(EvaluationRun.model_run_id.not_in(simulated))
+                eval_ids = sess.exec(query).all()
+                if not eval_ids:
+                    break
+                last_id = eval_ids[-1]
+                report.rows["evaluationrun"] += len(eval_ids)
+                if not dry_run:
+                    _release_row_usage(sess, EvaluationRun, EvaluationRun.id.in_(eval_ids))
+                    sess.exec(delete(EvaluationRun).where(EvaluationRun.id.in_(eval_ids)))
+                    sess.commit()
+
+        # 3) Fichiers communs des projets qui n'ont plus aucun run
+        if purged_by_project:
+            with SessionLocal() as sess:
+                remaining = dict(sess.exec(
+                    select(ModelRun.project_id, func.count())
+                    .where(ModelRun.project_id.in_(purged_by_project))
+                    .group_by(ModelRun.project_id)
+                ).all())
+            shared: Dict[Path, int] = {}
+            for project_id, purged in purged_by_project.items():
+                left = remaining.get(project_id, 0) - (purged if dry_run else 0)
+                if left <= 0:
+                    shared.update(dict.fromkeys(_project_shared_files(project_id), project_id))
+            results = _remove_files(pool, shared, dry_run)
+            report.add_files(results)
+            if not dry_run:
+                _release_file_usage(results, shared)
+
+    report.seconds = time.perf_counter() - started
+    if not dry_run:
+        telemetry.inc("purge_reclaimed_bytes_total", report.bytes, help="Octets libérés par la purge des runs")
+    logger.info("Purge des runs%s : %s", " (simulation)" if dry_run else "", json.dumps(report.as_dict()))
+    return report
 
 
 def prune_docker_containers():
@@ -97,10 +322,44 @@ def compress_old_logs():
         sess.commit()
 
 
-def start_scheduler():
+def prune_print_image_cache():
+    """Supprime les images du cache d'impression PDF inutilisées depuis RETENTION_DAYS."""
+    prune_print_images(RETENTION_DAYS)
+
+
+def prune_report_files():
+    """Supprime les rapports PDF inutilisés depuis RETENTION_DAYS et les tâches de rapport plus anciennes."""
+    prune_reports(RETENTION_DAYS)
+
+
+def prune_code_snapshots():
+    """Supprime les instantanés de code (et leurs fichiers) qui ne sont plus rattachés à aucun run."""
+    prune_snapshots(RETENTION_DAYS)
+
+
+def reconcile_storage_usage():
+    """Recale le registre d'espace de chaque projet sur le disque et la base (écritures non suivies, dérives)."""
+    reconcile_usage()
+
+
+def start_scheduler() -> BackgroundScheduler:
+    # Démarré uniquement dans le processus qui détient le bail des tâches planifiées (app.tasks.leader).
     sched = BackgroundScheduler(timezone="UTC")
     # purge quotidienne à 2h00 UTC
-    sched.add_job(purge_old_runs,    "cron", hour=2, minute=0, id="purge_runs")
-    sched.add_job(prune_docker_containers, "cron", hour=3, minute=0, id="prune_docker")
-    sched.add_job(compress_old_logs, "cron", hour=4, minute=0, id="compress_logs")
+    sched.add_job(leader_only(purge_old_runs),    "cron", hour=2, minute=0, id="purge_runs")
+    sched.add_job(leader_only(prune_docker_containers), "cron", hour=3, minute=0, id="prune_docker")
+    sched.add_job(leader_only(compress_old_logs), "cron", hour=4, minute=0, id="compress_logs")
+    sched.add_job(leader_only(prune_report_files), "cron", hour=4, minute=15, id="prune_reports")
+    sched.add_job(leader_only(prune_print_image_cache), "cron", hour=4, minute=30, id="prune_print_images")
+    sched.add_job(leader_only(prune_code_snapshots), "cron", hour=4, minute=45, id="prune_code_snapshots")
+    sched.add_job(leader_only(reconcile_storage_usage), "cron", hour=5, minute=0, id="reconcile_storage_usage")
     sched.start()
+    return sched
+
+
+if __name__ == "__main__":
+    # Purge manuelle : `python -m app.tasks.cleanup [--dry-run]` (depuis `backend/`).
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    print(json.dumps(purge_old_runs(dry_run="--dry-run" in sys.argv).as_dict(), indent=2))
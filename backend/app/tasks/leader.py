@@ -0,0 +1,206 @@
+# app/tasks/leader.py
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app.db import SessionLocal
+from app.models import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+# BLOC DE L'ÉLECTION DU PROCESSUS « LEADER » DES TÂCHES PLANIFIÉES
+# Avec plusieurs workers uvicorn, chaque processus exécute `on_startup` : sans coordination,
+# chaque tâche planifiée (purge, nettoyage Docker, alertes de NC) tournerait N fois en parallèle.
+# Les processus se disputent donc un bail stocké en base (`SchedulerLease`) :
+#   - le détenteur le renouvelle toutes les `SCHEDULER_LEASE_RENEW` secondes ;
+#   - un autre processus ne peut le prendre qu'une fois expiré (`SCHEDULER_LEASE_TTL` secondes),
+#     c'est-à-dire si le leader s'est arrêté sans le libérer (crash, kill -9) ;
+#   - un arrêt propre libère le bail : un autre processus le reprend au renouvellement suivant.
+# Seul le détenteur du bail démarre les planificateurs APScheduler ; chaque tâche revérifie le bail
+# avant de s'exécuter (cas d'un processus suspendu qui aurait perdu le bail sans le savoir).
+#
+# `SCHEDULER_MODE` : "lease" (défaut) pour l'élection dans les processus de l'API, "off" pour ne
+# lancer aucune tâche dans l'API et utiliser le processus dédié : `python -m app.tasks.leader`.
+
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "lease").lower()
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "30"))
+SCHEDULER_LEASE_RENEW = float(os.getenv("SCHEDULER_LEASE_RENEW", "10"))
+LEASE_NAME = "scheduler"
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# ─── Bail en base ────────────────────────────────────────────────────────────
+
+def try_acquire(name: str = LEASE_NAME, holder: str = INSTANCE_ID, ttl: Optional[float] = None) -> bool:
+    """Prend ou renouvelle le bail `name` pour `holder` (atomique). Retourne True si `holder` le détient."""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=SCHEDULER_LEASE_TTL if ttl is None else ttl)
+    with SessionLocal() as sess:
+        # Un seul UPDATE conditionnel : renouvellement par le détenteur ou reprise d'un bail expiré.
+        res = sess.execute(
+            update(SchedulerLease)
+            .where(
+                SchedulerLease.name == name,
+                or_(SchedulerLease.holder == holder, SchedulerLease.expires_at < now),
+            )
+            .values(holder=holder, expires_at=expires_at)
+        )
+        if res.rowcount == 0:
+            # Pas de ligne (premier démarrage) ou bail détenu par un autre processus.
+            try:
+                sess.execute(insert(SchedulerLease).values(
+                    name=name, holder=holder, expires_at=expires_at, acquired_at=now,
+                ))
+            except IntegrityError:
+                sess.rollback()
+                return False
+        sess.commit()
+    return True
+
+
+def release(name: str = LEASE_NAME, holder: str = INSTANCE_ID) -> None:
+    """Libère le bail s'il appartient à `holder` (il expire immédiatement)."""
+    with SessionLocal() as sess:
+        sess.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name, SchedulerLease.holder == holder)
+            .values(expires_at=datetime.utcnow())
+        )
+        sess.commit()
+
+
+# ─── Élection ────────────────────────────────────────────────────────────────
+
+class LeaderElector:
+    """
+    Maintient le bail dans un thread et démarre les planificateurs tant que ce processus en est le détenteur.
+    `starters` : fonctions qui démarrent un planificateur APScheduler et le retournent.
+    """
+
+    def __init__(self, starters: List[Callable[[], object]], name: str = LEASE_NAME, holder: str = INSTANCE_ID):
+        self.name = name
+        self.holder = holder
+        self.starters = starters
+        self._schedulers: List[object] = []
+        self._valid_until: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_leader(self) -> bool:
+        # Vrai tant que le dernier renouvellement réussi n'a pas expiré (vu de ce processus).
+        return self._valid_until is not None and datetime.utcnow() < self._valid_until
+
+    def _tick(self) -> None:
+        attempt = datetime.utcnow()
+        try:
+            acquired = try_acquire(self.name, self.holder)
+        except Exception:
+            logger.exception("Renouvellement du bail %s impossible", self.name)
+            acquired = False
+        if acquired:
+            # Marge d'un intervalle de renouvellement : un leader ralenti s'arrête avant qu'un autre ne reprenne.
+            self._valid_until = attempt + timedelta(seconds=SCHEDULER_LEASE_TTL - SCHEDULER_LEASE_RENEW)
+            if not self._schedulers:
+                logger.info("Bail %s obtenu par %s : démarrage des tâches planifiées", self.name, self.holder)
+                self._schedulers = [start() for start in self.starters]
+        elif self._schedulers or self._valid_until is not None:
+            logger.warning("Bail %s perdu par %s : arrêt des tâches planifiées", self.name, self.holder)
+            self._stop_schedulers()
+
+    def _stop_schedulers(self) -> None:
+        self._valid_until = None
+        schedulers, self._schedulers = self._schedulers, []
+        for sched in schedulers:
+            try:
+                sched.shutdown(wait=False)
+            except Exception:
+                logger.exception("Arrêt du planificateur impossible")
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._tick()
+            self._stop.wait(SCHEDULER_LEASE_RENEW)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Arrête les planificateurs et libère le bail (reprise rapide par un autre processus)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        was_leader = bool(self._schedulers)
+        self._stop_schedulers()
+        if was_leader:
+            try:
+                release(self.name, self.holder)
+            except Exception:
+                logger.exception("Libération du bail %s impossible", self.name)
+
+
+_elector: Optional[LeaderElector] = None
+
+
+def leader_only(job: Callable[[], object]) -> Callable[[], object]:
+    """Enveloppe une tâche planifiée : elle ne s'exécute que si ce processus détient encore le bail."""
+    def wrapper():
+        if _elector is not None and not _elector.is_leader():
+            logger.warning("Tâche %s ignorée : bail non détenu", job.__name__)
+            return None
+        return job()
+    wrapper.__name__ = job.__name__
+    wrapper.__doc__ = job.__doc__
+    return wrapper
+
+
+def start_leader_election(starters: List[Callable[[], object]]) -> Optional[LeaderElector]:
+    """Démarre l'élection (sauf si `SCHEDULER_MODE=off`). Retourne l'électeur, ou None."""
+    global _elector
+    if SCHEDULER_MODE == "off":
+        logger.info("SCHEDULER_MODE=off : aucune tâche planifiée dans ce processus")
+        return None
+    _elector = LeaderElector(starters)
+    _elector.start()
+    return _elector
+
+
+def stop_leader_election() -> None:
+    global _elector
+    if _elector is not None:
+        _elector.stop()
+        _elector = None
+
+
+# ─── Processus dédié ─────────────────────────────────────────────────────────
+
+def main() -> None:
+    """Exécute les tâches planifiées hors de l'API (à combiner avec `SCHEDULER_MODE=off` côté API)."""
+    from app.db import init_db
+    from app.tasks.cleanup import start_scheduler as cleanup_scheduler
+    from app.tasks.scheduler import start_scheduler as notif_scheduler
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    init_db()
+    # Le processus dédié participe aussi à l'élection : plusieurs instances restent sans danger.
+    global _elector
+    _elector = LeaderElector([cleanup_scheduler, notif_scheduler])
+    _elector.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_leader_election()
+
+
+if __name__ == "__main__":
+    main()
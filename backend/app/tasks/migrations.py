@@ -0,0 +1,214 @@
+# app/tasks/migrations.py
+import logging
+import os
+import time
+
+from sqlalchemy import case, func, inspect, or_, text
+from sqlmodel import select
+
+from app.db import SessionLocal, engine
+from app.models import AIProject, DocumentHistory, ISO42001ChecklistItem, StorageUsage
+from app.tasks.leader import release, try_acquire
+from app.utils.checklist import repair_item_lengths, seed_project_checklist
+from app.utils.doc_history import HISTORY_KEYFRAME_INTERVAL, compact_document_history
+from app.utils.compliance import rebuild_project_summaries
+from app.utils.search import create_search_table, rebuild_search_index
+from app.utils.storage_usage import reconcile_usage
+
+logger = logging.getLogger(__name__)
+
+# BLOC DES MIGRATIONS DE DONNÉES
+# `init_db()` crée les tables manquantes mais ne transforme pas les données existantes.
+# Les fonctions ci-dessous sont des migrations ponctuelles et idempotentes : elles sont
+# exécutées au démarrage et ne font rien quand les données sont déjà à jour.
+# Avec plusieurs workers uvicorn, chacun exécute le démarrage en même temps : les migrations sont
+# donc sérialisées par un bail en base (`migrations`, cf. app.tasks.leader). Un seul worker les
+# exécute à la fois ; les autres attendent sa fin, puis les rejouent (elles ne trouvent alors plus
+# rien à faire). Elles peuvent aussi être lancées à part : `python -m app.tasks.migrations`.
+MIGRATION_LEASE = "migrations"
+# Durée du bail : un worker arrêté pendant les migrations ne bloque les autres qu'au plus ce délai (s).
+MIGRATION_LEASE_TTL = float(os.getenv("MIGRATION_LEASE_TTL", "900"))
+
+# Colonnes ajoutées aux modèles après la création des tables : (table, colonne, définition SQL).
+# `create_all` ne modifie pas une table existante, elles sont donc ajoutées ici si besoin.
+NEW_COLUMNS = [
+    ("user", "token_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("documenthistory", "is_keyframe", "BOOLEAN NOT NULL DEFAULT 1"),
+    ("documenthistory", "delta", "VARCHAR"),
+    ("modelrun", "snapshot_id", "VARCHAR REFERENCES codesnapshot (id)"),
+    ("modelartifact", "sha256", "VARCHAR"),
+    ("document", "size", "INTEGER NOT NULL DEFAULT 0"),
+]
+# Remplissage des colonnes ajoutées, exécuté une seule fois, juste après leur ajout.
+COLUMN_BACKFILLS = {
+    ("document", "size"): "UPDATE document SET size = length(content)",
+}
+
+
+def add_missing_columns() -> None:
+    """Ajoute (ALTER TABLE ... ADD COLUMN) les colonnes de `NEW_COLUMNS` absentes de la base."""
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table, column, ddl in NEW_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {ddl}"))
+                if (table, column) in COLUMN_BACKFILLS:
+                    conn.execute(text(COLUMN_BACKFILLS[(table, column)]))
+                logger.info("Colonne %s.%s ajoutée", table, column)
+
+
+def create_missing_indexes() -> None:
+    """Ajoute les index déclarés dans les modèles après la création des tables existantes."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_iso42001checklistitem_project_id "
+            "ON iso42001checklistitem (project_id)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_documenthistory_document_id "
+            "ON documenthistory (document_id)"
+        ))
+        # Passages incrémentaux des alertes de NC (app.tasks.scheduler).
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_nonconformite_updated_at ON nonconformite (updated_at)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_nonconformite_deadline_correction ON nonconformite (deadline_correction)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_modelrun_snapshot_id ON modelrun (snapshot_id)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_modelartifact_sha256 ON modelartifact (sha256)"
+        ))
+        # Pagination de la liste des documents d'une équipe (app.routers.documents.list_documents).
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_document_team_id_updated_at_id ON document (team_id, updated_at, id)"
+        ))
+
+
+def seed_missing_checklists() -> None:
+    """Crée la checklist des projets qui n'en ont pas (projets créés avant l'initialisation à la création)."""
+    with SessionLocal() as sess:
+        project_ids = sess.exec(
+            select(AIProject.id).where(
+                ~select(ISO42001ChecklistItem.id)
+                .where(ISO42001ChecklistItem.project_id == AIProject.id)
+                .exists()
+            )
+        ).all()
+        for pid in project_ids:
+            seed_project_checklist(sess, pid)
+        sess.commit()
+    if project_ids:
+        logger.info("Checklist ISO 42001 créée pour %d projets", len(project_ids))
+
+
+def repair_checklist_items() -> None:
+    """Aligne `statuses`/`results`/`observations` sur le nombre de questions de chaque item."""
+    # Seuls les items dont une longueur diffère sont chargés (comparaison faite en SQL) : le coût au
+    # démarrage ne dépend pas du volume de checklists déjà correctes.
+    n_questions = func.coalesce(func.json_array_length(ISO42001ChecklistItem.audit_questions), 0)
+    drifted = or_(*(
+        func.coalesce(func.json_array_length(column), -1) != n_questions
+        for column in (ISO42001ChecklistItem.statuses, ISO42001ChecklistItem.results,
+                       ISO42001ChecklistItem.observations)
+    ))
+    with SessionLocal() as sess:
+        candidates = sess.exec(select(ISO42001ChecklistItem).where(drifted)).all()
+        repaired = [it for it in candidates if repair_item_lengths(it)]
+        for it in repaired:
+            sess.add(it)
+        sess.flush()
+        for pid in {it.project_id for it in repaired}:
+            rebuild_project_summaries(sess, pid)
+        sess.commit()
+    if repaired:
+        logger.info("%d items de checklist réparés", len(repaired))
+
+
+def backfill_compliance_summaries() -> None:
+    """Crée les lignes `ProjectComplianceSummary` manquantes pour les items existants."""
+    with SessionLocal() as sess:
+        n = rebuild_project_summaries(sess, only_missing=True)
+        sess.commit()
+    if n:
+        logger.info("Résumés de conformité créés pour %d items de checklist", n)
+
+
+def compact_document_histories() -> None:
+    """Convertit en deltas les versions archivées en copie complète (historique d'avant les deltas)."""
+    # Seuls les documents qui ont plus d'images clés que nécessaire sont relus.
+    keyframes = func.sum(case((DocumentHistory.is_keyframe == True, 1), else_=0))  # noqa: E712
+    with SessionLocal() as sess:
+        doc_ids = sess.exec(
+            select(DocumentHistory.document_id)
+            .group_by(DocumentHistory.document_id)
+            .having(keyframes > (func.count() + HISTORY_KEYFRAME_INTERVAL - 1) / HISTORY_KEYFRAME_INTERVAL)
+        ).all()
+    total = 0
+    for doc_id in doc_ids:
+        # une transaction par document : un seul historique en mémoire à la fois
+        with SessionLocal() as sess:
+            total += compact_document_history(sess, doc_id)
+            sess.commit()
+    if total:
+        logger.info("%d versions de documents compactées en deltas", total)
+
+
+def build_search_index() -> None:
+    """Crée et remplit l'index de recherche plein texte à sa première mise en service."""
+    # Exécutée avant les autres migrations de données : leurs écritures sont ensuite indexées au fil de l'eau.
+    if not create_search_table():
+        return
+    n = rebuild_search_index()
+    if n:
+        logger.info("Index de recherche construit : %d entrées", n)
+
+
+def backfill_storage_usage() -> None:
+    """Calcule le registre d'espace des projets qui n'en ont pas encore (projets d'avant le registre)."""
+    with SessionLocal() as sess:
+        missing = sess.exec(
+            select(AIProject.id).where(AIProject.id.not_in(select(StorageUsage.project_id)))
+        ).all()
+    if missing:
+        reconcile_usage(missing)
+        logger.info("Registre d'espace calculé pour %d projets", len(missing))
+
+
+def run_migrations() -> None:
+    """Exécute toutes les migrations de données, dans l'ordre."""
+    add_missing_columns()
+    create_missing_indexes()
+    build_search_index()
+    seed_missing_checklists()
+    repair_checklist_items()
+    backfill_compliance_summaries()
+    compact_document_histories()
+    backfill_storage_usage()
+
+
+def run_migrations_exclusive() -> None:
+    """`run_migrations`, exécuté par un seul processus à la fois (bail `migrations`)."""
+    waiting = False
+    while not try_acquire(MIGRATION_LEASE, ttl=MIGRATION_LEASE_TTL):
+        if not waiting:
+            logger.info("Migrations en cours dans un autre processus : attente de leur fin")
+            waiting = True
+        time.sleep(1)
+    try:
+        run_migrations()
+    finally:
+        release(MIGRATION_LEASE)
+
+
+if __name__ == "__main__":
+    # Migrations en étape séparée (avant de démarrer les workers) : `python -m app.tasks.migrations`.
+    from app.db import init_db
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    init_db()
+    run_migrations_exclusive()
@@ -1,65 +1,107 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Optional
+
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, timedelta
-from sqlmodel import Session, select
+from sqlalchemy import exists, insert, or_
+from sqlmodel import select
+
 from app.db import SessionLocal
-from app.models import NonConformite, AIProject
-import logging
-from app.models import Notification
+from app.models import AIProject, ISO42001ChecklistItem, NonConformite, Notification
+from app.tasks.leader import leader_only
+from app.utils import telemetry
+
 logger = logging.getLogger(__name__)
 
+# BLOC DES ALERTES DE NON-CONFORMITÉS CRITIQUES
+# Toutes les minutes, une notification est créée pour chaque NC majeure non corrigée dont l'échéance
+# tombe dans les `NC_ALERT_WINDOW_DAYS` jours, sauf si une notification non lue existe déjà pour elle.
+# Le tout tient en une requête (jointures item/projet + anti-jointure sur les notifications) suivie
+# d'un INSERT groupé. Après le premier passage, seules les NC susceptibles d'avoir changé d'état
+# sont examinées (« high-water mark ») :
+#   - celles modifiées depuis le passage précédent (`updated_at`, avec une marge de recouvrement
+#     pour les transactions validées en retard : l'anti-jointure évite les doublons) ;
+#   - celles dont l'échéance vient d'entrer dans la fenêtre (entre l'ancien et le nouveau seuil).
+
+NC_ALERT_WINDOW_DAYS = int(os.getenv("NC_ALERT_WINDOW_DAYS", "7"))
+NC_ALERT_OVERLAP = timedelta(seconds=int(os.getenv("NC_ALERT_OVERLAP_SECONDS", "60")))
 
+_lock = Lock()
+# Début et seuil d'échéance du dernier passage réussi (None : prochain passage complet).
+_last_run: Optional[datetime] = None
+_last_threshold: Optional[datetime] = None
 
 
-def check_nc_alerts():
-    with SessionLocal() as sess:
+def check_nc_alerts() -> int:
+    """Crée les notifications manquantes pour les NC critiques ; retourne le nombre créé."""
+    global _last_run, _last_threshold
+    started = time.perf_counter()
+    with _lock:   # un seul passage à la fois (APScheduler peut chevaucher deux exécutions)
         now = datetime.utcnow()
-        seuil = now + timedelta(days=7)
+        seuil = now + timedelta(days=NC_ALERT_WINDOW_DAYS)
 
-        nc_critique = sess.exec(
-            select(NonConformite)
+        query = (
+            select(
+                NonConformite.id, NonConformite.question_index, NonConformite.deadline_correction,
+                ISO42001ChecklistItem.control_id, ISO42001ChecklistItem.project_id, AIProject.team_id,
+            )
+            .join(ISO42001ChecklistItem, ISO42001ChecklistItem.id == NonConformite.checklist_item_id)
+            .join(AIProject, AIProject.id == ISO42001ChecklistItem.project_id)
             .where(
                 NonConformite.type_nc == "majeure",
                 NonConformite.statut != "corrigee",
                 NonConformite.deadline_correction <= seuil,
+                # Anti-jointure : pas de notification non lue pour cette NC.
+                ~exists().where(
+                    Notification.nonconformite_id == NonConformite.id,
+                    Notification.read == False,  # noqa: E712
+                ),
             )
-        ).all()
+        )
+        if _last_run is not None:
+            query = query.where(or_(
+                NonConformite.updated_at > _last_run - NC_ALERT_OVERLAP,
+                NonConformite.deadline_correction > _last_threshold,
+            ))
 
-        for nc in nc_critique:
-            # Vérifie si notification existe déjà et non lue
-            existing = sess.exec(
-                select(Notification)
-                .where(
-                    Notification.nonconformite_id == nc.id,
-                    Notification.read == False,
-                )
-            ).first()
-            if existing:
-                continue
-
-            item = nc.checklist_item  # accès direct à l’item parent
-            message = (
-                    f"NC majeure {item.control_id}-Q{nc.question_index + 1} – "
-                    f"deadline "
-                    f"{nc.deadline_correction.strftime('%Y-%m-%d') if nc.deadline_correction else 'inconnue'}"
-                    )
-            notification = Notification(
-                team_id=nc.checklist_item.project.team_id,
-                project_id=nc.checklist_item.project_id,
-                nonconformite_id=nc.id,
-                message=message,
-            )
-            sess.add(notification)
+        with SessionLocal() as sess:
+            rows = sess.exec(query).all()
+            if rows:
+                sess.execute(insert(Notification), [
+                    {
+                        "team_id": r.team_id,
+                        "project_id": r.project_id,
+                        "nonconformite_id": r.id,
+                        "message": (
+                            f"NC majeure {r.control_id}-Q{r.question_index + 1} – deadline "
+                            f"{r.deadline_correction.strftime('%Y-%m-%d') if r.deadline_correction else 'inconnue'}"
+                        ),
+                        "created_at": now, "updated_at": now, "read": False,
+                    }
+                    for r in rows
+                ])
+            sess.commit()
+        _last_run, _last_threshold = now, seuil
 
-        sess.commit()
+    if rows:
+        telemetry.inc("nc_alerts_created_total", len(rows), help="Notifications de NC critiques créées")
+    telemetry.observe("nc_alert_tick_seconds", time.perf_counter() - started,
+                      help="Durée d'un passage de la vérification des NC critiques")
+    return len(rows)
 
 
-def start_scheduler():
+def start_scheduler() -> BackgroundScheduler:
+    # Démarré uniquement dans le processus qui détient le bail des tâches planifiées (app.tasks.leader).
     scheduler = BackgroundScheduler()
     # Tâche qui tourne tous les jours à 2h du matin (exemple)
     #trigger = CronTrigger(hour=2, minute=0)
     trigger = CronTrigger(minute="*/1")
 
-    scheduler.add_job(check_nc_alerts, trigger, id="check_nc_alerts", replace_existing=True)
+    scheduler.add_job(leader_only(check_nc_alerts), trigger, id="check_nc_alerts", replace_existing=True)
     scheduler.start()
     logger.info("Scheduler APScheduler démarré avec la tâche check_nc_alerts")
+    return scheduler
@@ -0,0 +1,91 @@
+# app/utils/artifacts.py
+import hashlib
+import os
+import shutil
+import stat
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from sqlmodel import Session, select
+
+from app.models import ModelArtifact
+
+# BLOC DU REGISTRE DES ARTÉFACTS
+# Chaque entraînement écrit dans son propre dossier (storage/runs/project_<id>/run_<id>) : un run ne
+# peut plus écraser le modèle d'un autre. Ce dossier est hors du dossier du code, que chaque upload
+# remplace en entier et que les instantanés de code parcourent. À la fin du run, les fichiers modèle sont
+# déplacés dans un magasin adressé par leur contenu (storage/artifacts/ab/abcd…, empreinte SHA-256) :
+# un même modèle produit deux fois n'est stocké qu'une fois, et `ModelArtifact` en garde le chemin,
+# la taille et l'empreinte (qui sert aussi d'ETag au téléchargement).
+
+STORAGE_ROOT = Path(__file__).resolve().parents[2] / "storage"
+ARTIFACT_STORE = STORAGE_ROOT / "artifacts"
+MODEL_FILES = ("model.pt", "model.joblib", "model.onnx")
+
+
+def project_dir(project_id: int) -> Path:
+    return STORAGE_ROOT / "models" / f"project_{project_id}"
+
+
+def run_output_dir(project_id: int, run_id: int) -> Path:
+    """Dossier de sortie propre à un run d'entraînement (hors du dossier du code)."""
+    return STORAGE_ROOT / "runs" / f"project_{project_id}" / f"run_{run_id}"
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def artifact_filename(art: ModelArtifact) -> str:
+    # Dans le magasin, le fichier porte son empreinte : le nom d'origine se déduit du format.
+    return f"model.{art.format}" if art.sha256 else Path(art.path).name
+
+
+def store_file(src: Path) -> tuple[Path, str, int]:
+    """Déplace `src` dans le magasin (ou le supprime s'il y est déjà) ; retourne (chemin, empreinte, taille)."""
+    digest = file_sha256(src)
+    size = src.stat().st_size
+    dest = ARTIFACT_STORE / digest[:2] / digest
+    if dest.exists():
+        src.unlink()
+        os.utime(dest)
+    else:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(src, dest)
+        except OSError:  # autre système de fichiers
+            shutil.move(str(src), dest)
+        os.chmod(dest, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+    return dest, digest, size
+
+
+def register_artifacts(sess: Session, project_id: int, run_id: int, output_dir: Path,
+                       metrics: Optional[Dict[str, Any]] = None) -> tuple[List[ModelArtifact], int]:
+    """
+    Enregistre les fichiers modèle de `output_dir` dans le magasin et crée leurs `ModelArtifact`.
+    Retourne les artéfacts et les octets nouveaux pour le projet (fichiers qu'il ne stockait pas encore).
+    Ne fait pas de commit.
+    """
+    artifacts, new_bytes = [], 0
+    for name in MODEL_FILES:
+        candidate = output_dir / name
+        if not candidate.is_file():
+            continue
+        path, digest, size = store_file(candidate)
+        known = sess.exec(
+            select(ModelArtifact.id).where(ModelArtifact.project_id == project_id, ModelArtifact.sha256 == digest)
+        ).first()
+        if known is None:
+            new_bytes += size
+        art = ModelArtifact(
+            project_id=project_id, model_run_id=run_id,
+            path=str(path), format=candidate.suffix.lstrip("."),
+            size_bytes=size, sha256=digest, metrics=dict(metrics or {}),
+        )
+        sess.add(art)
+        artifacts.append(art)
+    return artifacts, new_bytes
@@ -0,0 +1,244 @@
+# app/utils/cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Set
+
+from cachetools import LRUCache
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import event, inspect as sa_inspect, select as sa_select
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+
+from app.db import dialect_insert
+from app.models import (
+    ActionCorrective,
+    AIProject,
+    Comment,
+    DataVersion,
+    EvaluationRun,
+    ISO42001ChecklistItem,
+    NonConformite,
+    Proof,
+    Team,
+    TeamMembership,
+    User,
+)
+
+logger = logging.getLogger(__name__)
+
+# BLOC DU CACHE DE RÉPONSES VERSIONNÉ
+# Les réponses coûteuses (tableau de bord, données d'audit, analyse de risques) sont mises en cache
+# sous une clé (espace de noms, périmètre, version). La version de chaque périmètre est stockée en BDD
+# (`DataVersion`) et incrémentée automatiquement, dans la même transaction, dès qu'une écriture touche
+# la checklist, les NC, les actions, les preuves, les évaluations ou les commentaires, ainsi que les noms
+# affichés (équipe renommée, utilisateur renommé : toutes ses équipes). Une entrée de cache
+# n'est donc jamais invalidée explicitement : elle devient simplement inatteignable.
+
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "memory://")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # utilisé par les backends partagés
+
+
+def project_scope(project_id: int) -> str:
+    return f"project:{project_id}"
+
+
+def team_scope(team_id: int) -> str:
+    return f"team:{team_id}"
+
+
+# ─── Backends de stockage ────────────────────────────────────────────────────
+
+class MemoryBackend:
+    """Cache LRU en mémoire du processus (par défaut)."""
+
+    def __init__(self, maxsize: int):
+        self._data: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._data[key] = value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """Cache partagé entre processus/serveurs (optionnel, nécessite le paquet `redis`)."""
+
+    def __init__(self, url: str, ttl: int):
+        import redis  # dépendance optionnelle
+
+        self._client = redis.Redis.from_url(url)
+        self._ttl = ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(f"smia:cache:{key}")
+
+    def set(self, key: str, value: bytes) -> None:
+        self._client.set(f"smia:cache:{key}", value, ex=self._ttl)
+
+    def clear(self) -> None:
+        for k in self._client.scan_iter("smia:cache:*"):
+            self._client.delete(k)
+
+
+def _make_backend():
+    if RESPONSE_CACHE_URL.startswith(("redis://", "rediss://")):
+        try:
+            return RedisBackend(RESPONSE_CACHE_URL, RESPONSE_CACHE_TTL)
+        except ImportError:
+            logger.warning("RESPONSE_CACHE_URL pointe vers Redis mais le paquet `redis` n'est pas installé : "
+                           "repli sur le cache en mémoire.")
+    return MemoryBackend(RESPONSE_CACHE_SIZE)
+
+
+backend = _make_backend()
+
+
+# ─── Versions et clés ────────────────────────────────────────────────────────
+
+class CacheKey(NamedTuple):
+    key: str
+    etag: str
+
+
+def read_versions(sess: Session, scopes: Iterable[str]) -> Dict[str, int]:
+    scopes = list(scopes)
+    rows = sess.exec(select(DataVersion.scope, DataVersion.version).where(DataVersion.scope.in_(scopes))).all()
+    found = dict(rows)
+    return {s: found.get(s, 0) for s in scopes}
+
+
+def cache_key(sess: Session, namespace: str, *scopes: str) -> CacheKey:
+    """Construit la clé de cache (et l'ETag associé) à partir des versions courantes des périmètres."""
+    versions = read_versions(sess, scopes)
+    key = namespace + "|" + "|".join(f"{s}@{versions[s]}" for s in scopes)
+    etag = '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+    return CacheKey(key, etag)
+
+
+def get_or_compute(ck: CacheKey, compute: Callable[[], Any]) -> Any:
+    """Retourne la valeur en cache pour `ck`, ou l'obtient via `compute()` et la mémorise.
+    Les valeurs sont sérialisées en JSON, ce qui garantit que chaque appelant reçoit sa propre copie."""
+    raw = backend.get(ck.key)
+    if raw is not None:
+        return json.loads(raw)
+    value = compute()
+    try:
+        backend.set(ck.key, json.dumps(value, default=str).encode("utf-8"))
+    except Exception:
+        logger.exception("Impossible de mettre en cache %s", ck.key)
+    return value
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Vrai si le client possède déjà la représentation identifiée par `etag` (`If-None-Match`)."""
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    candidates = {t.strip().removeprefix("W/") for t in inm.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def cached_json_response(request: Request, ck: CacheKey, compute: Callable[[], Any]) -> Response:
+    """Réponse JSON avec ETag : 304 si le client est à jour, sinon contenu (depuis le cache si possible)."""
+    headers = {"ETag": ck.etag, "Cache-Control": "private, no-cache"}
+    if not_modified(request, ck.etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(get_or_compute(ck, compute), headers=headers)
+
+
+# ─── Incrément automatique des versions ──────────────────────────────────────
+
+# Types dont l'écriture invalide les réponses du projet auquel ils appartiennent.
+_PROJECT_BOUND = (ISO42001ChecklistItem, Comment, EvaluationRun)
+_ITEM_BOUND = (NonConformite, ActionCorrective, Proof)
+
+
+def _bump(connection, scopes: Set[str]) -> None:
+    # Un seul INSERT ... ON CONFLICT par périmètre : deux transactions qui créent le même périmètre
+    # en même temps s'incrémentent l'une après l'autre, sans IntegrityError dans le flush.
+    # La construction vient du dialecte de la connexion (SQLite, sinon PostgreSQL).
+    if not scopes:   # ex. utilisateur renommé qui n'appartient à aucune équipe
+        return
+    now = datetime.utcnow()
+    table = DataVersion.__table__
+    stmt = dialect_insert(connection.dialect, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.scope],
+        set_={"version": table.c.version + 1, "updated_at": stmt.excluded.updated_at},
+    )
+    # ordre stable pour limiter les interblocages
+    connection.execute(stmt, [{"scope": scope, "version": 1, "updated_at": now} for scope in sorted(scopes)])
+
+
+def bump_scopes(sess: Session, *scopes: str) -> None:
+    """Incrémente explicitement des périmètres, dans la transaction de `sess` (hors écritures suivies)."""
+    _bump(sess.connection(), set(scopes))
+
+
+@event.listens_for(SASession, "after_flush")
+def _bump_versions_after_flush(session, flush_context) -> None:
+    project_ids: Set[int] = set()
+    team_ids: Set[int] = set()
+    item_ids: Set[int] = set()
+    nc_ids: Set[int] = set()
+    user_ids: Set[int] = set()
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, _PROJECT_BOUND):
+            project_ids.add(obj.project_id)
+        elif isinstance(obj, _ITEM_BOUND):
+            if obj.checklist_item_id is not None:
+                item_ids.add(obj.checklist_item_id)
+            elif isinstance(obj, ActionCorrective) and obj.non_conformite_id is not None:
+                nc_ids.add(obj.non_conformite_id)
+        elif isinstance(obj, AIProject):
+            if obj.id is not None:
+                project_ids.add(obj.id)
+            team_ids.add(obj.team_id)
+        elif isinstance(obj, TeamMembership):
+            team_ids.add(obj.team_id)
+        elif isinstance(obj, Team):
+            if obj.id is not None:
+                team_ids.add(obj.id)
+        elif isinstance(obj, User):
+            # seul le nom apparaît dans les réponses en cache (membres, auteurs, responsables)
+            if obj in session.dirty and sa_inspect(obj).attrs.username.history.has_changes():
+                user_ids.add(obj.id)
+
+    if not (project_ids or team_ids or item_ids or nc_ids or user_ids):
+        return
+
+    connection = session.connection()
+    items = ISO42001ChecklistItem.__table__
+    if user_ids:
+        memberships = TeamMembership.__table__
+        team_ids.update(connection.execute(
+            sa_select(memberships.c.team_id).where(memberships.c.user_id.in_(user_ids))
+        ).scalars())
+    if nc_ids:
+        ncs = NonConformite.__table__
+        item_ids.update(connection.execute(sa_select(ncs.c.checklist_item_id).where(ncs.c.id.in_(nc_ids))).scalars())
+    if item_ids:
+        project_ids.update(connection.execute(sa_select(items.c.project_id).where(items.c.id.in_(item_ids))).scalars())
+    project_ids.discard(None)
+    if project_ids:
+        projects = AIProject.__table__
+        team_ids.update(connection.execute(sa_select(projects.c.team_id).where(projects.c.id.in_(project_ids))).scalars())
+    team_ids.discard(None)
+
+    _bump(connection, {project_scope(p) for p in project_ids} | {team_scope(t) for t in team_ids})
@@ -0,0 +1,76 @@
+# app/utils/checklist.py
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from app.models import ISO42001ChecklistItem, ProjectComplianceSummary
+from config.iso42001_requirements import ISO42001_REQUIREMENTS
+
+# BLOC D'INITIALISATION DE LA CHECKLIST ISO 42001
+# La checklist d'un projet est créée une seule fois, à la création du projet, par un INSERT groupé
+# (un seul aller-retour au lieu d'un `sess.add()` par point de contrôle). La lecture de la checklist
+# n'écrit donc jamais en base.
+
+
+def checklist_rows(project_id: int) -> List[Dict[str, Any]]:
+    """Construit les lignes `ISO42001ChecklistItem` d'un projet à partir de `ISO42001_REQUIREMENTS`."""
+    now = datetime.utcnow()
+    rows = []
+    for req in ISO42001_REQUIREMENTS:
+        n = len(req["audit_questions"])
+        rows.append({
+            "project_id": project_id, "control_id": req["control_id"], "control_name": req["control_name"],
+            "description": req["description"], "audit_questions": req["audit_questions"],
+            "evidence_required": req["evidence_required"], "statuses": ["to-do"] * n,
+            "results": ["not-assessed"] * n, "observations": [None] * n,
+            "status": "to-do", "result": "not-assessed", "observation": None,
+            "created_at": now, "updated_at": now,
+        })
+    return rows
+
+
+def seed_project_checklist(sess: Session, project_id: int) -> int:
+    """
+    Insère la checklist complète d'un projet et ses lignes de résumé de conformité (tout est
+    "not-assessed", donc les compteurs se déduisent directement du nombre de questions).
+    Ne fait rien si le projet a déjà des items. Retourne le nombre d'items créés. Ne fait pas de commit.
+    """
+    exists = sess.exec(
+        select(ISO42001ChecklistItem.id).where(ISO42001ChecklistItem.project_id == project_id).limit(1)
+    ).first()
+    if exists is not None:
+        return 0
+
+    rows = checklist_rows(project_id)
+    sess.execute(insert(ISO42001ChecklistItem), rows)
+
+    created = sess.exec(
+        select(ISO42001ChecklistItem.id, ISO42001ChecklistItem.control_id, ISO42001ChecklistItem.audit_questions)
+        .where(ISO42001ChecklistItem.project_id == project_id)
+    ).all()
+    now = datetime.utcnow()
+    sess.execute(insert(ProjectComplianceSummary), [
+        {
+            "project_id": project_id, "checklist_item_id": item_id, "control_id": control_id,
+            "total": len(questions), "compliant": 0, "not_compliant": 0, "not_assessed": len(questions),
+            "open_nc": 0, "major_open_nc": 0, "updated_at": now,
+        }
+        for item_id, control_id, questions in created
+    ])
+    return len(rows)
+
+
+def repair_item_lengths(item: ISO42001ChecklistItem) -> bool:
+    """
+    Aligne `statuses`, `results` et `observations` sur le nombre de questions de l'item.
+    Retourne True si l'item a été modifié.
+    """
+    q = len(item.audit_questions)
+    updated = False
+    if len(item.statuses) != q: item.statuses = [item.status] * q; updated = True
+    if len(item.results) != q: item.results = [item.result] * q; updated = True
+    if len(item.observations) != q: item.observations = [item.observation] * q; updated = True
+    return updated
+
@@ -0,0 +1,207 @@
+# app/utils/code_snapshots.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Tuple
+
+from cachetools import LRUCache
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from app.db import SessionLocal, dialect_insert
+from app.models import CodeSnapshot, ModelRun
+
+logger = logging.getLogger(__name__)
+
+# BLOC DES INSTANTANÉS DU CODE DES MODÈLES
+# Le dossier `storage/models/project_<id>` est réécrit à chaque upload (et `config.yaml` modifiable par
+# l'API) : chaque run est donc rattaché à un instantané immuable du code pris à son lancement.
+#   - chaque fichier est stocké une seule fois, sous son empreinte : storage/code/blobs/ab/abcd… ;
+#   - un instantané est un manifeste {chemin relatif: empreinte} ; son id est l'empreinte du manifeste,
+#     un code inchangé redonne donc le même instantané (rien n'est recopié) ;
+#   - le conteneur monte en lecture seule une arborescence matérialisée par liens physiques
+#     (storage/code/trees/<id>), construite une seule fois par instantané puis réutilisée.
+# Les fichiers produits dans le dossier du projet (`NOT_CODE` : sorties des évaluations, snapshot de données)
+# ne font pas partie du code ; les sorties des runs sont hors de ce dossier (app.utils.artifacts.run_output_dir).
+
+CODE_STORE = Path(__file__).resolve().parents[2] / "storage" / "code"
+BLOBS_DIR = CODE_STORE / "blobs"
+TREES_DIR = CODE_STORE / "trees"
+
+# Entrées de la racine du dossier du projet qui ne sont pas du code (reprises à chaque upload du code).
+NOT_CODE = {"output", "ref_stats.csv", "config_data.json", "drift_report.html"}
+IGNORED_DIRS = {"__pycache__", ".git"}
+
+_digests: LRUCache = LRUCache(maxsize=20000)   # (chemin, taille, mtime) -> empreinte
+_lock = Lock()
+
+
+# ─── Empreintes et fichiers ──────────────────────────────────────────────────
+
+def _file_digest(path: Path, st: os.stat_result) -> str:
+    # Un fichier inchangé (même taille, même date) n'est pas relu d'un lancement à l'autre.
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        digest = _digests.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _lock:
+            _digests[key] = digest
+    return digest
+
+
+def blob_path(digest: str) -> Path:
+    return BLOBS_DIR / digest[:2] / digest
+
+
+def _store_blob(src: Path, digest: str) -> None:
+    dest = blob_path(digest)
+    if dest.exists():
+        os.utime(dest)   # réutilisé : protégé de la purge des fichiers orphelins (cf. prune_snapshots)
+        return
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".blob-", dir=dest.parent)
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, dest)
+    except Exception:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _scan(src: Path) -> Dict[str, Tuple[Path, int, str]]:
+    """Fichiers de code de `src` : {chemin relatif POSIX: (chemin, taille, empreinte)}."""
+    files: Dict[str, Tuple[Path, int, str]] = {}
+    for root, dirs, names in os.walk(src):
+        rel_root = Path(root).relative_to(src)
+        dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS and not (rel_root == Path(".") and d in NOT_CODE))
+        for name in names:
+            if rel_root == Path(".") and name in NOT_CODE:
+                continue
+            path = Path(root) / name
+            st = path.stat()
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            files[(rel_root / name).as_posix()] = (path, st.st_size, _file_digest(path, st))
+    return files
+
+
+# ─── Instantanés ─────────────────────────────────────────────────────────────
+
+def create_snapshot(sess: Session, src: Path) -> CodeSnapshot:
+    """
+    Instantané du code de `src` (créé s'il n'existe pas encore) ; seuls les fichiers absents
+    du magasin sont copiés. Lève FileNotFoundError si `src` ne contient aucun fichier. Ne fait pas de commit.
+    Deux lancements simultanés sur le même code insèrent la même ligne : `ON CONFLICT DO NOTHING`.
+    """
+    files = _scan(src) if src.is_dir() else {}
+    if not files:
+        raise FileNotFoundError(str(src))
+    manifest = {rel: digest for rel, (_, _, digest) in sorted(files.items())}
+    snapshot_id = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+    snapshot = sess.get(CodeSnapshot, snapshot_id)
+    if snapshot is not None:
+        return snapshot
+    for path, _, digest in files.values():
+        _store_blob(path, digest)
+    table = CodeSnapshot.__table__
+    sess.execute(
+        dialect_insert(sess.get_bind().dialect, table)
+        .values(id=snapshot_id, manifest=manifest, file_count=len(files),
+                size_bytes=sum(size for _, size, _ in files.values()), created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[table.c.id])
+    )
+    return sess.get(CodeSnapshot, snapshot_id)
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    try:
+        os.link(src, dest)
+    except OSError:  # autre système de fichiers, liens physiques non supportés
+        shutil.copyfile(src, dest)
+        os.chmod(dest, 0o444)
+
+
+def materialize(snapshot: CodeSnapshot) -> Path:
+    """Arborescence (lecture seule) de l'instantané, construite à la première demande puis réutilisée."""
+    tree = TREES_DIR / snapshot.id
+    if tree.is_dir():
+        return tree
+    TREES_DIR.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{snapshot.id[:12]}-", dir=TREES_DIR))
+    try:
+        for rel, digest in snapshot.manifest.items():
+            dest = staging / rel
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            _link_or_copy(blob_path(digest), dest)
+        os.replace(staging, tree)
+    except OSError:
+        _rmtree(staging)
+        if not tree.is_dir():   # sinon : construite au même moment par un autre run
+            raise
+    return tree
+
+
+def _rmtree(path: Path) -> None:
+    # Les fichiers du magasin sont en lecture seule (bloquant sous Windows) : on les rend modifiables.
+    def onerror(func, p, _exc):
+        os.chmod(p, stat.S_IWRITE)
+        func(p)
+    shutil.rmtree(path, onerror=onerror)
+
+
+# ─── Nettoyage ───────────────────────────────────────────────────────────────
+
+def prune_snapshots(retention_days: int) -> Dict[str, int]:
+    """
+    Supprime les instantanés qui ne sont plus rattachés à aucun run (depuis `retention_days`),
+    leurs arborescences et les fichiers que plus aucun manifeste ne référence.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    with SessionLocal() as sess:
+        unused = sess.exec(
+            select(CodeSnapshot.id).where(
+                CodeSnapshot.created_at < cutoff,
+                CodeSnapshot.id.not_in(select(ModelRun.snapshot_id).where(ModelRun.snapshot_id != None)),  # noqa: E711
+            )
+        ).all()
+        if unused:
+            sess.execute(delete(CodeSnapshot).where(CodeSnapshot.id.in_(unused)))
+            sess.commit()
+        kept = set()
+        snapshot_ids = set()
+        for snapshot_id, manifest in sess.exec(select(CodeSnapshot.id, CodeSnapshot.manifest)).all():
+            snapshot_ids.add(snapshot_id)
+            kept.update(manifest.values())
+
+    trees = blobs = 0
+    if TREES_DIR.is_dir():
+        for tree in TREES_DIR.iterdir():
+            # Dossiers temporaires (préfixe ".") : seulement ceux d'une construction interrompue.
+            stale = tree.name.startswith(".") and datetime.utcfromtimestamp(tree.stat().st_mtime) < cutoff
+            if (not tree.name.startswith(".") and tree.name not in snapshot_ids) or stale:
+                _rmtree(tree)
+                trees += 1
+    if BLOBS_DIR.is_dir():
+        for blob in BLOBS_DIR.glob("*/*"):
+            if blob.name not in kept and datetime.utcfromtimestamp(blob.stat().st_mtime) < cutoff:
+                os.chmod(blob, stat.S_IWRITE | stat.S_IREAD)
+                blob.unlink()
+                blobs += 1
+    if unused or trees or blobs:
+        logger.info("Instantanés de code purgés : %d instantanés, %d arborescences, %d fichiers",
+                    len(unused), trees, blobs)
+    return {"snapshots": len(unused), "trees": trees, "blobs": blobs}
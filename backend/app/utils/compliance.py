@@ -0,0 +1,157 @@
+# app/utils/compliance.py
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, func
+from sqlmodel import Session, select
+
+from app.models import (
+    AIProject,
+    ISO42001ChecklistItem,
+    NonConformite,
+    ProjectComplianceSummary,
+)
+
+# BLOC DU RÉSUMÉ DE CONFORMITÉ MATÉRIALISÉ
+# La table `ProjectComplianceSummary` contient une ligne par item de checklist avec les compteurs
+# de réponses et de non-conformités. Elle est mise à jour dans la même transaction que les
+# écritures (réponses, NC, actions), ce qui évite de reparcourir toutes les réponses à chaque lecture.
+
+# Statuts d'une non-conformité considérée comme close.
+CLOSED_NC_STATUSES = ("corrigee", "ferme")
+
+
+def count_results(results: Iterable[str]) -> Tuple[int, int, int, int]:
+    """Retourne (total, compliant, not_compliant, not_assessed) pour une liste de réponses."""
+    total = compliant = not_compliant = not_assessed = 0
+    for r in results or []:
+        total += 1
+        if r == "compliant":
+            compliant += 1
+        elif r == "not-compliant":
+            not_compliant += 1
+        elif r == "not-assessed":
+            not_assessed += 1
+    return total, compliant, not_compliant, not_assessed
+
+
+def refresh_item_summary(sess: Session, item: ISO42001ChecklistItem, sync_score: bool = True) -> ProjectComplianceSummary:
+    """
+    Recalcule la ligne de résumé d'UN item (ses réponses et ses non-conformités)
+    puis, par défaut, resynchronise `AIProject.compliance_score`.
+    Ne fait pas de commit : l'appelant reste maître de la transaction.
+    """
+    return refresh_item_summaries(sess, [item], sync_score=sync_score)[item.id]
+
+
+def refresh_item_summaries(sess: Session, items: List[ISO42001ChecklistItem],
+                           sync_score: bool = True) -> Dict[int, ProjectComplianceSummary]:
+    """
+    Version groupée de `refresh_item_summary` : les compteurs de NC et les lignes de résumé
+    de tous les items sont lus en une requête chacun, quel que soit le nombre d'items.
+    """
+    if not items:
+        return {}
+    item_ids = [item.id for item in items]
+    statut, type_nc = func.lower(NonConformite.statut), func.lower(NonConformite.type_nc)
+    nc_counts = {
+        row[0]: (int(row[1] or 0), int(row[2] or 0))
+        for row in sess.exec(
+            select(
+                NonConformite.checklist_item_id,
+                func.sum(case((statut.not_in(CLOSED_NC_STATUSES), 1), else_=0)),
+                # Même définition que le tableau de bord : NC majeure pas encore corrigée.
+                func.sum(case((and_(type_nc == "majeure", statut != "corrigee"), 1), else_=0)),
+            )
+            .where(NonConformite.checklist_item_id.in_(item_ids))
+            .group_by(NonConformite.checklist_item_id)
+        ).all()
+    }
+    summaries = {
+        summary.checklist_item_id: summary
+        for summary in sess.exec(
+            select(ProjectComplianceSummary).where(ProjectComplianceSummary.checklist_item_id.in_(item_ids))
+        ).all()
+    }
+
+    now = datetime.utcnow()
+    for item in items:
+        total, compliant, not_compliant, not_assessed = count_results(item.results)
+        summary = summaries.get(item.id)
+        if not summary:
+            summary = ProjectComplianceSummary(project_id=item.project_id, checklist_item_id=item.id, control_id=item.control_id)
+            summaries[item.id] = summary
+        summary.control_id = item.control_id
+        summary.total, summary.compliant = total, compliant
+        summary.not_compliant, summary.not_assessed = not_compliant, not_assessed
+        summary.open_nc, summary.major_open_nc = nc_counts.get(item.id, (0, 0))
+        summary.updated_at = now
+        sess.add(summary)
+
+    if sync_score:
+        for project_id in {item.project_id for item in items}:
+            sync_project_score(sess, project_id)
+    return summaries
+
+
+def refresh_item_summary_by_id(sess: Session, item_id: int) -> None:
+    """Variante pratique quand seul l'ID de l'item est connu (ex: changement sur une NC)."""
+    item = sess.get(ISO42001ChecklistItem, item_id)
+    if item:
+        refresh_item_summary(sess, item)
+
+
+def sync_project_score(sess: Session, project_id: int) -> int:
+    """Recalcule `AIProject.compliance_score` (en %) à partir des lignes de résumé du projet."""
+    total, compliant = sess.exec(
+        select(
+            func.coalesce(func.sum(ProjectComplianceSummary.total), 0),
+            func.coalesce(func.sum(ProjectComplianceSummary.compliant), 0),
+        ).where(ProjectComplianceSummary.project_id == project_id)
+    ).one()
+    score = round(compliant / total * 100) if total else 0
+    proj = sess.get(AIProject, project_id)
+    if proj and proj.compliance_score != score:
+        proj.compliance_score = score
+        sess.add(proj)
+    return score
+
+
+def project_compliance_counts(sess: Session, project_ids: List[int]) -> Dict[int, Dict[str, int]]:
+    """Agrège les compteurs par projet (une requête GROUP BY sur la table de résumé)."""
+    if not project_ids:
+        return {}
+    rows = sess.exec(
+        select(
+            ProjectComplianceSummary.project_id,
+            func.sum(ProjectComplianceSummary.total),
+            func.sum(ProjectComplianceSummary.compliant),
+            func.sum(ProjectComplianceSummary.not_compliant),
+            func.sum(ProjectComplianceSummary.not_assessed),
+            func.sum(ProjectComplianceSummary.open_nc),
+            func.sum(ProjectComplianceSummary.major_open_nc),
+        )
+        .where(ProjectComplianceSummary.project_id.in_(project_ids))
+        .group_by(ProjectComplianceSummary.project_id)
+    ).all()
+    keys = ("total", "compliant", "not_compliant", "not_assessed", "open_nc", "major_open_nc")
+    return {row[0]: dict(zip(keys, (int(v or 0) for v in row[1:]))) for row in rows}
+
+
+def rebuild_project_summaries(sess: Session, project_id: Optional[int] = None, only_missing: bool = False) -> int:
+    """
+    Reconstruit les résumés à partir des items (rattrapage des données existantes).
+    `only_missing=True` ne traite que les items qui n'ont pas encore de ligne de résumé.
+    Retourne le nombre d'items traités. Ne fait pas de commit.
+    """
+    query = select(ISO42001ChecklistItem)
+    if project_id is not None:
+        query = query.where(ISO42001ChecklistItem.project_id == project_id)
+    if only_missing:
+        query = query.outerjoin(
+            ProjectComplianceSummary,
+            ProjectComplianceSummary.checklist_item_id == ISO42001ChecklistItem.id,
+        ).where(ProjectComplianceSummary.id.is_(None))
+    items = sess.exec(query).all()
+    refresh_item_summaries(sess, items)
+    return len(items)
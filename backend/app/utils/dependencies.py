@@ -1,6 +1,10 @@
 # utils/dependencies.py
-from typing import Generator
-from fastapi import HTTPException, Depends
+import os
+from threading import Lock
+from typing import Generator, NamedTuple, Optional
+
+from cachetools import TTLCache
+from fastapi import HTTPException, Depends, Request
 from sqlmodel import Session, select
 
 from app.auth import get_current_user
@@ -12,15 +16,110 @@ def get_session() -> Generator[Session, None, None]:
     with SessionLocal() as sess:
         yield sess
 
-def assert_owner(sess: Session, project_id: int, user: User,team_id: int):
 
-    # only owner or manager can upload
-    mymem = sess.exec(
-        select(TeamMembership).where(
+# ─── Autorisations d'équipe ───────────────────────────────────────────────────
+# BLOC DU CACHE DES APPARTENANCES
+# Presque toutes les routes vérifient que l'utilisateur est membre de l'équipe (et parfois son rôle).
+# L'appartenance (utilisateur, équipe) est résolue une seule fois par requête (`request.state`)
+# et gardée quelques secondes dans un cache du processus. `teams.py` invalide l'entrée à chaque
+# écriture sur une appartenance (invitation, acceptation, retrait, suppression d'équipe).
+# Le cache est propre à chaque processus : l'invalidation ne touche que le worker qui a traité la
+# modification. Sur les autres workers, un membre retiré garde l'accès en lecture au plus
+# MEMBERSHIP_CACHE_TTL secondes. Les routes d'écriture (méthodes autres que GET/HEAD/OPTIONS,
+# `assert_owner`, gestion des membres) relisent l'appartenance en base (`fresh=True`).
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "5"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "4096"))
+
+# Rôles autorisés à modifier le code, les données et les entraînements d'un projet.
+MANAGER_ROLES = ("owner", "manager")
+
+
+class Membership(NamedTuple):
+    """Vue figée d'une ligne `TeamMembership`, sûre à partager entre sessions et threads."""
+    team_id: int
+    user_id: int
+    role: str
+    accepted: bool
+
+
+_membership_cache: TTLCache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+_membership_lock = Lock()
+_MISSING = object()
+_SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def get_membership(sess: Session, team_id: int, user_id: int, fresh: bool = False) -> Optional[Membership]:
+    """Retourne l'appartenance (acceptée ou non) de `user_id` à `team_id`, ou None.
+
+    `fresh=True` ignore le cache (l'entrée est rafraîchie) : à utiliser avant une écriture.
+    """
+    key = (team_id, user_id)
+    if not fresh:
+        with _membership_lock:
+            cached = _membership_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+    row = sess.exec(
+        select(TeamMembership.role, TeamMembership.accepted_at).where(
             TeamMembership.team_id == team_id,
-            TeamMembership.user_id == user.id
+            TeamMembership.user_id == user_id,
         )
     ).first()
-    if not mymem or mymem.role not in ("owner", "manager"):
-        raise HTTPException(403, "Seul le propriétaire de l'equipe peut faire ca ")
+    mem = Membership(team_id, user_id, row[0], row[1] is not None) if row else None
+    with _membership_lock:
+        _membership_cache[key] = mem
+    return mem
+
+
+def invalidate_membership(team_id: int, user_id: Optional[int] = None) -> None:
+    """Oublie l'appartenance d'un utilisateur (ou de tous les membres si `user_id` est None)."""
+    with _membership_lock:
+        if user_id is not None:
+            _membership_cache.pop((team_id, user_id), None)
+        else:
+            for key in [k for k in _membership_cache.keys() if k[0] == team_id]:
+                _membership_cache.pop(key, None)
+
+
+def assert_member(sess: Session, team_id: int, user: User, fresh: bool = False) -> Membership:
+    """403 si l’utilisateur n’est pas membre (invitation acceptée)."""
+    mem = get_membership(sess, team_id, user.id, fresh=fresh)
+    if not mem or not mem.accepted:
+        raise HTTPException(403, "Accès interdit à cette équipe")
+    return mem
+
+
+def assert_owner(sess: Session, project_id: int, user: User, team_id: int,
+                 detail: str = "Seul le propriétaire de l'equipe peut faire ca "):
+
+    # only owner or manager can upload
+    mymem = get_membership(sess, team_id, user.id, fresh=True)
+    if not mymem or mymem.role not in MANAGER_ROLES:
+        raise HTTPException(403, detail)
+    return mymem
+
+
+def team_membership(
+        team_id: int,
+        request: Request,
+        current_user: User = Depends(get_current_user),
+        sess: Session = Depends(get_session),
+) -> Membership:
+    # DÉPENDANCE FASTAPI : résout l'appartenance de l'utilisateur courant à l'équipe de l'URL
+    # une seule fois par requête ; les vérifications suivantes relisent `request.state`.
+    # Les requêtes d'écriture la relisent en base plutôt que dans le cache du processus.
+    memberships = getattr(request.state, "memberships", None)
+    if memberships is None:
+        memberships = request.state.memberships = {}
+    if team_id not in memberships:
+        memberships[team_id] = assert_member(
+            sess, team_id, current_user, fresh=request.method not in _SAFE_METHODS
+        )
+    return memberships[team_id]
+
 
+def require_manager(mem: Membership, detail: str = "Seul le propriétaire de l'equipe peut faire ca ") -> None:
+    """403 si l'appartenance (déjà résolue) n'a pas un rôle de gestion (owner / manager)."""
+    if mem.role not in MANAGER_ROLES:
+        raise HTTPException(403, detail)
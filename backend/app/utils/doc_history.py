@@ -0,0 +1,196 @@
+# app/utils/doc_history.py
+import json
+import os
+from difflib import SequenceMatcher
+from threading import Lock
+from typing import List, Optional
+
+from cachetools import LRUCache
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+
+from app.models import Document, DocumentHistory
+
+# BLOC DE L'HISTORIQUE DES DOCUMENTS PAR DELTAS
+# Chaque version d'un document est archivée soit comme « image clé » (contenu complet), soit comme
+# delta ligne à ligne par rapport à la version précédente (`content` vide, opérations dans `delta`).
+# Une image clé est écrite toutes les `HISTORY_KEYFRAME_INTERVAL` versions, ou quand le delta n'est
+# pas plus petit que le contenu : reconstruire une version applique au plus quelques deltas.
+# Les versions reconstruites sont gardées dans un LRU borné (en nombre de caractères). Une version
+# écrite n'y entre qu'au commit de sa transaction : un rollback ne laisse pas en cache le contenu
+# d'une version qui n'existe pas en base. La clé inclut la date de création du document : SQLite
+# réutilise l'id d'un document supprimé, et le cache d'un autre worker (que `forget_document`
+# n'atteint pas) ne doit pas servir l'ancien contenu au nouveau document.
+
+HISTORY_KEYFRAME_INTERVAL = int(os.getenv("HISTORY_KEYFRAME_INTERVAL", "20"))
+HISTORY_CACHE_CHARS = int(os.getenv("HISTORY_CACHE_CHARS", str(32 * 1024 * 1024)))
+
+# Opérations d'un delta : [COPY, n] garde n lignes, [SKIP, n] en saute n, [INSERT, "texte"] ajoute du texte.
+COPY, SKIP, INSERT = 0, 1, 2
+
+_cache: LRUCache = LRUCache(maxsize=HISTORY_CACHE_CHARS, getsizeof=lambda content: len(content) or 1)
+_lock = Lock()
+_PENDING = "doc_history_pending"   # clé de `Session.info` : versions écrites, pas encore commitées
+
+
+def _key(doc: Document, version: int) -> tuple:
+    return doc.id, doc.created_at, version
+
+
+# ─── Deltas ──────────────────────────────────────────────────────────────────
+
+def make_delta(old: str, new: str) -> str:
+    """Delta (JSON compact) qui transforme `old` en `new`, ligne à ligne."""
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops: List[list] = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([COPY, i2 - i1])
+            continue
+        if i2 > i1:
+            ops.append([SKIP, i2 - i1])
+        if j2 > j1:
+            ops.append([INSERT, "".join(b[j1:j2])])
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def apply_delta(old: str, delta: str) -> str:
+    """Applique un delta produit par `make_delta` au contenu `old`."""
+    lines = old.splitlines(keepends=True)
+    out: List[str] = []
+    pos = 0
+    for op, arg in json.loads(delta):
+        if op == COPY:
+            out.extend(lines[pos:pos + arg])
+            pos += arg
+        elif op == SKIP:
+            pos += arg
+        else:
+            out.append(arg)
+    return "".join(out)
+
+
+# ─── Écriture ────────────────────────────────────────────────────────────────
+
+def record_version(sess: Session, doc: Document, previous_content: Optional[str] = None) -> DocumentHistory:
+    """
+    Archive la version courante de `doc`. `previous_content` est le contenu de la version précédente
+    (None pour la première version) : il sert de base au delta. Ne fait pas de commit.
+    """
+    row = DocumentHistory(
+        document_id=doc.id, title=doc.title, content=doc.content,
+        version=doc.version, created_at=doc.created_at,
+        updated_at=doc.updated_at, created_by=doc.created_by,
+        is_keyframe=True,
+    )
+    if previous_content is not None:
+        last_keyframe = sess.exec(
+            select(func.max(DocumentHistory.version)).where(
+                DocumentHistory.document_id == doc.id, DocumentHistory.is_keyframe == True  # noqa: E712
+            )
+        ).one()
+        if last_keyframe is not None and doc.version - last_keyframe < HISTORY_KEYFRAME_INTERVAL:
+            delta = make_delta(previous_content, doc.content)
+            if len(delta) < len(doc.content):
+                row.content, row.delta, row.is_keyframe = "", delta, False
+    sess.add(row)
+    sess.info.setdefault(_PENDING, {})[_key(doc, doc.version)] = doc.content
+    return row
+
+
+@event.listens_for(SASession, "after_commit")
+def _cache_committed_versions(session) -> None:
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        with _lock:
+            _cache.update(pending)
+
+
+@event.listens_for(SASession, "after_transaction_end")
+def _drop_uncommitted_versions(session, transaction) -> None:
+    # Fin de la transaction principale sans commit (rollback, fermeture) : rien n'entre en cache.
+    if transaction.parent is None:
+        session.info.pop(_PENDING, None)
+
+
+# ─── Lecture ─────────────────────────────────────────────────────────────────
+
+def version_content(sess: Session, doc: Document, version: int) -> Optional[str]:
+    """Contenu de la version `version` du document (reconstruit si besoin), ou None si elle n'existe pas."""
+    document_id = doc.id
+    with _lock:
+        cached = _cache.get(_key(doc, version))
+    if cached is not None:
+        return cached
+
+    # Remonte de la version demandée jusqu'à une image clé (ou une version déjà en cache).
+    keyframe = sess.exec(
+        select(func.max(DocumentHistory.version)).where(
+            DocumentHistory.document_id == document_id,
+            DocumentHistory.is_keyframe == True,  # noqa: E712
+            DocumentHistory.version <= version,
+        )
+    ).one()
+    if keyframe is None:
+        return None
+    rows = sess.exec(
+        select(DocumentHistory.version, DocumentHistory.is_keyframe, DocumentHistory.content, DocumentHistory.delta)
+        .where(
+            DocumentHistory.document_id == document_id,
+            DocumentHistory.version >= keyframe,
+            DocumentHistory.version <= version,
+        )
+        .order_by(DocumentHistory.version, DocumentHistory.id)
+    ).all()
+    if not rows or rows[-1][0] != version:
+        return None
+
+    # Point de départ : la version la plus récente déjà en cache, sinon l'image clé (rows[0]).
+    start, content = 0, rows[0][2]
+    with _lock:
+        for i in range(len(rows) - 1, 0, -1):
+            hit = _cache.get(_key(doc, rows[i][0]))
+            if hit is not None:
+                start, content = i, hit
+                break
+    for _, is_keyframe, full, delta in rows[start + 1:]:
+        content = full if is_keyframe else apply_delta(content, delta)
+    with _lock:
+        _cache[_key(doc, version)] = content
+    return content
+
+
+def forget_document(document_id: int) -> None:
+    """Retire du cache de ce processus les versions d'un document supprimé (libère la mémoire)."""
+    with _lock:
+        for key in [k for k in _cache.keys() if k[0] == document_id]:
+            _cache.pop(key, None)
+
+
+# ─── Compactage ──────────────────────────────────────────────────────────────
+
+def compact_document_history(sess: Session, document_id: int) -> int:
+    """
+    Convertit en deltas les copies complètes d'un document qui ne sont pas des images clés.
+    Idempotent. Retourne le nombre de versions compactées. Ne fait pas de commit.
+    """
+    rows = sess.exec(
+        select(DocumentHistory)
+        .where(DocumentHistory.document_id == document_id)
+        .order_by(DocumentHistory.version, DocumentHistory.id)
+    ).all()
+    compacted = 0
+    previous: Optional[str] = None
+    since_keyframe = 0
+    for row in rows:
+        content = row.content if row.is_keyframe else apply_delta(previous or "", row.delta or "[]")
+        if previous is not None and row.is_keyframe and since_keyframe + 1 < HISTORY_KEYFRAME_INTERVAL:
+            delta = make_delta(previous, content)
+            if len(delta) < len(content):
+                row.content, row.delta, row.is_keyframe = "", delta, False
+                sess.add(row)
+                compacted += 1
+        since_keyframe = 0 if row.is_keyframe else since_keyframe + 1
+        previous = content
+    return compacted
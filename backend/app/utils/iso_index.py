@@ -0,0 +1,59 @@
+# app/utils/iso_index.py
+from pathlib import Path
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+from config.iso42001_requirements import ISO42001_REQUIREMENTS
+
+# BLOC DE L'INDEX DU RÉFÉRENTIEL ISO 42001
+# `ISO42001_REQUIREMENTS` est une constante : toutes les correspondances dont les routes ont besoin
+# (ordre des contrôles, numéro global d'une question, modèle .docx d'une preuve) sont calculées une
+# seule fois à l'import et exposées en lecture seule. Les recherches deviennent des accès de
+# dictionnaire, sans relire la checklist du projet en base.
+
+# Dossier des modèles de documents vierges, nommés d'après le numéro global de la question ("15.docx").
+DOCUMENTS_DIR = Path(__file__).resolve().parents[2] / "config" / "documents"
+
+
+class EvidenceRef(NamedTuple):
+    """Emplacement d'une preuve attendue dans le référentiel."""
+    control_id: str
+    question_index: int   # index local de la première question de l'item qui cite la preuve
+    global_number: int    # numéro de cette question sur l'ensemble de la norme (à partir de 1)
+    template_path: Path   # modèle .docx correspondant (peut ne pas exister sur le disque)
+
+
+def _build_index():
+    control_order, question_offsets, question_evidence, evidence = {}, {}, {}, {}
+    offset = 0
+    for order, req in enumerate(ISO42001_REQUIREMENTS):
+        control_id = req["control_id"]
+        control_order[control_id] = order
+        question_offsets[control_id] = offset
+        for q_idx, question in enumerate(req["audit_questions"]):
+            refs = tuple(question["evidence_refs"])
+            question_evidence[(control_id, q_idx)] = refs
+            for ev in refs:
+                # Comme l'ancien calcul, une preuve citée par plusieurs questions renvoie à la première.
+                if (control_id, ev) not in evidence:
+                    number = offset + q_idx + 1
+                    evidence[(control_id, ev)] = EvidenceRef(control_id, q_idx, number, DOCUMENTS_DIR / f"{number}.docx")
+        offset += len(req["audit_questions"])
+    control_evidence = {
+        req["control_id"]: frozenset(e["id"] for e in req["evidence_required"]) for req in ISO42001_REQUIREMENTS
+    }
+    return (MappingProxyType(control_order), MappingProxyType(question_offsets),
+            MappingProxyType(question_evidence), MappingProxyType(evidence), MappingProxyType(control_evidence))
+
+
+# control_id -> position dans la norme
+# control_id -> nombre de questions des contrôles précédents
+# (control_id, question_index) -> evidence_refs de la question
+# (control_id, evidence_id) -> EvidenceRef
+# control_id -> ensemble des evidence_id attendus
+CONTROL_ORDER, QUESTION_OFFSETS, QUESTION_EVIDENCE, EVIDENCE_INDEX, CONTROL_EVIDENCE = _build_index()
+
+
+def evidence_ref(control_id: str, evidence_id: str) -> Optional[EvidenceRef]:
+    """Retourne l'emplacement de `evidence_id` dans le contrôle `control_id`, ou None."""
+    return EVIDENCE_INDEX.get((control_id, evidence_id))
@@ -1,156 +1,184 @@
+import hashlib
 import os
 import re
-import base64
+import time
 import uuid
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Tuple
 
-import fitz      # PyMuPDF
 import markdown
-import pdfkit
-from sqlmodel import Session
+from PIL import Image
+from sqlmodel import Session, select
 
 from app.db import SessionLocal
 from app.models import DocumentImage
+from app.utils.pdf_import import extract_page_range, store_pages
+from app.utils.pdf_render import PageOptions, render_pdf
+from app.utils.templating import render_html
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Chemin vers wkhtmltopdf (Windows/WSL)
-WKHTMLTOPDF_PATH = os.path.join(
-    os.getcwd(), "app", "utils", "wkhtmltopdf", "bin", "wkhtmltopdf.exe"
-)
-if not os.path.isfile(WKHTMLTOPDF_PATH):
-    raise RuntimeError(f"Cannot find wkhtmltopdf at {WKHTMLTOPDF_PATH}")
-PDFKIT_CONFIG = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
-# ─────────────────────────────────────────────────────────────────────────────
+# Mise en page des documents exportés (marges de 15 mm, numéro de page en bas à droite).
+DOCUMENT_PAGE = PageOptions(margin_mm=15, page_numbers=True)
 
 
 def pdf_to_markdown_and_images(pdf_bytes: bytes, sess: Session, doc) -> str:
     """
-    • Extrait texte & images d’un PDF.
-    • Stocke chaque image en PNG dans DocumentImage.
+    • Extrait texte & images d’un PDF (dans le processus courant, sans tâche de fond).
+    • Stocke chaque image distincte en PNG dans DocumentImage (INSERT groupé).
     • Retourne du Markdown pointant vers /documents/{doc.id}/images/{img.id}.
+    L'import des gros PDF passe plutôt par `pdf_import.submit_pdf_import`.
     """
-    md_chunks: list[str] = []
-    pdf = fitz.open(stream=pdf_bytes, filetype="pdf")
-
-    for pno, page in enumerate(pdf, start=1):
-        txt = page.get_text("text")
-        if txt.strip():
-            md_chunks.append(txt.strip())
-
-        for idx, img in enumerate(page.get_images(full=True), start=1):
-            xref = img[0]
-            pix = fitz.Pixmap(pdf, xref)
-            png = pix.tobytes("png")
-            pix = None
-
-            img_row = DocumentImage(
-                document_id=doc.id,
-                filename   = f"{uuid.uuid4().hex}.png",
-                mime_type  = "image/png",
-                data       = png
-            )
-            sess.add(img_row)
-            sess.flush()  # récupère img_row.id
-
-            md_chunks.append(
-                f"![page-{pno}-img-{idx}](/documents/{doc.id}/images/{img_row.id})"
-            )
-
-        md_chunks.append("")  # saut de ligne entre pages
-
-    return "\n\n".join(md_chunks)
+    pages, images = extract_page_range(pdf_bytes)
+    return "\n\n".join(store_pages(sess, doc.id, pages, images, {}))
+
+
+# ─── Images pour l'impression ────────────────────────────────────────────────
+# BLOC DU CACHE D'IMAGES D'IMPRESSION
+# Les images d'un document ne sont pas intégrées en base64 dans le HTML : elles sont chargées en une
+# requête, écrites une fois sur le disque sous l'empreinte SHA-256 de leur contenu, et référencées
+# par une URL file://. Une image trop grande pour l'impression est réduite (et recompressée) une seule
+# fois : le fichier du cache sert ensuite à tous les exports. `cleanup.py` purge les fichiers inutilisés.
+
+PRINT_IMAGE_DIR = Path(__file__).resolve().parents[2] / "storage" / "cache" / "print_images"
+# Largeur imprimable A4 (180 mm) à ~200 dpi ; au-delà, l'image est réduite.
+PRINT_IMAGE_MAX_PX = int(os.getenv("PRINT_IMAGE_MAX_PX", "1400"))
+# Au-delà de cette taille (octets), une image opaque est recompressée en JPEG.
+PRINT_IMAGE_MAX_BYTES = int(os.getenv("PRINT_IMAGE_MAX_BYTES", str(1024 * 1024)))
+PRINT_JPEG_QUALITY = 85
+_PRINT_EXT = {"image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp"}
+
+
+def _sniff_mime(data: bytes, declared: str) -> str:
+    # Détection JPEG via signature binaire (le type déclaré est souvent "image/png" par défaut)
+    if data[:2] == b"\xff\xd8":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    return declared or "image/png"
+
+
+def _shrink_for_print(data: bytes) -> Optional[Tuple[bytes, str]]:
+    """Réduit / recompresse l'image si elle dépasse les limites d'impression. None si inutile ou impossible."""
+    try:
+        with Image.open(BytesIO(data)) as im:
+            too_large = max(im.size) > PRINT_IMAGE_MAX_PX
+            too_heavy = len(data) > PRINT_IMAGE_MAX_BYTES
+            if not (too_large or too_heavy):
+                return None
+            im.load()
+            if too_large:
+                im.thumbnail((PRINT_IMAGE_MAX_PX, PRINT_IMAGE_MAX_PX), Image.LANCZOS)
+            out = BytesIO()
+            has_alpha = im.mode in ("RGBA", "LA", "P") and ("A" in im.mode or "transparency" in im.info)
+            if has_alpha:
+                im.save(out, format="PNG", optimize=True)
+                mime = "image/png"
+            else:
+                im.convert("RGB").save(out, format="JPEG", quality=PRINT_JPEG_QUALITY, optimize=True)
+                mime = "image/jpeg"
+    except Exception:
+        return None  # image illisible par Pillow : on garde l'original
+    shrunk = out.getvalue()
+    return (shrunk, mime) if len(shrunk) < len(data) else None
+
+
+def print_image_path(data: bytes, mime_type: str) -> Path:
+    """Fichier (dans le cache d'impression) à utiliser pour cette image, créé au premier appel."""
+    digest = hashlib.sha256(data).hexdigest()
+    for ext in set(_PRINT_EXT.values()):
+        cached = PRINT_IMAGE_DIR / f"{digest}{ext}"
+        if cached.is_file():
+            os.utime(cached)  # date d'utilisation, lue par la purge du cache
+            return cached
+
+    mime = _sniff_mime(data, mime_type)
+    shrunk = _shrink_for_print(data)
+    if shrunk:
+        data, mime = shrunk
+    path = PRINT_IMAGE_DIR / f"{digest}{_PRINT_EXT.get(mime, '.png')}"
+    # Écriture dans un fichier temporaire puis renommage : un rendu concurrent ne lit jamais d'image tronquée.
+    PRINT_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return path
+
+
+def prune_print_images(max_age_days: int) -> int:
+    """Supprime les images du cache d'impression inutilisées depuis `max_age_days` jours."""
+    if not PRINT_IMAGE_DIR.is_dir():
+        return 0
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for f in PRINT_IMAGE_DIR.iterdir():
+        try:
+            if f.stat().st_mtime < cutoff:
+                f.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+# Capture tout <img src="/documents/.../images/N" …>
+IMG_RE = re.compile(
+    r'<img\s+[^>]*src=["\'](?P<src>/documents/\d+/images/(?P<img_id>\d+))["\'][^>]*>',
+    flags=re.IGNORECASE
+)
+ALT_RE = re.compile(r'alt=["\']([^"\']*)["\']')
 
 
 def markdown_to_pdf(md: str, title: str | None = None) -> bytes:
     """
     • Convertit Markdown → HTML fragment.
-    • Remplace chaque <img src="/documents/.../images/N"...> par une balise
-      <img src="data:<mime>;base64,..." alt="..." style="..."/> intégrée.
-    • Génère le PDF via wkhtmltopdf.
+    • Charge en une requête les images référencées (<img src="/documents/.../images/N">),
+      les place dans le cache d'impression (réduites si besoin) et remplace chaque balise par
+      <img src="file:///..." alt="..." style="..."/>.
+    • Génère le PDF avec le moteur configuré (WeasyPrint ou wkhtmltopdf).
     """
     # 1) Markdown → fragment HTML
     body_html = markdown.markdown(
         md,
         extensions=["extra", "toc", "tables", "fenced_code"]
     )
-    if title:
-        body_html = f"<h1>{title}</h1>\n" + body_html
-
-    # 2) Regex pour capturer tout <img src="/documents/.../images/N" …>
-    IMG_RE = re.compile(
-        r'<img\s+[^>]*src=["\'](?P<src>/documents/\d+/images/(?P<img_id>\d+))["\'][^>]*>',
-        flags=re.IGNORECASE
-    )
 
-    def _embed(match: re.Match[str]) -> str:
-        orig_tag = match.group(0)
-        img_id   = int(match.group("img_id"))
-
-        # On re-ouvre une session pour récupérer le BLOB
+    # 2) Chargement groupé des images référencées
+    img_ids = {int(m.group("img_id")) for m in IMG_RE.finditer(body_html)}
+    paths: dict[int, Path] = {}
+    if img_ids:
         with SessionLocal() as sess:
-            img = sess.get(DocumentImage, img_id)
-
-        if not img:
+            rows = sess.exec(
+                select(DocumentImage.id, DocumentImage.mime_type, DocumentImage.data)
+                .where(DocumentImage.id.in_(img_ids))
+            ).all()
+        for img_id, mime_type, data in rows:
+            paths[img_id] = print_image_path(data, mime_type)
+        del rows
+
+    def _link(match: re.Match[str]) -> str:
+        orig_tag = match.group(0)
+        path = paths.get(int(match.group("img_id")))
+        if path is None:
             return orig_tag  # si introuvable, on ne change rien
 
-        # Détection JPEG via signature binaire
-        data_bytes = img.data
-        if data_bytes[:2] == b'\xff\xd8':
-            mime = "image/jpeg"
-        else:
-            mime = img.mime_type  # ex: "image/png"
-
-        b64 = base64.b64encode(data_bytes).decode("ascii")
-
         # Récupère l'attribut alt si présent
-        alt_m = re.search(r'alt=["\']([^"\']*)["\']', orig_tag)
+        alt_m = ALT_RE.search(orig_tag)
         alt_text = alt_m.group(1) if alt_m else ""
 
-        # Reconstruction de la balise <img> embarquée
+        # Reconstruction de la balise <img> pointant vers le fichier local
         return (
             f'<img '
-            f'src="data:{mime};base64,{b64}" '
+            f'src="{path.as_uri()}" '
             f'alt="{alt_text}" '
             f'style="display:block;max-width:100%;height:auto;margin:1em 0;" '
             f'/>'
         )
 
-    # 3) Injection de toutes les images en data-URI
-    body_html = IMG_RE.sub(_embed, body_html)
-
-    # 4) Enveloppe HTML complet
-    full_html = f"""<!DOCTYPE html>
-<html lang="fr">
-<head>
-  <meta charset="utf-8"/>
-  <title>{title or ''}</title>
-  <style>
-    body {{ font-family: DejaVu Sans, Arial, sans-serif; margin:20px; }}
-    pre  {{ white-space: pre-wrap; word-break: break-word; }}
-    img  {{ display:block;max-width:100%;height:auto;margin:1em 0; }}
-  </style>
-</head>
-<body>
-{body_html}
-</body>
-</html>
-"""
-
-    # 5) Options wkhtmltopdf (ignore tout appel réseau)
-    options = {
-        "enable-local-file-access":    None,
-        "encoding":                   "UTF-8",
-        "margin-top":                 "15mm",
-        "margin-bottom":              "15mm",
-        "margin-left":                "15mm",
-        "margin-right":               "15mm",
-        "footer-right":               "[page] / [toPage]",
-        "load-error-handling":        "ignore",
-        "load-media-error-handling":  "ignore",
-    }
-
-    # 6) Génération et retour des octets PDF
-    return pdfkit.from_string(
-        full_html, False,
-        configuration=PDFKIT_CONFIG,
-        options=options
-    )
+    # 3) Remplacement des balises par les chemins des fichiers
+    body_html = IMG_RE.sub(_link, body_html)
+
+    # 4) Enveloppe HTML complet (gabarit partagé avec les rapports)
+    full_html = render_html("document.html", title=title, body_html=body_html)
+
+    # 5) Génération et retour des octets PDF (moteur configuré dans `pdf_render`)
+    return render_pdf(full_html, DOCUMENT_PAGE)
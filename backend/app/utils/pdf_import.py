@@ -0,0 +1,287 @@
+# app/utils/pdf_import.py
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+import fitz      # PyMuPDF
+from sqlalchemy import insert, select, update
+from sqlmodel import Session
+
+from app.db import SessionLocal
+from app.models import Document, DocumentImage, DocumentImport
+from app.utils import telemetry
+from app.utils.doc_history import record_version
+
+logger = logging.getLogger(__name__)
+
+# BLOC D'IMPORT DES PDF EN ARRIÈRE-PLAN
+# L'import d'un PDF (texte + images de chaque page) ne s'exécute plus dans la requête :
+# 1. la route enregistre le fichier, crée le document vide et lance la tâche d'import ;
+# 2. les pages sont découpées en tranches extraites en parallèle dans un pool de processus ; au plus
+#    PDF_IMPORT_WINDOW tranches sont soumises à la fois, la suivante part quand une tranche est
+#    enregistrée (les images extraites ne s'accumulent pas en mémoire) ;
+# 3. les images identiques (logo répété sur chaque page) sont dédupliquées par empreinte SHA-256,
+#    et les images nouvelles d'une tranche sont insérées en un seul INSERT groupé ;
+# 4. la progression (`DocumentImport`) est mise à jour après chaque tranche et visible via la route
+#    `.../import` ; le contenu Markdown du document est écrit une seule fois, à la fin.
+
+PDF_IMPORT_WORKERS = int(os.getenv("PDF_IMPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_IMPORT_CHUNK = int(os.getenv("PDF_IMPORT_CHUNK", "16"))   # pages par tranche
+# Taille maximale d'un PDF importé (413 au-delà, vérifié pendant la réception du fichier).
+PDF_IMPORT_MAX_BYTES = int(os.getenv("PDF_IMPORT_MAX_MB", "100")) * 1024 * 1024
+# Tranches soumises au pool et pas encore enregistrées (par import).
+PDF_IMPORT_WINDOW = int(os.getenv("PDF_IMPORT_WINDOW", str(2 * PDF_IMPORT_WORKERS)))
+
+PENDING, RUNNING, DONE, ERROR = "pending", "running", "done", "error"
+
+# (numéro de page à partir de 1, texte, empreintes des images dans l'ordre de la page)
+PageExtract = Tuple[int, str, List[str]]
+
+
+# ─── Extraction (exécutée dans les workers) ──────────────────────────────────
+
+def extract_page_range(source: Union[str, bytes], start: int = 0,
+                       stop: Optional[int] = None) -> Tuple[List[PageExtract], Dict[str, bytes]]:
+    """
+    Extrait le texte et les images des pages [start, stop) d'un PDF (chemin ou bytes).
+    Retourne les pages et les images PNG de la tranche, une seule fois par empreinte.
+    """
+    pages: List[PageExtract] = []
+    images: Dict[str, bytes] = {}
+    by_xref: Dict[int, str] = {}   # une image référencée par plusieurs pages n'est convertie qu'une fois
+    pdf = fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype="pdf")
+    try:
+        stop = pdf.page_count if stop is None else min(stop, pdf.page_count)
+        for pno in range(start, stop):
+            page = pdf[pno]
+            hashes = []
+            for img in page.get_images(full=True):
+                xref = img[0]
+                digest = by_xref.get(xref)
+                if digest is None:
+                    pix = fitz.Pixmap(pdf, xref)
+                    png = pix.tobytes("png")
+                    pix = None
+                    digest = by_xref[xref] = hashlib.sha256(png).hexdigest()
+                    images.setdefault(digest, png)
+                hashes.append(digest)
+            pages.append((pno + 1, page.get_text("text").strip(), hashes))
+    finally:
+        pdf.close()
+    return pages, images
+
+
+# ─── Enregistrement ──────────────────────────────────────────────────────────
+
+def store_pages(sess: Session, document_id: int, pages: List[PageExtract], images: Dict[str, bytes],
+                seen: Dict[str, int]) -> List[str]:
+    """
+    Insère (en un INSERT groupé) les images pas encore vues du document et retourne les morceaux
+    Markdown des pages. `seen` (empreinte -> id de `DocumentImage`) est complété au passage.
+    Ne fait pas de commit.
+    """
+    new = [digest for digest in images if digest not in seen]
+    if new:
+        rows = sess.execute(
+            insert(DocumentImage).returning(DocumentImage.id, DocumentImage.filename, sort_by_parameter_order=True),
+            [{"document_id": document_id, "filename": f"{digest}.png", "mime_type": "image/png",
+              "data": images[digest]} for digest in new],
+        ).all()
+        for img_id, filename in rows:
+            seen[filename.removesuffix(".png")] = img_id
+
+    md_chunks: List[str] = []
+    for pno, text, hashes in pages:
+        if text:
+            md_chunks.append(text)
+        for idx, digest in enumerate(hashes, start=1):
+            md_chunks.append(f"![page-{pno}-img-{idx}](/documents/{document_id}/images/{seen[digest]})")
+        md_chunks.append("")  # saut de ligne entre pages
+    return md_chunks
+
+
+# ─── Tâches d'import ─────────────────────────────────────────────────────────
+# L'état de chaque import est dans la table `DocumentImport` (une ligne par document) : la route de
+# suivi peut arriver sur un autre worker que celui qui exécute l'import. Tant que l'import est actif,
+# le document n'est ni modifiable ni supprimable (cf. `import_active`) ; l'import s'arrête de plus
+# dès que la version du document a changé, et le contenu final n'est écrit que sur cette version.
+
+# Un import actif sans progrès depuis ce délai (s) est considéré comme interrompu (worker arrêté) :
+# il ne bloque plus le document et apparaît en erreur.
+PDF_IMPORT_STALE = float(os.getenv("PDF_IMPORT_STALE", "600"))
+
+
+class DocumentChanged(Exception):
+    """Le document a été modifié ou supprimé pendant l'import."""
+
+
+def _is_stale(job: DocumentImport) -> bool:
+    return job.status in (PENDING, RUNNING) and job.updated_at < datetime.utcnow() - timedelta(seconds=PDF_IMPORT_STALE)
+
+
+def import_state(job: DocumentImport) -> Dict[str, Any]:
+    """État de l'import tel que renvoyé par la route de suivi."""
+    status, error = job.status, job.error
+    if _is_stale(job):
+        status, error = ERROR, "Import interrompu"
+    return {
+        "document_id": job.document_id,
+        "status": status,
+        "pages_done": job.pages_done,
+        "total_pages": job.total_pages,
+        "progress": round(job.pages_done / job.total_pages * 100) if job.total_pages else 100,
+        "images": job.images,
+        "error": error,
+    }
+
+
+def import_active(sess: Session, document_id: int) -> bool:
+    """Vrai si un import (non interrompu) est en attente ou en cours pour ce document."""
+    job = sess.get(DocumentImport, document_id)
+    return job is not None and job.status in (PENDING, RUNNING) and not _is_stale(job)
+
+
+def _update(sess: Session, document_id: int, **values: Any) -> None:
+    sess.execute(
+        update(DocumentImport).where(DocumentImport.document_id == document_id)
+        .values(**values, updated_at=datetime.utcnow())
+    )
+
+
+_lock = Lock()
+_local_active = 0   # imports en attente ou en cours dans ce processus (jauge)
+# Un thread par import coordonne les tranches ; l'extraction elle-même a lieu dans `_pool`.
+_coordinator = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdf-import")
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _extract_async(pdf_path: str, start: int, stop: int) -> Future:
+    global _pool
+    with _lock:
+        if _pool is None:
+            # "spawn" : les workers ne dupliquent pas l'état (threads, connexions) du serveur.
+            _pool = ProcessPoolExecutor(max_workers=PDF_IMPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool.submit(extract_page_range, pdf_path, start, stop)
+
+
+def _run(document_id: int, version: int, pdf_path: str, total_pages: int) -> None:
+    global _local_active
+    started = time.perf_counter()
+    in_flight: Deque[Future] = deque()
+    try:
+        with SessionLocal() as sess:
+            _update(sess, document_id, status=RUNNING)
+            sess.commit()
+        ranges = [(s, min(s + PDF_IMPORT_CHUNK, total_pages)) for s in range(0, total_pages, PDF_IMPORT_CHUNK)]
+        # Sans pool (PDF_IMPORT_WORKERS = 0), chaque tranche est extraite au moment où on l'attend.
+        window = max(1, PDF_IMPORT_WINDOW) if PDF_IMPORT_WORKERS > 0 else 0
+        submitted = 0
+        md_chunks: List[str] = []
+        seen: Dict[str, int] = {}
+        pages_done = 0
+        for s, e in ranges:
+            if window:
+                while submitted < len(ranges) and len(in_flight) < window:
+                    in_flight.append(_extract_async(pdf_path, *ranges[submitted]))
+                    submitted += 1
+                pages, images = in_flight.popleft().result()
+            else:
+                pages, images = extract_page_range(pdf_path, s, e)
+            pages_done += len(pages)
+            with SessionLocal() as sess:
+                if sess.execute(select(Document.version).where(Document.id == document_id)).scalar() != version:
+                    raise DocumentChanged()
+                md_chunks.extend(store_pages(sess, document_id, pages, images, seen))
+                _update(sess, document_id, pages_done=pages_done, images=len(seen))
+                sess.commit()
+            pages = images = None   # libère la tranche avant d'attendre la suivante
+
+        # Import terminé : contenu écrit en une fois, seulement si personne n'a enregistré de version
+        # entre-temps, puis première entrée de l'historique, comme pour un document créé à la main.
+        with SessionLocal() as sess:
+            content = "\n\n".join(md_chunks)
+            res = sess.execute(
+                update(Document).where(Document.id == document_id, Document.version == version)
+                .values(content=content, size=len(content))
+            )
+            if res.rowcount == 0:
+                raise DocumentChanged()
+            doc = sess.get(Document, document_id)
+            # Le contenu a été écrit par un UPDATE direct : la mise à jour de l'ORM
+            # déclenche la réindexation du document (app.utils.search).
+            doc.updated_at = datetime.utcnow()
+            sess.add(doc)
+            record_version(sess, doc)
+            _update(sess, document_id, status=DONE, finished_at=datetime.utcnow())
+            sess.commit()
+        telemetry.observe("pdf_import_seconds", time.perf_counter() - started, help="Durée des imports de PDF")
+    except Exception as e:
+        if isinstance(e, DocumentChanged):
+            logger.warning("Import PDF du document %s arrêté : document modifié ou supprimé", document_id)
+            error = "Document modifié ou supprimé pendant l'import"
+        else:
+            logger.exception("Échec de l'import PDF du document %s", document_id)
+            error = str(e)
+        with SessionLocal() as sess:
+            _update(sess, document_id, status=ERROR, error=error, finished_at=datetime.utcnow())
+            sess.commit()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        with _lock:
+            _local_active -= 1
+        try:
+            os.remove(pdf_path)
+        except OSError:
+            pass
+
+
+def count_pages(pdf_path: str) -> int:
+    """Nombre de pages du PDF ; lève ValueError si le fichier n'est pas un PDF lisible."""
+    try:
+        with fitz.open(pdf_path) as pdf:
+            if not pdf.is_pdf:
+                raise ValueError("not a PDF")
+            return pdf.page_count
+    except Exception as e:
+        raise ValueError(str(e))
+
+
+def submit_pdf_import(sess: Session, doc: Document, pdf_path: str, total_pages: int) -> DocumentImport:
+    """
+    Enregistre l'import de `pdf_path` (fichier temporaire, supprimé à la fin) dans le document `doc`,
+    puis le lance. Fait un commit.
+    """
+    global _local_active
+    job = DocumentImport(document_id=doc.id, team_id=doc.team_id, total_pages=total_pages)
+    sess.add(job)
+    sess.commit()
+    with _lock:
+        _local_active += 1
+    _coordinator.submit(_run, doc.id, doc.version, pdf_path, total_pages)
+    return job
+
+
+def get_import_job(document_id: int) -> Optional[DocumentImport]:
+    with SessionLocal() as sess:
+        return sess.get(DocumentImport, document_id)
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+telemetry.register_gauge(
+    "pdf_imports_active", lambda: _local_active, help="Imports de PDF en attente ou en cours (ce processus)"
+)
@@ -0,0 +1,235 @@
+# app/utils/pdf_render.py
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, NamedTuple, Optional, Union
+
+from app.utils.templating import write_html
+
+logger = logging.getLogger(__name__)
+
+# BLOC DES MOTEURS DE RENDU PDF
+# La conversion HTML → PDF passe par une interface unique (`render_pdf`) et un moteur choisi par
+# la variable `PDF_RENDERER` :
+#   - "weasyprint"  : rendu dans un processus Python (pas de sous-processus par document) ;
+#   - "wkhtmltopdf" : ancien moteur, un processus wkhtmltopdf lancé à chaque rendu ;
+#   - "auto"        : WeasyPrint s'il est utilisable, sinon wkhtmltopdf (défaut).
+# Les moteurs « en processus » tournent dans un pool de workers persistants (`PDF_RENDER_WORKERS`,
+# 2 par défaut, 0 pour rendre dans le processus de l'API) : chaque worker importe le moteur et charge
+# les polices une seule fois, et plusieurs rapports se rendent en parallèle sans bloquer le serveur
+# (le rendu tient le GIL). Le pool n'est démarré qu'au premier rendu ; chaque worker uvicorn a le sien.
+# Aucun moteur n'est importé au démarrage : l'application démarre même si aucun n'est installé.
+# Un moteur indisponible (import ou vérification en échec) est mémorisé comme tel pour la durée du
+# processus : il n'est ni retenté ni signalé à nouveau à chaque rendu (redémarrer après l'installation).
+
+PDF_RENDERER = os.getenv("PDF_RENDERER", "auto").lower()
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Ancien emplacement (Windows/WSL), encore utilisé si `WKHTMLTOPDF_PATH` n'est pas défini
+# et que wkhtmltopdf n'est pas dans le PATH.
+_LEGACY_WKHTMLTOPDF = os.path.join(os.getcwd(), "app", "utils", "wkhtmltopdf", "bin", "wkhtmltopdf.exe")
+
+Html = Union[str, Iterable[str]]
+
+
+class PageOptions(NamedTuple):
+    """Mise en page commune aux moteurs."""
+    margin_mm: int = 10
+    page_numbers: bool = False   # numéro "page / total" en bas à droite
+
+
+class RendererUnavailable(RuntimeError):
+    """Le moteur demandé n'est pas installé ou pas configuré sur cette machine."""
+
+
+# ─── Moteurs ─────────────────────────────────────────────────────────────────
+
+class WkhtmltopdfRenderer:
+    name = "wkhtmltopdf"
+    in_process = False
+
+    def __init__(self):
+        self.path = os.getenv("WKHTMLTOPDF_PATH") or shutil.which("wkhtmltopdf") or _LEGACY_WKHTMLTOPDF
+        self._config = None
+
+    def check(self) -> None:
+        try:
+            import pdfkit  # interface Python de l'outil en ligne de commande wkhtmltopdf
+        except ImportError as e:
+            raise RendererUnavailable(f"pdfkit n'est pas installé ({e})")
+        if not os.path.isfile(self.path):
+            raise RendererUnavailable(f"Cannot find wkhtmltopdf at {self.path}")
+        if self._config is None:
+            self._config = pdfkit.configuration(wkhtmltopdf=self.path)
+
+    def _options(self, page: PageOptions) -> Dict[str, Optional[str]]:
+        margin = f"{page.margin_mm}mm"
+        options = {
+            "enable-local-file-access": None,
+            "encoding": "UTF-8",
+            "margin-top": margin,
+            "margin-bottom": margin,
+            "margin-left": margin,
+            "margin-right": margin,
+            # ignore tout appel réseau ou ressource introuvable
+            "load-error-handling": "ignore",
+            "load-media-error-handling": "ignore",
+        }
+        if page.page_numbers:
+            options["footer-right"] = "[page] / [toPage]"
+        return options
+
+    def render_string(self, html: str, page: PageOptions) -> bytes:
+        import pdfkit
+        self.check()
+        return pdfkit.from_string(html, False, configuration=self._config, options=self._options(page))
+
+    def render_file(self, html_path: str, page: PageOptions) -> bytes:
+        import pdfkit
+        self.check()
+        return pdfkit.from_file(html_path, False, configuration=self._config, options=self._options(page))
+
+
+class WeasyPrintRenderer:
+    name = "weasyprint"
+    in_process = True
+
+    def __init__(self):
+        self._weasyprint = None
+        self._fonts = None
+        self._page_css: Dict[PageOptions, object] = {}
+
+    def check(self) -> None:
+        if self._weasyprint is not None:
+            return
+        try:
+            import weasyprint
+            from weasyprint.text.fonts import FontConfiguration
+        except (ImportError, OSError) as e:  # OSError : bibliothèques système (pango) absentes
+            raise RendererUnavailable(f"WeasyPrint n'est pas utilisable ({e})")
+        self._weasyprint = weasyprint
+        self._fonts = FontConfiguration()   # gardée pour tous les rendus de ce processus
+
+    def _stylesheet(self, page: PageOptions):
+        css = self._page_css.get(page)
+        if css is None:
+            footer = ('@bottom-right { content: counter(page) " / " counter(pages); font-size: 9pt; }'
+                      if page.page_numbers else "")
+            css = self._page_css[page] = self._weasyprint.CSS(
+                string=f"@page {{ size: A4; margin: {page.margin_mm}mm; {footer} }}",
+                font_config=self._fonts,
+            )
+        return css
+
+    def _write(self, document, page: PageOptions) -> bytes:
+        return document.write_pdf(stylesheets=[self._stylesheet(page)], font_config=self._fonts)
+
+    def render_string(self, html: str, page: PageOptions) -> bytes:
+        self.check()
+        return self._write(self._weasyprint.HTML(string=html, base_url="."), page)
+
+    def render_file(self, html_path: str, page: PageOptions) -> bytes:
+        self.check()
+        return self._write(self._weasyprint.HTML(filename=html_path, encoding="utf-8"), page)
+
+
+_RENDERERS = {"weasyprint": WeasyPrintRenderer, "wkhtmltopdf": WkhtmltopdfRenderer}
+_instances: Dict[str, object] = {}
+_unavailable: Dict[str, str] = {}   # moteur -> raison de son indisponibilité
+_lock = Lock()
+
+
+def get_renderer(name: Optional[str] = None):
+    """Retourne le moteur `name` (ou celui de `PDF_RENDERER`), prêt à l'emploi, ou lève `RendererUnavailable`."""
+    name = (name or PDF_RENDERER).lower()
+    candidates = ["weasyprint", "wkhtmltopdf"] if name == "auto" else [name]
+    errors = []
+    for candidate in candidates:
+        if candidate not in _RENDERERS:
+            raise RendererUnavailable(f"Moteur PDF inconnu : {candidate}")
+        with _lock:
+            reason = _unavailable.get(candidate)
+            renderer = _instances.get(candidate)
+            if renderer is None and reason is None:
+                renderer = _instances[candidate] = _RENDERERS[candidate]()
+        if reason is not None:
+            errors.append(reason)
+            continue
+        try:
+            renderer.check()
+            return renderer
+        except RendererUnavailable as e:
+            with _lock:
+                _unavailable[candidate] = str(e)
+            logger.warning("Moteur PDF %s indisponible : %s", candidate, e)
+            errors.append(str(e))
+    raise RendererUnavailable(" ; ".join(errors))
+
+
+# ─── Pool de workers persistants ─────────────────────────────────────────────
+
+def _init_worker(name: str) -> None:
+    # Exécuté une fois par worker : importe le moteur et charge les polices avant le premier rapport.
+    try:
+        get_renderer(name).render_string("<p></p>", PageOptions())
+    except RendererUnavailable:
+        pass
+
+
+def _render_in_worker(name: str, html_path: str, page: PageOptions) -> bytes:
+    return get_renderer(name).render_file(html_path, page)
+
+
+_pools: Dict[str, ProcessPoolExecutor] = {}
+
+
+def _pool_for(name: str, workers: int) -> ProcessPoolExecutor:
+    with _lock:
+        pool = _pools.get(name)
+        if pool is None:
+            # "spawn" : les workers ne dupliquent pas l'état (threads, connexions) du serveur.
+            pool = _pools[name] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(name,),
+            )
+        return pool
+
+
+def shutdown_pools() -> None:
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ─── Point d'entrée ──────────────────────────────────────────────────────────
+
+def render_pdf(html: Html, page: PageOptions = PageOptions(), renderer: Optional[str] = None,
+               workers: Optional[int] = None) -> bytes:
+    """
+    Convertit du HTML (chaîne, ou morceaux produits par `templating.stream_html`) en bytes PDF.
+    Les morceaux sont écrits au fil de l'eau dans un fichier temporaire lu par le moteur.
+    Avec un moteur en processus et `workers` (défaut : `PDF_RENDER_WORKERS`) > 0, le rendu
+    a lieu dans le pool de workers persistants.
+    """
+    engine = get_renderer(renderer)
+    workers = PDF_RENDER_WORKERS if workers is None else workers
+    use_pool = engine.in_process and workers > 0
+
+    if isinstance(html, str) and not use_pool:
+        return engine.render_string(html, page)
+
+    with tempfile.TemporaryDirectory(prefix="smia-pdf-") as tmp:
+        html_path = Path(tmp) / "document.html"
+        write_html(html, html_path)
+        if use_pool:
+            future = _pool_for(engine.name, workers).submit(_render_in_worker, engine.name, str(html_path), page)
+            return future.result()
+        return engine.render_file(str(html_path), page)
@@ -0,0 +1,62 @@
+# app/utils/ratelimit.py
+import os
+import time
+from threading import Lock
+from typing import Optional
+
+from cachetools import TTLCache
+from fastapi import HTTPException, Request
+
+from app.utils import telemetry
+
+# BLOC DU LIMITEUR DE DÉBIT (TOKEN BUCKET)
+# Chaque clé (adresse IP, nom d'utilisateur, ...) dispose d'un seau de `burst` jetons qui se
+# remplit à `rate` jetons par seconde. Une requête consomme un jeton ; un seau vide donne un 429.
+# Les seaux inactifs disparaissent du cache, la mémoire reste bornée.
+
+
+class TokenBucketLimiter:
+    def __init__(self, name: str, rate: float, burst: int, max_keys: int = 10000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        # Un seau plein se reconstitue en burst / rate secondes : au-delà, on peut l'oublier.
+        ttl = max(burst / rate, 1.0) if rate > 0 else 3600.0
+        self._buckets: TTLCache = TTLCache(maxsize=max_keys, ttl=ttl)
+        self._lock = Lock()
+
+    def try_acquire(self, key: str) -> Optional[float]:
+        """Consomme un jeton pour `key`. Retourne None si accepté, sinon le délai d'attente (s)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            if tokens >= 1.0:
+                self._buckets[key] = (tokens - 1.0, now)
+                return None
+            self._buckets[key] = (tokens, now)
+        return (1.0 - tokens) / self.rate if self.rate > 0 else 60.0
+
+    def check(self, *keys: str) -> None:
+        """Lève une 429 (avec `Retry-After`) si l'une des clés a épuisé son seau."""
+        for key in keys:
+            wait = self.try_acquire(key)
+            if wait is not None:
+                telemetry.inc(f"{self.name}_rate_limited_total", help="Requêtes refusées par le limiteur de débit")
+                raise HTTPException(
+                    status_code=429,
+                    detail="Trop de tentatives, réessayez plus tard",
+                    headers={"Retry-After": str(max(1, int(wait + 0.999)))},
+                )
+
+
+# `X-Forwarded-For` n'est pris en compte que derrière un proxy de confiance (sinon falsifiable).
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+
+
+def client_ip(request: Request) -> str:
+    """Adresse du client (premier saut de `X-Forwarded-For` si le proxy est de confiance)."""
+    forwarded = request.headers.get("x-forwarded-for") if TRUST_FORWARDED_FOR else None
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
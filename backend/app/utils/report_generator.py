@@ -1,272 +1,196 @@
 # app/utils/report_generator.py
 
-from typing import Dict, Any
+from collections import defaultdict
+from typing import Dict, Any, Iterable, Iterator, List, Tuple, Union
 from sqlmodel import Session, select
 from app.db import SessionLocal
 from app.models import (
+    ActionCorrective,
     AIProject,
     ISO42001ChecklistItem,
     EvaluationRun,
+    NonConformite,
+    Proof,
+    TeamMembership,
+    User,
 )
+from app.utils.compliance import project_compliance_counts
+from app.utils.cache import cache_key, get_or_compute, project_scope, team_scope
+from app.utils.pdf_render import PageOptions, render_pdf
+from app.utils.templating import render_html, stream_html
+
+# Mise en page du rapport d'audit (marges par défaut de wkhtmltopdf, sans pied de page).
+REPORT_PAGE = PageOptions(margin_mm=10, page_numbers=False)
 
 def get_audit_data_for_project(project_id: int) -> Dict[str, Any]:
+    # Les données d'audit sont mises en cache par version du projet et de l'équipe
+    # (les membres de l'équipe apparaissent dans le rapport).
     with SessionLocal() as sess:
         project = sess.get(AIProject, project_id)
         if not project:
             raise ValueError(f"Projet {project_id} introuvable")
-
-        checklist_items = []
-        for item in project.checklist_items:
-            questions_data = []
-            for idx, question in enumerate(item.audit_questions):
-                # Preuves liées à cette question
-                proofs_for_question = [
-                    {
-                        "filename": proof.filename,
-                        "proof_id": proof.id,
-                        "checklist_item_id": proof.checklist_item_id,
-                        "evidence_id": proof.evidence_id,
-                    }
-                    for proof in item.proofs
-                    if proof.evidence_id in question.get("evidence_refs", [])
-                ]
-
-                # Non-conformités liées à cette question
-                ncs_for_question = []
-                for nc in item.non_conformites:
-                    if nc.question_index == idx:
-                        actions_for_nc = [
-                            {
-                                "description": action.description,
-                                "responsible": getattr(action.responsible_user, "username", "?") if action.responsible_user else "?",
-                                "deadline": action.deadline.isoformat() if action.deadline else None,
-                                "status": action.status,
-                            }
-                            for action in nc.actions_correctives
-                        ]
-
-                        ncs_for_question.append({
-                            "id": nc.id,
-                            "type_nc": nc.type_nc.value if hasattr(nc.type_nc, "value") else nc.type_nc,
-                            "statut": nc.statut.value if hasattr(nc.statut, "value") else nc.statut,
-                            "deadline_correction": nc.deadline_correction.isoformat() if nc.deadline_correction else None,
-                            "actions_correctives": actions_for_nc,
-                        })
-
-                questions_data.append({
-                    "question": question.get("question", ""),
-                    "status": item.statuses[idx] if idx < len(item.statuses) else "",
-                    "result": item.results[idx] if idx < len(item.results) else "",
-                    "observation": item.observations[idx] if idx < len(item.observations) else "",
-                    "evidence_required": item.evidence_required,
-                    "proofs": proofs_for_question,
-                    "non_conformities": ncs_for_question,
-                })
-
-            checklist_items.append({
-                "control_id": item.control_id,
-                "control_name": item.control_name,
-                "description": item.description,
-                "status": item.status,
-                "result": item.result,
-                "observation": item.observation,
-                "audit_questions": questions_data,
+        ck = cache_key(sess, "audit", project_scope(project_id), team_scope(project.team_id))
+        return get_or_compute(ck, lambda: _build_audit_data(sess, project))
+
+
+def _enum_value(v):
+    return v.value if hasattr(v, "value") else v
+
+
+def _build_audit_data(sess: Session, project: AIProject) -> Dict[str, Any]:
+    # BLOC D'ASSEMBLAGE DES DONNÉES D'AUDIT
+    # Quelques requêtes ensemblistes (items, preuves, NC, actions, membres) au lieu de parcourir les
+    # relations paresseuses item par item. Les résultats sont rangés dans des dictionnaires indexés
+    # par (item, evidence_id) et (item, question_index), puis lus directement pour chaque question.
+    # Seules les métadonnées des preuves sont lues, jamais `Proof.content`.
+    project_id = project.id
+    items = sess.exec(
+        select(ISO42001ChecklistItem)
+        .where(ISO42001ChecklistItem.project_id == project_id)
+        .order_by(ISO42001ChecklistItem.id)
+    ).all()
+
+    # (item_id, evidence_id) -> preuves
+    proofs_by_evidence: Dict[Tuple[int, str], List[Dict[str, Any]]] = defaultdict(list)
+    for proof_id, item_id, evidence_id, filename in sess.exec(
+        select(Proof.id, Proof.checklist_item_id, Proof.evidence_id, Proof.filename)
+        .join(ISO42001ChecklistItem, ISO42001ChecklistItem.id == Proof.checklist_item_id)
+        .where(ISO42001ChecklistItem.project_id == project_id)
+        .order_by(Proof.id)
+    ).all():
+        proofs_by_evidence[(item_id, evidence_id)].append({
+            "filename": filename,
+            "proof_id": proof_id,
+            "checklist_item_id": item_id,
+            "evidence_id": evidence_id,
+        })
+
+    ncs = sess.exec(
+        select(NonConformite)
+        .join(ISO42001ChecklistItem, ISO42001ChecklistItem.id == NonConformite.checklist_item_id)
+        .where(ISO42001ChecklistItem.project_id == project_id)
+        .order_by(NonConformite.id)
+    ).all()
+
+    # nc_id -> actions correctives (avec le nom du responsable, par jointure externe)
+    actions_by_nc: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    if ncs:
+        for action, username in sess.exec(
+            select(ActionCorrective, User.username)
+            .outerjoin(User, User.id == ActionCorrective.responsible_user_id)
+            .where(ActionCorrective.non_conformite_id.in_([nc.id for nc in ncs]))
+            .order_by(ActionCorrective.id)
+        ).all():
+            actions_by_nc[action.non_conformite_id].append({
+                "description": action.description,
+                "responsible": username or "?",
+                "deadline": action.deadline.isoformat() if action.deadline else None,
+                "status": action.status,
             })
 
-        # Récupérer les membres de l'équipe via la relation "team" du projet
-        team_members = []
-        if project.team and project.team.members:
-            for membership in project.team.members:
-                if membership.user:
-                    team_members.append({"username": membership.user.username})
+    # (item_id, question_index) -> non-conformités
+    ncs_by_question: Dict[Tuple[int, int], List[Dict[str, Any]]] = defaultdict(list)
+    for nc in ncs:
+        ncs_by_question[(nc.checklist_item_id, nc.question_index)].append({
+            "id": nc.id,
+            "type_nc": _enum_value(nc.type_nc),
+            "statut": _enum_value(nc.statut),
+            "deadline_correction": nc.deadline_correction.isoformat() if nc.deadline_correction else None,
+            "actions_correctives": actions_by_nc.get(nc.id, []),
+        })
+
+    checklist_items = []
+    for item in items:
+        questions_data = []
+        for idx, question in enumerate(item.audit_questions):
+            # Preuves liées à cette question (une preuve citée deux fois n'apparaît qu'une fois)
+            proofs_for_question = sorted(
+                (proof
+                 for ev in dict.fromkeys(question.get("evidence_refs", []))
+                 for proof in proofs_by_evidence.get((item.id, ev), ())),
+                key=lambda proof: proof["proof_id"],
+            )
+            questions_data.append({
+                "question": question.get("question", ""),
+                "status": item.statuses[idx] if idx < len(item.statuses) else "",
+                "result": item.results[idx] if idx < len(item.results) else "",
+                "observation": item.observations[idx] if idx < len(item.observations) else "",
+                "evidence_required": item.evidence_required,
+                "proofs": proofs_for_question,
+                "non_conformities": ncs_by_question.get((item.id, idx), []),
+            })
 
-        return {
-            "project_title": project.title,
-            "description": project.description or "",
-            "team_members": team_members,
-            "checklist_items": checklist_items,
-        }
+        checklist_items.append({
+            "control_id": item.control_id,
+            "control_name": item.control_name,
+            "description": item.description,
+            "status": item.status,
+            "result": item.result,
+            "observation": item.observation,
+            "audit_questions": questions_data,
+        })
+
+    # Membres de l'équipe du projet, en une jointure
+    team_members = [
+        {"username": username}
+        for username in sess.exec(
+            select(User.username)
+            .join(TeamMembership, TeamMembership.user_id == User.id)
+            .where(TeamMembership.team_id == project.team_id)
+            .order_by(TeamMembership.invited_at, TeamMembership.user_id)
+        ).all()
+    ]
+
+    # Synthèse lue dans le résumé de conformité matérialisé (pas de recalcul question par question).
+    compliance = project_compliance_counts(sess, [project_id]).get(project_id, {})
+    total = compliance.get("total", 0)
+    compliance["score"] = round(compliance.get("compliant", 0) / total * 100, 1) if total else 0
+
+    return {
+        "project_title": project.title,
+        "description": project.description or "",
+        "team_members": team_members,
+        "checklist_items": checklist_items,
+        "compliance": compliance,
+    }
 
 
 def get_risk_analysis_for_project(project_id: int) -> Dict[str, Any]:
     with SessionLocal() as sess:
-        eval_run = sess.exec(
-            select(EvaluationRun)
-            .where(EvaluationRun.project_id == project_id)
-            .order_by(EvaluationRun.created_at.desc())
-        ).first()
-        if not eval_run:
-            return {}
+        ck = cache_key(sess, "risk", project_scope(project_id))
+        return get_or_compute(ck, lambda: _latest_evaluation_metrics(sess, project_id))
 
-        return eval_run.metrics or {}
 
+def _latest_evaluation_metrics(sess: Session, project_id: int) -> Dict[str, Any]:
+    eval_run = sess.exec(
+        select(EvaluationRun)
+        .where(EvaluationRun.project_id == project_id)
+        .order_by(EvaluationRun.created_at.desc())
+    ).first()
+    if not eval_run:
+        return {}
 
-def generate_report_html(audit_data: Dict[str, Any], risk_analysis_data: Dict[str, Any]) -> str:
-    # HTML + CSS complet, moderne et lisible
-    html = f"""<!DOCTYPE html>
-<html lang="fr">
-<head>
-<meta charset="UTF-8" />
-<title>Rapport d’Audit et d’Analyse des Risques IA</title>
-<style>
-  body {{
-    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-    margin: 30px;
-    color: #222;
-    background: #f9f9f9;
-  }}
-  h1, h2, h3, h4 {{
-    color: #004d99;
-  }}
-  table {{
-    border-collapse: collapse;
-    width: 100%;
-    margin-bottom: 25px;
-  }}
-  th, td {{
-    border: 1px solid #ccc;
-    padding: 10px;
-    text-align: left;
-  }}
-  th {{
-    background-color: #e6f0ff;
-  }}
-  tr:nth-child(even) {{
-    background-color: #f2faff;
-  }}
-  .section-separator {{
-    border-top: 3px solid #004d99;
-    margin: 40px 0 30px 0;
-  }}
-  ul {{
-    margin: 10px 0 20px 20px;
-  }}
-  .small-text {{
-    font-size: 0.9em;
-    color: #555;
-  }}
-  .nc-actions {{
-    margin-left: 15px;
-  }}
-</style>
-</head>
-<body>
-
-<h1>Rapport d’Audit et d’Analyse des Risques IA</h1>
+    return eval_run.metrics or {}
 
-<h2>1. Introduction</h2>
-<p><strong>Projet :</strong> {audit_data['project_title']}</p>
-<p><strong>Description :</strong> {audit_data.get('description', 'Non spécifiée')}</p>
 
-<div class="section-separator"></div>
+# ─── Rendu HTML ──────────────────────────────────────────────────────────────
+# Le gabarit `app/templates/reports/audit_risk_report.html` décrit la mise en page du rapport.
 
-<h2>2. Résultats de l’Audit Organisationnel (ISO 42001)</h2>
-"""
+def stream_report_html(audit_data: Dict[str, Any], risk_analysis_data: Dict[str, Any]) -> Iterator[str]:
+    """HTML complet du rapport, produit par morceaux."""
+    return stream_html("audit_risk_report.html", audit=audit_data, risk=risk_analysis_data)
 
-    for item in audit_data["checklist_items"]:
-        html += f"""
-<h3>{item['control_id']} - {item['control_name']}</h3>
-<p><strong>Description :</strong> {item['description']}</p>
-<p><strong>Statut global :</strong> {item.get('status', '')} | <strong>Résultat global :</strong> {item.get('result', '')}</p>
-"""
-        if item.get('observation'):
-            html += f"<p><strong>Observation globale :</strong> {item.get('observation')}</p>"
 
-        # Questions détaillées
-        for idx, question in enumerate(item.get("audit_questions", []), start=1):
-            html += f"""
-<h4>Question {idx}: {question.get('question', '')}</h4>
-<ul>
-  <li><strong>Statut :</strong> {question.get('status', '')}</li>
-  <li><strong>Résultat :</strong> {question.get('result', '')}</li>"""
-            if question.get('observation'):
-                html += f"<li><strong>Observation :</strong> {question.get('observation')}</li>"
-            # Preuves
-            proofs = question.get('proofs', [])
-            if proofs:
-                html += "<li><strong>Preuves associées :</strong><ul>"
-                for proof in proofs:
-                    html += f"<li>{proof['filename']}</li>"
-                html += "</ul></li>"
-            # Non-conformités et actions
-            ncs = question.get('non_conformities', [])
-            if ncs:
-                html += "<li><strong>Non-conformités associées :</strong><ul>"
-                for nc in ncs:
-                    html += f"""
-<li>
-Type : {nc.get('type_nc','')} | Statut : {nc.get('statut','')} | Deadline : {nc.get('deadline_correction', 'N/A')}
-"""
-                    actions = nc.get('actions_correctives', [])
-                    if actions:
-                        html += "<ul class='nc-actions'>"
-                        for action in actions:
-                            html += f"<li>{action['description']} (Responsable : {action.get('responsible','?')}, Deadline : {action.get('deadline')}, Statut : {action.get('status')})</li>"
-                        html += "</ul>"
-                    html += "</li>"
-                html += "</ul></li>"
-            html += "</ul>"
-
-        html += '<hr style="margin:40px 0;">'
-
-    # Analyse technique risques IA
-    html += """
-<div class="section-separator"></div>
-<h2>3. Analyse Technique des Risques IA</h2>
-
-<h3>3.1 Performance du modèle</h3>
-<ul>
-"""
-    performance = risk_analysis_data.get("performance", {})
-    if performance:
-        for k, v in performance.items():
-            html += f"<li><strong>{k} :</strong> {v:.4f}</li>"
-    else:
-        html += "<li>Aucune donnée de performance disponible.</li>"
-    html += "</ul>"
-
-    # Fairness / Equité
-    html += "<h3>3.2 Équité et biais</h3>"
-    fairness = risk_analysis_data.get("fairness", {})
-    if fairness:
-        for attr, metrics in fairness.items():
-            html += f"<h4>Attribut sensible : {attr}</h4><ul>"
-            for metric_name, metric_val in metrics.items():
-                html += f"<li>{metric_name}: {metric_val}</li>"
-            html += "</ul>"
-    else:
-        html += "<p>Aucune donnée d’équité disponible.</p>"
-
-    # Drift / Dérive
-    html += "<h3>3.3 Dérive des données</h3><ul>"
-    drift = risk_analysis_data.get("drift", {})
-    if drift:
-        for test_name, val in drift.items():
-            html += f"<li>{test_name} : {val}</li>"
-    else:
-        html += "<li>Aucune donnée de dérive disponible.</li>"
-    html += "</ul>"
-
-    # Robustesse
-    html += "<h3>3.4 Robustesse</h3><ul>"
-    robustness = risk_analysis_data.get("robustness", {})
-    if robustness:
-        for k, v in robustness.items():
-            html += f"<li>{k}: {v}</li>"
-    else:
-        html += "<li>Aucune donnée de robustesse disponible.</li>"
-    html += "</ul>"
-
-    # Synthèse & recommandations
-    html += """
-<div class="section-separator"></div>
-<h2>4. Synthèse & Recommandations</h2>
-<p>(À compléter selon contexte et analyses)</p>
+def generate_report_html(audit_data: Dict[str, Any], risk_analysis_data: Dict[str, Any]) -> str:
+    """HTML complet du rapport, en une seule chaîne."""
+    return render_html("audit_risk_report.html", audit=audit_data, risk=risk_analysis_data)
 
-<h2>5. Annexes</h2>
-<p>Données brutes et fichiers annexes.</p>
 
-</body>
-</html>"""
+# ─── Conversion HTML → PDF ───────────────────────────────────────────────────
 
-    return html
+def render_report_pdf(report_html: Union[str, Iterable[str]]) -> bytes:
+    """
+    Convertit le HTML du rapport (chaîne ou morceaux de `stream_report_html`) en bytes PDF,
+    avec le moteur configuré dans `app.utils.pdf_render`.
+    """
+    return render_pdf(report_html, REPORT_PAGE)
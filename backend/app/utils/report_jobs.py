@@ -0,0 +1,258 @@
+# app/utils/report_jobs.py
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import delete, update
+from sqlmodel import Session, select
+
+from app.db import SessionLocal
+from app.models import ReportJob
+from app.utils import telemetry
+from app.utils.report_generator import (
+    get_audit_data_for_project,
+    get_risk_analysis_for_project,
+    render_report_pdf,
+    stream_report_html,
+)
+
+logger = logging.getLogger(__name__)
+
+# BLOC DES TÂCHES DE GÉNÉRATION DU RAPPORT PDF
+# La conversion HTML → PDF (wkhtmltopdf) prend plusieurs secondes pour une checklist complète :
+# elle ne s'exécute plus dans la requête mais dans un pool dédié. Le client crée une tâche (POST),
+# suit sa progression (GET ou SSE) puis télécharge le fichier.
+# L'état des tâches est dans la table `ReportJob` : avec plusieurs workers uvicorn, le suivi et le
+# téléchargement peuvent arriver sur un autre worker que celui qui exécute la tâche.
+# Chaque PDF est stocké sous l'empreinte SHA-256 des données qui l'ont produit : un projet inchangé
+# retrouve son fichier sans repasser par wkhtmltopdf, même après un redémarrage. L'empreinte sert
+# aussi d'ETag, pour les tâches comme pour la route synchrone.
+
+REPORTS_DIR = Path(__file__).resolve().parents[2] / "storage" / "reports"
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+# Une tâche en attente ou en cours sans progrès depuis ce délai (s) est considérée comme interrompue
+# (worker arrêté pendant la génération) : elle n'est plus réutilisée et apparaît en erreur.
+REPORT_JOB_STALE = float(os.getenv("REPORT_JOB_STALE", "600"))
+# À incrémenter dès que la mise en page du rapport change : les anciens fichiers ne sont plus réutilisés.
+REPORT_FORMAT_VERSION = "2"
+
+PENDING, RUNNING, DONE, ERROR = "pending", "running", "done", "error"
+
+_executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+_lock = Lock()
+_local_active = 0   # tâches en attente ou en cours dans ce processus (jauge)
+
+
+def _is_stale(job: ReportJob) -> bool:
+    return job.status in (PENDING, RUNNING) and job.updated_at < datetime.utcnow() - timedelta(seconds=REPORT_JOB_STALE)
+
+
+def job_state(job: ReportJob) -> Dict[str, Any]:
+    """État de la tâche tel que renvoyé par les routes de suivi."""
+    status, stage, error = job.status, job.stage, job.error
+    if _is_stale(job):
+        status, stage, error = ERROR, "error", "Génération interrompue, relancer la tâche"
+    return {
+        "job_id": job.id,
+        "project_id": job.project_id,
+        "status": status,
+        "stage": stage,
+        "progress": job.progress,
+        "error": error,
+        "cached": job.cached,
+        "etag": report_etag(job.data_hash) if job.data_hash else None,
+    }
+
+
+def report_path(data_hash: str) -> Path:
+    return REPORTS_DIR / f"{data_hash}.pdf"
+
+
+def report_etag(data_hash: str) -> str:
+    return f'"{data_hash[:32]}"'
+
+
+def report_data_hash(audit_data: Dict[str, Any], risk_data: Dict[str, Any]) -> str:
+    """Empreinte stable des données d'entrée du rapport (clés triées, version du format incluse)."""
+    payload = json.dumps(
+        {"format": REPORT_FORMAT_VERSION, "audit": audit_data, "risk": risk_data},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    # Écriture dans un fichier temporaire puis renommage : un lecteur ne voit jamais de PDF tronqué.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+
+
+def _update(job_id: str, **values: Any) -> None:
+    # Chaque étape est écrite dans sa propre transaction courte (lue par les autres workers).
+    with SessionLocal() as sess:
+        sess.execute(update(ReportJob).where(ReportJob.id == job_id).values(**values, updated_at=datetime.utcnow()))
+        sess.commit()
+
+
+def build_report(project_id: int, job_id: Optional[str] = None) -> Tuple[str, bool]:
+    """
+    Produit (ou retrouve) le PDF du projet. Retourne (empreinte, True si le fichier existait déjà).
+    Si `job_id` est fourni, la progression de la tâche est mise à jour à chaque étape.
+    """
+    def step(**values: Any) -> None:
+        if job_id is not None:
+            _update(job_id, **values)
+
+    step(stage="audit_data", progress=10)
+    audit_data = get_audit_data_for_project(project_id)
+    step(stage="risk_data", progress=30)
+    risk_data = get_risk_analysis_for_project(project_id)
+    data_hash = report_data_hash(audit_data, risk_data)
+
+    path = report_path(data_hash)
+    if path.is_file():
+        os.utime(path)   # date de dernier usage : cf. `prune_reports`
+        step(data_hash=data_hash)
+        telemetry.inc("report_cache_hits_total", help="Rapports PDF servis depuis le stockage")
+        return data_hash, True
+
+    step(stage="render", progress=50, data_hash=data_hash)
+    started = time.perf_counter()
+    pdf_bytes = render_report_pdf(stream_report_html(audit_data, risk_data))
+    telemetry.observe("report_render_seconds", time.perf_counter() - started,
+                      help="Durée de la conversion HTML → PDF des rapports")
+    _write_atomic(path, pdf_bytes)
+    return data_hash, False
+
+
+def _run(job_id: str, project_id: int) -> None:
+    global _local_active
+    _update(job_id, status=RUNNING, stage="started")
+    try:
+        data_hash, cached = build_report(project_id, job_id)
+        _update(job_id, status=DONE, stage="done", progress=100, data_hash=data_hash, cached=cached,
+                finished_at=datetime.utcnow())
+    except Exception as e:
+        logger.exception("Échec de la génération du rapport du projet %s", project_id)
+        _update(job_id, status=ERROR, stage="error", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        with _lock:
+            _local_active -= 1
+
+
+def known_report_hash(sess: Session, version_key: str) -> Optional[str]:
+    """Empreinte du PDF déjà produit pour cette version des données (None si aucun fichier)."""
+    data_hash = sess.exec(
+        select(ReportJob.data_hash)
+        .where(ReportJob.version_key == version_key, ReportJob.status == DONE, ReportJob.data_hash != None)  # noqa: E711
+        .order_by(ReportJob.finished_at.desc())
+    ).first()
+    if data_hash is None:
+        return None
+    try:
+        os.utime(report_path(data_hash))
+    except OSError:   # fichier purgé : le rapport sera régénéré
+        return None
+    return data_hash
+
+
+def _new_job(sess: Session, team_id: int, project_id: int, version_key: str, **values: Any) -> ReportJob:
+    job = ReportJob(id=uuid.uuid4().hex, team_id=team_id, project_id=project_id, version_key=version_key, **values)
+    sess.add(job)
+    sess.commit()
+    sess.refresh(job)
+    return job
+
+
+def submit_report_job(sess: Session, team_id: int, project_id: int, version_key: str) -> ReportJob:
+    """
+    Crée la tâche de génération du rapport pour la version courante du projet.
+    - Si le PDF de cette version existe déjà, la tâche est immédiatement terminée.
+    - Si une tâche pour cette version est déjà en cours (dans n'importe quel worker), elle est réutilisée.
+    Deux créations simultanées sur deux workers peuvent lancer deux générations : elles écrivent
+    le même fichier (renommage atomique), sans autre effet qu'un rendu en double.
+    """
+    global _local_active
+    active = sess.exec(
+        select(ReportJob)
+        .where(
+            ReportJob.version_key == version_key,
+            ReportJob.status.in_((PENDING, RUNNING)),
+            ReportJob.updated_at >= datetime.utcnow() - timedelta(seconds=REPORT_JOB_STALE),
+        )
+        .order_by(ReportJob.created_at.desc())
+    ).first()
+    if active is not None:
+        return active
+
+    known_hash = known_report_hash(sess, version_key)
+    if known_hash:
+        telemetry.inc("report_cache_hits_total", help="Rapports PDF servis depuis le stockage")
+        return _new_job(sess, team_id, project_id, version_key, status=DONE, stage="done", progress=100,
+                        data_hash=known_hash, cached=True, finished_at=datetime.utcnow())
+
+    job = _new_job(sess, team_id, project_id, version_key)
+    with _lock:
+        _local_active += 1
+    _executor.submit(_run, job.id, project_id)
+    return job
+
+
+def run_report(sess: Session, team_id: int, project_id: int, version_key: str) -> str:
+    """
+    Produit le PDF dans l'appel (route synchrone) et l'enregistre comme une tâche terminée, pour que
+    les requêtes suivantes sur la même version répondent sans recalculer l'empreinte.
+    Retourne l'empreinte ; lève RuntimeError en cas d'échec.
+    """
+    global _local_active
+    known_hash = known_report_hash(sess, version_key)
+    if known_hash:
+        return known_hash
+    job = _new_job(sess, team_id, project_id, version_key)
+    with _lock:
+        _local_active += 1
+    _run(job.id, project_id)
+    sess.refresh(job)
+    if job.status != DONE:
+        raise RuntimeError(job.error or "Échec de la génération du rapport")
+    return job.data_hash
+
+
+def get_report_job(job_id: str) -> Optional[ReportJob]:
+    with SessionLocal() as sess:
+        return sess.get(ReportJob, job_id)
+
+
+def prune_reports(retention_days: int) -> Dict[str, int]:
+    """Supprime les PDF inutilisés depuis `retention_days` jours et les tâches terminées plus anciennes."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    with SessionLocal() as sess:
+        jobs = sess.execute(delete(ReportJob).where(ReportJob.created_at < cutoff)).rowcount
+        sess.commit()
+    files = 0
+    if REPORTS_DIR.is_dir():
+        for f in REPORTS_DIR.iterdir():   # rapports et fichiers temporaires d'une écriture interrompue
+            try:
+                if datetime.utcfromtimestamp(f.stat().st_mtime) < cutoff:
+                    f.unlink()
+                    files += 1
+            except OSError:
+                pass
+    if jobs or files:
+        logger.info("Rapports purgés : %d fichiers, %d tâches", files, jobs)
+    return {"files": files, "jobs": jobs}
+
+
+telemetry.register_gauge(
+    "report_jobs_active", lambda: _local_active, help="Générations de rapport PDF en attente ou en cours (ce processus)"
+)
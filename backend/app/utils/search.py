@@ -0,0 +1,304 @@
+# app/utils/search.py
+import hashlib
+import html
+import json
+import logging
+import os
+import sqlite3
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from sqlalchemy import bindparam, event, select as sa_select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session as SASession, defer
+from sqlmodel import select
+
+from app.db import SessionLocal, engine
+from app.models import AIProject, Comment, Document, DocumentHistory, ISO42001ChecklistItem, Proof
+
+logger = logging.getLogger(__name__)
+
+# BLOC DE L'INDEX DE RECHERCHE PLEIN TEXTE
+# Un index SQLite FTS5 (`search_index`) couvre les documents, leurs versions archivées,
+# les observations de la checklist, les commentaires de projet et les noms des fichiers de preuve.
+# L'index est tenu à jour dans la même transaction que les écritures (événement `after_flush`,
+# comme les versions de `app.utils.cache`) et interrogé par `/teams/{team_id}/search`,
+# classé par pertinence (bm25) avec extraits surlignés.
+#
+# Chaque ligne de l'index a pour rowid `id source * 8 + code du type` (empreinte de l'id pour les UUID) : la mise à jour d'une
+# entrée se fait par rowid, sans parcourir l'index. Les colonnes UNINDEXED servent au filtrage
+# (équipe, projet) et à retrouver la source d'un résultat.
+# Seul SQLite est pris en charge : sur un autre moteur, l'index est désactivé et la recherche répond 503.
+
+SEARCH_SNIPPET_TOKENS = int(os.getenv("SEARCH_SNIPPET_TOKENS", "16"))
+
+DOCUMENT, HISTORY, OBSERVATION, COMMENT, PROOF = "document", "history", "observation", "comment", "proof"
+KINDS = {DOCUMENT: 1, HISTORY: 2, OBSERVATION: 3, COMMENT: 4, PROOF: 5}
+_MODELS = {Document: DOCUMENT, DocumentHistory: HISTORY, ISO42001ChecklistItem: OBSERVATION,
+           Comment: COMMENT, Proof: PROOF}
+
+# Marqueurs du surlignage renvoyés par snippet() : remplacés par <mark> après échappement HTML.
+_HL_START, _HL_END = "\x02", "\x03"
+
+_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "title, body, kind UNINDEXED, ref_id UNINDEXED, team_id UNINDEXED, project_id UNINDEXED, "
+    "parent_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+_available: Optional[bool] = None
+_ready = False
+
+
+def search_available() -> bool:
+    """Vrai si la base est SQLite et que FTS5 est compilé (vérifié une fois, sur une base en mémoire)."""
+    global _available
+    if _available is None:
+        _available = engine.dialect.name == "sqlite"
+        if _available:
+            probe = sqlite3.connect(":memory:")
+            try:
+                probe.execute("CREATE VIRTUAL TABLE probe USING fts5(x)")
+            except sqlite3.OperationalError as e:
+                logger.warning("FTS5 indisponible, recherche désactivée : %s", e)
+                _available = False
+            finally:
+                probe.close()
+    return _available
+
+
+def _index_ready(conn: Connection) -> bool:
+    # Tant que la migration n'a pas créé la table, les écritures ne sont pas indexées.
+    global _ready
+    if not _ready and search_available():
+        _ready = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first() is not None
+    return _ready
+
+
+def create_search_table() -> bool:
+    """Crée la table d'index si besoin. Retourne True si elle vient d'être créée (index à remplir)."""
+    if not search_available():
+        return False
+    with engine.begin() as conn:
+        if _index_ready(conn):
+            return False
+        conn.execute(text(_DDL))
+    return True
+
+
+def _rowid(kind: str, ref_id: Union[int, str]) -> int:
+    if isinstance(ref_id, str):
+        # Identifiants UUID (commentaires) : empreinte stable sur 56 bits.
+        ref_id = int.from_bytes(hashlib.blake2b(ref_id.encode(), digest_size=7).digest(), "big")
+    return ref_id * 8 + KINDS[kind]
+
+
+# ─── Contenu indexé ──────────────────────────────────────────────────────────
+
+def _history_body(content: str, is_keyframe: bool, delta: Optional[str]) -> str:
+    # Une image clé est indexée en entier ; un delta, par le texte ajouté dans cette version :
+    # la recherche retrouve la version qui a introduit un passage sans dupliquer tout le document.
+    if is_keyframe or not delta:
+        return content or ""
+    return "\n".join(arg for op, arg in json.loads(delta) if isinstance(arg, str))
+
+
+def _observation_body(observation: Optional[str], observations: Optional[List[Optional[str]]]) -> str:
+    texts = [observation] + list(observations or [])
+    return "\n".join(dict.fromkeys(t.strip() for t in texts if t and t.strip()))
+
+
+def _entry(obj: Any, teams: Dict[Tuple[str, int], Tuple[Optional[int], Optional[int]]]) -> Optional[Dict[str, Any]]:
+    """Ligne d'index de `obj` (None si rien à indexer). `teams` : (type, id) -> (équipe, projet)."""
+    kind = _MODELS[type(obj)]
+    parent_id = None
+    if kind == DOCUMENT:
+        title, body, team_id, project_id = obj.title, obj.content, obj.team_id, None
+    else:
+        if kind == HISTORY:
+            title, parent_id = f"{obj.title} (v{obj.version})", obj.document_id
+            body = _history_body(obj.content, obj.is_keyframe, obj.delta)
+            team_id, project_id = teams.get((DOCUMENT, obj.document_id), (None, None))
+        elif kind == OBSERVATION:
+            title = f"{obj.control_id} {obj.control_name}"
+            body = _observation_body(obj.observation, obj.observations)
+            team_id, project_id = teams.get((OBSERVATION, obj.id), (None, None))
+        elif kind == COMMENT:
+            title, body = obj.author, obj.content
+            team_id, project_id = teams.get((COMMENT, obj.id), (None, None))
+        else:
+            title, body, parent_id = obj.filename, obj.evidence_id, obj.checklist_item_id
+            team_id, project_id = teams.get((PROOF, obj.id), (None, None))
+        if kind == OBSERVATION and not body:
+            return None
+    if team_id is None:
+        return None
+    return {"rowid": _rowid(kind, obj.id), "title": title or "", "body": body or "", "kind": kind,
+            "ref_id": obj.id, "team_id": team_id, "project_id": project_id, "parent_id": parent_id}
+
+
+def _resolve_teams(conn: Connection, objs: Iterable[Any]) -> Dict[Tuple[str, int], Tuple[Optional[int], Optional[int]]]:
+    """Équipe et projet de chaque objet, en quelques requêtes groupées."""
+    items = ISO42001ChecklistItem.__table__
+    doc_ids: Set[int] = set()
+    project_of: Dict[Tuple[str, int], int] = {}
+    proof_items: Dict[int, int] = {}
+    for obj in objs:
+        if isinstance(obj, DocumentHistory):
+            doc_ids.add(obj.document_id)
+        elif isinstance(obj, (ISO42001ChecklistItem, Comment)):
+            project_of[(_MODELS[type(obj)], obj.id)] = obj.project_id
+        elif isinstance(obj, Proof):
+            proof_items[obj.id] = obj.checklist_item_id
+
+    out: Dict[Tuple[str, int], Tuple[Optional[int], Optional[int]]] = {}
+    if doc_ids:
+        t = Document.__table__
+        for doc_id, team_id in conn.execute(sa_select(t.c.id, t.c.team_id).where(t.c.id.in_(doc_ids))):
+            out[(DOCUMENT, doc_id)] = (team_id, None)
+    if proof_items:
+        item_project = dict(conn.execute(
+            sa_select(items.c.id, items.c.project_id).where(items.c.id.in_(set(proof_items.values())))
+        ).all())
+        for proof_id, item_id in proof_items.items():
+            if item_id in item_project:
+                project_of[(PROOF, proof_id)] = item_project[item_id]
+    if project_of:
+        t = AIProject.__table__
+        team_of = dict(conn.execute(
+            sa_select(t.c.id, t.c.team_id).where(t.c.id.in_(set(project_of.values())))
+        ).all())
+        for key, project_id in project_of.items():
+            if project_id in team_of:
+                out[key] = (team_of[project_id], project_id)
+    return out
+
+
+# ─── Écriture dans l'index ───────────────────────────────────────────────────
+
+def _delete_rowids(conn: Connection, rowids: Iterable[int]) -> None:
+    rowids = list(rowids)
+    if rowids:
+        conn.execute(
+            text("DELETE FROM search_index WHERE rowid IN :rowids").bindparams(bindparam("rowids", expanding=True)),
+            {"rowids": rowids},
+        )
+
+
+def _insert(conn: Connection, entries: List[Dict[str, Any]]) -> None:
+    if entries:
+        conn.execute(
+            text("INSERT INTO search_index (rowid, title, body, kind, ref_id, team_id, project_id, parent_id) "
+                 "VALUES (:rowid, :title, :body, :kind, :ref_id, :team_id, :project_id, :parent_id)"),
+            entries,
+        )
+
+
+def index_objects(conn: Connection, upserts: Iterable[Any], deletes: Iterable[Any] = ()) -> None:
+    """Met à jour l'index pour les objets modifiés (`upserts`) et supprimés (`deletes`)."""
+    upserts, deletes = list(upserts), list(deletes)
+    _delete_rowids(conn, [_rowid(_MODELS[type(o)], o.id) for o in chain(upserts, deletes) if o.id is not None])
+    # La suppression d'un document ou d'un projet emporte les entrées qui en dépendent
+    # (historique, checklist, commentaires, preuves), même supprimées par un DELETE groupé.
+    for obj in deletes:
+        if isinstance(obj, Document):
+            conn.execute(text("DELETE FROM search_index WHERE kind = :kind AND parent_id = :id"),
+                         {"kind": HISTORY, "id": obj.id})
+        elif isinstance(obj, AIProject):
+            conn.execute(text("DELETE FROM search_index WHERE project_id = :id"), {"id": obj.id})
+    teams = _resolve_teams(conn, upserts)
+    _insert(conn, [e for e in (_entry(o, teams) for o in upserts) if e is not None])
+
+
+@event.listens_for(SASession, "after_flush")
+def _index_after_flush(session, flush_context) -> None:
+    deleted = [o for o in session.deleted if isinstance(o, tuple(_MODELS)) or isinstance(o, AIProject)]
+    changed = [o for o in chain(session.new, session.dirty)
+               if type(o) in _MODELS and o not in session.deleted]
+    if not (deleted or changed):
+        return
+    connection = session.connection()
+    if _index_ready(connection):
+        index_objects(connection, changed, deleted)
+
+
+def rebuild_search_index(batch_size: int = 500) -> int:
+    """Reconstruit entièrement l'index à partir des tables sources. Retourne le nombre d'entrées."""
+    total = 0
+    with SessionLocal() as sess:
+        conn = sess.connection()
+        conn.execute(text("DELETE FROM search_index"))
+        for model in _MODELS:
+            # Les preuves sont indexées sans charger leur contenu binaire.
+            query = select(model).execution_options(yield_per=batch_size)
+            if model is Proof:
+                query = query.options(defer(Proof.content))
+            batch: List[Any] = []
+            for obj in sess.exec(query):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    total += _index_batch(conn, batch)
+                    batch = []
+            total += _index_batch(conn, batch)
+        sess.commit()
+    return total
+
+
+def _index_batch(conn: Connection, objs: List[Any]) -> int:
+    teams = _resolve_teams(conn, objs)
+    entries = [e for e in (_entry(o, teams) for o in objs) if e is not None]
+    _insert(conn, entries)
+    return len(entries)
+
+
+# ─── Recherche ───────────────────────────────────────────────────────────────
+
+def match_expression(query: str) -> Optional[str]:
+    """
+    Transforme la saisie de l'utilisateur en expression FTS5 sûre : chaque mot est cité
+    (la syntaxe FTS5 n'est pas interprétée) et le dernier est pris comme préfixe (« recherche en cours de frappe »).
+    """
+    terms = [t.replace('"', '""') for t in query.split() if t.strip('"')]
+    if not terms:
+        return None
+    return " ".join(f'"{t}"' for t in terms[:-1]) + (" " if len(terms) > 1 else "") + f'"{terms[-1]}"*'
+
+
+def _highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_HL_START, "<mark>").replace(_HL_END, "</mark>")
+
+
+def search(conn: Connection, team_id: int, query: str, kinds: Optional[List[str]] = None,
+           project_id: Optional[int] = None, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """Résultats classés (bm25, titre pondéré x5) d'une recherche dans l'équipe, paginés."""
+    expr = match_expression(query)
+    if expr is None:
+        return {"total": 0, "items": []}
+    where = "search_index MATCH :expr AND team_id = :team_id"
+    params: Dict[str, Any] = {"expr": expr, "team_id": team_id}
+    if kinds:
+        where += " AND kind IN :kinds"
+        params["kinds"] = kinds
+    if project_id is not None:
+        where += " AND project_id = :project_id"
+        params["project_id"] = project_id
+
+    def bind(sql: str):
+        stmt = text(sql)
+        return stmt.bindparams(bindparam("kinds", expanding=True)) if kinds else stmt
+
+    total = conn.execute(bind(f"SELECT count(*) FROM search_index WHERE {where}"), params).scalar()
+    rows = conn.execute(bind(
+        "SELECT kind, ref_id, project_id, parent_id, "
+        f"highlight(search_index, 0, '{_HL_START}', '{_HL_END}') AS title, "
+        f"snippet(search_index, 1, '{_HL_START}', '{_HL_END}', '…', {SEARCH_SNIPPET_TOKENS}) AS snippet, "
+        "bm25(search_index, 5.0, 1.0) AS score "
+        f"FROM search_index WHERE {where} ORDER BY score LIMIT :limit OFFSET :offset"
+    ), {**params, "limit": limit, "offset": offset}).all()
+    return {
+        "total": total,
+        "items": [{
+            "kind": r.kind, "id": r.ref_id, "project_id": r.project_id, "parent_id": r.parent_id,
+            "title": _highlight(r.title), "snippet": _highlight(r.snippet), "score": round(-r.score, 4),
+        } for r in rows],
+    }
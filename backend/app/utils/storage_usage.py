@@ -0,0 +1,229 @@
+# app/utils/storage_usage.py
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import LargeBinary, cast, delete, func, insert, literal, update
+from sqlmodel import Session, select
+
+from app.db import SessionLocal
+from app.models import (
+    AIProject, EvaluationRun, ISO42001ChecklistItem, ModelArtifact, ModelRun, Proof,
+    ProjectUsageRead, StorageUsage, TeamUsageRead,
+)
+from app.utils import telemetry
+
+logger = logging.getLogger(__name__)
+
+# BLOC DU REGISTRE D'ESPACE DE STOCKAGE PAR PROJET
+# Chaque projet a une ligne `StorageUsage` : octets occupés par catégorie et nombre de runs.
+#   - models : code et snapshot `ref_stats.csv` (storage/models/project_<id>), sorties des runs
+#              (storage/runs/project_<id>), fichiers du projet dans le magasin d'artéfacts (storage/artifacts)
+#   - data   : datasets (storage/data/project_<id>)
+#   - logs   : logs des runs et évaluations (en base et storage/logs/run_<id>.log[.gz])
+#   - blobs  : fichiers stockés en base (preuves)
+# Le registre est mis à jour par incréments (UPDATE ... SET col = col + :delta) dans la transaction
+# de chaque écriture (upload, artefact, purge) : vérifier un quota ne lit qu'une ligne.
+# Les écritures qu'il ne suit pas (sorties des évaluations, fichiers modifiés à la main) sont rattrapées
+# par `reconcile_usage`, qui recalcule périodiquement chaque ligne à partir du disque et de la base.
+
+STORAGE_ROOT = Path(__file__).resolve().parents[2] / "storage"
+# Quota d'espace par projet en MiB (0 : pas de limite) et nombre maximal de runs par projet.
+PROJECT_STORAGE_QUOTA = int(os.getenv("PROJECT_STORAGE_QUOTA_MB", "2048")) * 1024 * 1024
+PROJECT_RUN_QUOTA = int(os.getenv("PROJECT_RUN_QUOTA", "10"))
+
+CATEGORIES = ("models_bytes", "data_bytes", "logs_bytes", "blob_bytes")
+
+
+def total_bytes(usage: StorageUsage) -> int:
+    return sum(getattr(usage, c) for c in CATEGORIES)
+
+
+def dir_size(path: Path) -> int:
+    """Taille cumulée des fichiers sous `path` (0 si le dossier n'existe pas)."""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += dir_size(Path(entry.path))
+            elif entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+    return total
+
+
+def text_bytes(text: Optional[str]) -> int:
+    return len(text.encode("utf-8")) if text else 0
+
+
+# ─── Mises à jour incrémentales ──────────────────────────────────────────────
+
+def _ensure_row(sess: Session, project_id: int) -> bool:
+    """Crée la ligne (à zéro) du projet si elle n'existe pas. Retourne True si une ligne a été créée."""
+    res = sess.execute(
+        insert(StorageUsage).prefix_with("OR IGNORE").from_select(
+            ["project_id", "team_id", "updated_at"],
+            select(AIProject.id, AIProject.team_id, literal(datetime.utcnow())).where(AIProject.id == project_id),
+        )
+    )
+    return res.rowcount > 0
+
+
+def _execute(sess: Session, project_id: int, stmt) -> int:
+    # La ligne est créée à la première écriture du projet, puis l'UPDATE est rejoué.
+    rowcount = sess.execute(stmt).rowcount
+    if rowcount == 0 and _ensure_row(sess, project_id):
+        rowcount = sess.execute(stmt).rowcount
+    return rowcount
+
+
+def add_usage(sess: Session, project_id: int, **deltas: int) -> None:
+    """Ajoute `deltas` (ex: `models_bytes=-1024`, `run_count=1`) à la ligne du projet. Ne fait pas de commit."""
+    values = {col: getattr(StorageUsage, col) + delta for col, delta in deltas.items() if delta}
+    if not values:
+        return
+    _execute(sess, project_id, update(StorageUsage).where(StorageUsage.project_id == project_id)
+             .values(**values, updated_at=datetime.utcnow()))
+
+
+def reserve_run(sess: Session, project_id: int) -> bool:
+    """
+    Compte un run de plus si le quota de runs n'est pas atteint (UPDATE conditionnel, sans course
+    entre deux lancements simultanés). Retourne False si le quota est atteint. Ne fait pas de commit.
+    """
+    stmt = (
+        update(StorageUsage)
+        .where(StorageUsage.project_id == project_id, StorageUsage.run_count < PROJECT_RUN_QUOTA)
+        .values(run_count=StorageUsage.run_count + 1, updated_at=datetime.utcnow())
+    )
+    return _execute(sess, project_id, stmt) > 0
+
+
+def check_storage_quota(sess: Session, project_id: int, incoming: int, released: int = 0) -> None:
+    """
+    Lève 413 si écrire `incoming` octets (en remplaçant `released` octets existants)
+    dépasse le quota d'espace du projet.
+    """
+    if PROJECT_STORAGE_QUOTA <= 0:
+        return
+    usage = sess.get(StorageUsage, project_id)
+    used = total_bytes(usage) if usage else 0
+    if used - released + incoming > PROJECT_STORAGE_QUOTA:
+        telemetry.inc("storage_quota_rejections_total", help="Écritures refusées pour dépassement du quota")
+        raise HTTPException(
+            413,
+            f"Quota de stockage du projet atteint ({used // 2**20} / {PROJECT_STORAGE_QUOTA // 2**20} MiB)",
+        )
+
+
+# ─── Lecture ─────────────────────────────────────────────────────────────────
+
+def team_usage(sess: Session, team_id: int) -> TeamUsageRead:
+    """Espace occupé par chaque projet de l'équipe (une ligne du registre par projet)."""
+    rows = sess.exec(
+        select(AIProject.id, AIProject.title, StorageUsage)
+        .join(StorageUsage, StorageUsage.project_id == AIProject.id, isouter=True)
+        .where(AIProject.team_id == team_id)
+        .order_by(AIProject.id)
+    ).all()
+    projects = []
+    for project_id, title, usage in rows:
+        usage = usage or StorageUsage(project_id=project_id, team_id=team_id)
+        projects.append(ProjectUsageRead(
+            project_id=project_id, title=title,
+            **{c: getattr(usage, c) for c in CATEGORIES},
+            total_bytes=total_bytes(usage), run_count=usage.run_count,
+            quota_bytes=PROJECT_STORAGE_QUOTA or None, run_quota=PROJECT_RUN_QUOTA,
+            reconciled_at=usage.reconciled_at,
+        ))
+    return TeamUsageRead(
+        team_id=team_id,
+        total_bytes=sum(p.total_bytes for p in projects),
+        run_count=sum(p.run_count for p in projects),
+        projects=projects,
+    )
+
+
+# ─── Recalage ────────────────────────────────────────────────────────────────
+
+def db_bytes(column):
+    # length() d'un TEXT compte des caractères : la conversion en BLOB donne des octets.
+    return func.coalesce(func.sum(func.length(cast(column, LargeBinary))), 0)
+
+
+def scan_project_usage(sess: Session, project_id: int) -> Dict[str, int]:
+    """Recalcule l'espace réel d'un projet (parcours des dossiers et agrégats en base)."""
+    run_ids = sess.exec(select(ModelRun.id).where(ModelRun.project_id == project_id)).all()
+    logs_dir = STORAGE_ROOT / "logs"
+    log_files = 0
+    for run_id in run_ids:
+        for name in (f"run_{run_id}.log", f"run_{run_id}.log.gz"):
+            try:
+                log_files += (logs_dir / name).stat().st_size
+            except OSError:
+                pass
+    run_logs = sess.exec(select(db_bytes(ModelRun.logs)).where(ModelRun.project_id == project_id)).one()
+    eval_logs = sess.exec(select(db_bytes(EvaluationRun.logs)).where(EvaluationRun.project_id == project_id)).one()
+    blobs = sess.exec(
+        select(db_bytes(Proof.content))
+        .join(ISO42001ChecklistItem, ISO42001ChecklistItem.id == Proof.checklist_item_id)
+        .where(ISO42001ChecklistItem.project_id == project_id)
+    ).one()
+    # Magasin d'artéfacts : chaque contenu distinct du projet compte une fois.
+    stored = sess.exec(
+        select(ModelArtifact.sha256, func.max(ModelArtifact.size_bytes))
+        .where(ModelArtifact.project_id == project_id, ModelArtifact.sha256 != None)  # noqa: E711
+        .group_by(ModelArtifact.sha256)
+    ).all()
+    return {
+        "models_bytes": dir_size(STORAGE_ROOT / "models" / f"project_{project_id}")
+                        + dir_size(STORAGE_ROOT / "runs" / f"project_{project_id}")
+                        + sum(size for _, size in stored),
+        "data_bytes": dir_size(STORAGE_ROOT / "data" / f"project_{project_id}"),
+        "logs_bytes": int(run_logs) + int(eval_logs) + log_files,
+        "blob_bytes": int(blobs),
+        "run_count": len(run_ids),
+    }
+
+
+def reconcile_usage(project_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Recale le registre des projets `project_ids` (tous par défaut) sur l'espace réellement occupé,
+    une transaction par projet. Retourne le nombre de projets dont le registre avait dérivé.
+    """
+    if project_ids is None:
+        with SessionLocal() as sess:
+            project_ids = sess.exec(select(AIProject.id).order_by(AIProject.id)).all()
+            # Lignes orphelines (projet supprimé hors ORM).
+            sess.execute(delete(StorageUsage).where(StorageUsage.project_id.not_in(select(AIProject.id))))
+            sess.commit()
+
+    drifted = 0
+    for project_id in project_ids:
+        with SessionLocal() as sess:
+            actual = scan_project_usage(sess, project_id)
+            _ensure_row(sess, project_id)
+            usage = sess.get(StorageUsage, project_id)
+            if usage is None:   # projet supprimé entre-temps
+                continue
+            diff = {k: v - getattr(usage, k) for k, v in actual.items() if v != getattr(usage, k)}
+            if diff:
+                drifted += 1
+                logger.info("Registre d'espace du projet %s recalé : %s", project_id, diff)
+            # Les incréments écrits pendant le parcours sont écrasés : le passage suivant les rattrape.
+            now = datetime.utcnow()
+            sess.execute(
+                update(StorageUsage).where(StorageUsage.project_id == project_id)
+                .values(**actual, updated_at=now, reconciled_at=now)
+            )
+            sess.commit()
+    telemetry.inc("storage_usage_drifted_total", drifted, help="Registres d'espace recalés lors d'un passage")
+    return drifted
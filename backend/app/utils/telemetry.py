@@ -0,0 +1,82 @@
+# app/utils/telemetry.py
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+# BLOC DES MÉTRIQUES DE FONCTIONNEMENT
+# Petit registre en mémoire (compteurs, jauges, durées) exposé au format texte Prometheus
+# par la route `/metrics`. À ne pas confondre avec `app.metrics`, qui calcule les métriques
+# des modèles d'IA évalués.
+
+_lock = Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+_summaries: Dict[str, Tuple[int, float, float]] = {}   # nom -> (nombre, somme, max)
+_help: Dict[str, str] = {}
+
+
+def inc(name: str, value: float = 1.0, help: str = "") -> None:
+    """Incrémente un compteur (créé à la première utilisation)."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0.0) + value
+        if help: _help.setdefault(name, help)
+
+
+def register_gauge(name: str, fn: Callable[[], float], help: str = "") -> None:
+    """Déclare une jauge dont la valeur est lue (via `fn`) au moment de l'export."""
+    with _lock:
+        _gauges[name] = fn
+        if help: _help.setdefault(name, help)
+
+
+def observe(name: str, value: float, help: str = "") -> None:
+    """Enregistre une observation (ex: une durée en secondes) : nombre, somme et maximum."""
+    with _lock:
+        count, total, peak = _summaries.get(name, (0, 0.0, 0.0))
+        _summaries[name] = (count + 1, total + value, max(peak, value))
+        if help: _help.setdefault(name, help)
+
+
+def snapshot() -> Dict[str, float]:
+    """Valeurs courantes de toutes les métriques (utile pour les logs et le débogage)."""
+    with _lock:
+        values = dict(_counters)
+        gauges = dict(_gauges)
+        for name, (count, total, peak) in _summaries.items():
+            values[f"{name}_count"], values[f"{name}_sum"], values[f"{name}_max"] = count, total, peak
+    for name, fn in gauges.items():
+        try:
+            values[name] = float(fn())
+        except Exception:
+            continue
+    return values
+
+
+def render_prometheus() -> str:
+    """Export au format texte Prometheus (version 0.0.4)."""
+    with _lock:
+        counters, gauges, summaries, helps = dict(_counters), dict(_gauges), dict(_summaries), dict(_help)
+    lines = []
+
+    def _head(name: str, kind: str) -> None:
+        if name in helps:
+            lines.append(f"# HELP {name} {helps[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for name in sorted(counters):
+        _head(name, "counter")
+        lines.append(f"{name} {counters[name]}")
+    for name in sorted(gauges):
+        try:
+            value = float(gauges[name]())
+        except Exception:
+            continue
+        _head(name, "gauge")
+        lines.append(f"{name} {value}")
+    for name in sorted(summaries):
+        count, total, peak = summaries[name]
+        _head(name, "summary")
+        lines.append(f"{name}_count {count}")
+        lines.append(f"{name}_sum {total}")
+        lines.append(f"# TYPE {name}_max gauge")
+        lines.append(f"{name}_max {peak}")
+    return "\n".join(lines) + "\n"
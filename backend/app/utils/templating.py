@@ -0,0 +1,55 @@
+# app/utils/templating.py
+from numbers import Real
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Union
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+# BLOC DU MOTEUR DE GABARITS DES RAPPORTS
+# Les rapports HTML (rapport d'audit et de risques, export PDF des documents) sont décrits par des
+# gabarits Jinja2 dans `app/templates/reports`, compilés une seule fois puis gardés en mémoire.
+# Le rendu produit des morceaux de HTML au fil de l'eau (`stream_html`) : on évite les
+# concaténations successives d'une grande chaîne, et le rapport peut aller directement sur le disque.
+
+TEMPLATES_DIR = Path(__file__).resolve().parents[1] / "templates" / "reports"
+# Taille (en fragments de gabarit) des morceaux renvoyés par `stream_html`.
+STREAM_BUFFER = 64
+
+
+def _format_metric(value: Any) -> str:
+    """Affiche un nombre avec 4 décimales ; les autres valeurs sont laissées telles quelles."""
+    if isinstance(value, Real) and not isinstance(value, bool):
+        return f"{value:.4f}"
+    return str(value)
+
+
+_env = Environment(
+    loader=FileSystemLoader(str(TEMPLATES_DIR)),
+    autoescape=select_autoescape(["html"]),
+    trim_blocks=True,
+    lstrip_blocks=True,
+    auto_reload=False,
+)
+_env.filters["metric"] = _format_metric
+
+
+def stream_html(template_name: str, **context: Any) -> Iterator[str]:
+    """Rend le gabarit par morceaux successifs."""
+    stream = _env.get_template(template_name).stream(**context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return iter(stream)
+
+
+def render_html(template_name: str, **context: Any) -> str:
+    """Rend le gabarit en une seule chaîne."""
+    return _env.get_template(template_name).render(**context)
+
+
+def write_html(html: Union[str, Iterable[str]], path: Path) -> None:
+    """Écrit le HTML (chaîne ou morceaux issus de `stream_html`) dans `path`, en UTF-8."""
+    with open(path, "w", encoding="utf-8") as f:
+        if isinstance(html, str):
+            f.write(html)
+        else:
+            for chunk in html:
+                f.write(chunk)
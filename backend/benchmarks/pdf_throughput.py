@@ -0,0 +1,99 @@
+# benchmarks/pdf_throughput.py
+"""
+Débit de génération du rapport d'audit en PDF (rapports / minute) selon le moteur de rendu :
+wkhtmltopdf (un sous-processus par rendu), WeasyPrint dans le processus courant, et WeasyPrint
+dans le pool de workers persistants de `app.utils.pdf_render`.
+
+Usage (depuis `backend/`, sous Linux) :
+    python -m benchmarks.pdf_throughput [--controls 500] [--reports 20] [--concurrency 4] [--workers 4]
+                                        [--save benchmarks/results/pdf_throughput.json]
+
+Les moteurs absents de la machine sont signalés et ignorés. Aucune base de données n'est nécessaire.
+`--save` enregistre les paramètres, la machine (processeurs, système, versions) et les débits mesurés
+en JSON, pour comparer les mesures d'une machine à l'autre et d'une version à l'autre.
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime
+from importlib import metadata
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.pdf_render import PageOptions, RendererUnavailable, get_renderer, render_pdf, shutdown_pools
+from app.utils.templating import stream_html
+from benchmarks.report_render import synthetic_audit_data
+
+
+def run(audit, risk, renderer: str, workers: int, reports: int, concurrency: int) -> float:
+    """Rend `reports` rapports avec `concurrency` requêtes simultanées ; retourne le débit (rapports / min)."""
+    page = PageOptions()
+
+    def one(_):
+        return len(render_pdf(stream_html("audit_risk_report.html", audit=audit, risk=risk),
+                              page, renderer=renderer, workers=workers))
+
+    one(0)  # échauffement : démarrage du pool, chargement des polices
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(reports)))
+    return reports / (time.perf_counter() - started) * 60
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--controls", type=int, default=500)
+    parser.add_argument("--questions", type=int, default=4)
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4, help="taille du pool de workers WeasyPrint")
+    parser.add_argument("--save", type=Path, help="fichier JSON où enregistrer les résultats")
+    args = parser.parse_args()
+
+    audit, risk = synthetic_audit_data(args.controls, args.questions)
+    variants = [
+        ("wkhtmltopdf (sous-processus)", "wkhtmltopdf", 0),
+        ("weasyprint (en processus)", "weasyprint", 0),
+        (f"weasyprint (pool de {args.workers})", "weasyprint", args.workers),
+    ]
+    print(f"{args.controls} contrôles x {args.questions} questions, {args.reports} rapports, "
+          f"{args.concurrency} requêtes simultanées\n")
+    print(f"{'moteur':<32}{'rapports / min':>16}")
+    results = []
+    try:
+        for label, renderer, workers in variants:
+            try:
+                get_renderer(renderer)
+            except RendererUnavailable as e:
+                print(f"{label:<32}{'indisponible':>16}  ({e})")
+                results.append({"variant": label, "reports_per_minute": None, "error": str(e)})
+                continue
+            rate = run(audit, risk, renderer, workers, args.reports, args.concurrency)
+            print(f"{label:<32}{rate:>16.1f}")
+            results.append({"variant": label, "reports_per_minute": round(rate, 1)})
+    finally:
+        shutdown_pools()
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps({
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "params": {k: v for k, v in vars(args).items() if k != "save"},
+            "machine": {"cpus": os.cpu_count(), "system": platform.platform(), "python": platform.python_version(),
+                        "engines": {pkg: _version(pkg) for pkg in ("weasyprint", "pdfkit")}},
+            "results": results,
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nRésultats enregistrés dans {args.save}")
+
+
+def _version(package: str):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/report_render.py
+"""
+Compare le rendu HTML du rapport d'audit : ancienne concaténation de chaînes contre gabarit Jinja2
+(rendu complet et rendu par morceaux écrits sur disque), sur un projet synthétique.
+
+Usage (depuis `backend/`) :
+    python -m benchmarks.report_render [--controls 500] [--questions 4] [--repeat 5]
+
+Pour chaque variante : meilleur temps sur `--repeat` essais et pic de mémoire Python (tracemalloc).
+Aucune base de données n'est nécessaire.
+"""
+import argparse
+import os
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Tuple
+
+from app.utils.templating import render_html, stream_html, write_html
+from benchmarks.legacy_report_html import legacy_generate_report_html
+
+
+def synthetic_audit_data(controls: int, questions: int, seed: int = 42) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Données d'audit et de risques d'un projet fictif de `controls` points de contrôle."""
+    rnd = random.Random(seed)
+    items = []
+    for c in range(controls):
+        audit_questions = []
+        for q in range(questions):
+            proofs = [{"filename": f"preuve_{c}_{q}_{p}.pdf", "proof_id": c * 100 + q * 10 + p,
+                       "checklist_item_id": c, "evidence_id": f"E{q}"} for p in range(rnd.randint(0, 3))]
+            ncs = [{
+                "id": c * 100 + q, "type_nc": rnd.choice(["mineure", "majeure"]), "statut": "non_corrigee",
+                "deadline_correction": "2025-01-01T00:00:00",
+                "actions_correctives": [{"description": "Mettre à jour la procédure " * 3, "responsible": "auditeur",
+                                         "deadline": "2025-02-01T00:00:00", "status": "open"}],
+            }] if rnd.random() < 0.2 else []
+            audit_questions.append({
+                "question": f"La politique {c}.{q} est-elle documentée, approuvée et communiquée ? " * 2,
+                "status": rnd.choice(["to-do", "in-progress", "done"]),
+                "result": rnd.choice(["compliant", "not-compliant", "not-assessed"]),
+                "observation": "Observation de l'auditeur. " * rnd.randint(0, 5),
+                "evidence_required": [], "proofs": proofs, "non_conformities": ncs,
+            })
+        items.append({
+            "control_id": f"A.{c // 10}.{c % 10}", "control_name": f"Contrôle synthétique {c}",
+            "description": "Description du point de contrôle de la norme. " * 4,
+            "status": "in-progress", "result": "not-assessed", "observation": None,
+            "audit_questions": audit_questions,
+        })
+    audit = {
+        "project_title": "Projet synthétique", "description": "Banc d'essai du rendu",
+        "team_members": [{"username": "auditeur"}], "checklist_items": items,
+        "compliance": {"total": controls * questions, "compliant": 0, "open_nc": 0, "score": 0},
+    }
+    risk = {
+        "performance": {"accuracy": 0.91, "f1": 0.87, "precision": 0.9, "recall": 0.85},
+        "fairness": {"sexe": {"demographic_parity": 0.04}, "age": {"demographic_parity": 0.08}},
+        "drift": {"ks": 0.12}, "robustness": {"noise_accuracy": 0.88},
+    }
+    return audit, risk
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """Retourne (meilleur temps en secondes, pic mémoire en octets) de `fn`."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--controls", type=int, default=500)
+    parser.add_argument("--questions", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    audit, risk = synthetic_audit_data(args.controls, args.questions)
+    render_html("audit_risk_report.html", audit=audit, risk=risk)  # compilation du gabarit hors mesure
+
+    variants = {
+        "concaténation (ancien)": lambda: legacy_generate_report_html(audit, risk),
+        "jinja2 render": lambda: render_html("audit_risk_report.html", audit=audit, risk=risk),
+        "jinja2 stream → fichier": lambda: write_html(
+            stream_html("audit_risk_report.html", audit=audit, risk=risk), os.devnull),
+    }
+    size = len(legacy_generate_report_html(audit, risk).encode("utf-8"))
+    print(f"{args.controls} contrôles x {args.questions} questions, HTML ≈ {size / 1e6:.1f} Mo\n")
+    print(f"{'variante':<28}{'temps (ms)':>12}{'pic mémoire (Mo)':>20}")
+    for name, fn in variants.items():
+        seconds, peak = measure(fn, args.repeat)
+        print(f"{name:<28}{seconds * 1000:>12.1f}{peak / 1e6:>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
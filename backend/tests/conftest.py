@@ -0,0 +1,6 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+# Les tests importent le paquet `app` depuis backend/, quel que soit le dossier de lancement.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,107 @@
+# tests/test_doc_history.py
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.models import Document, DocumentHistory
+from app.utils import doc_history
+from app.utils.doc_history import apply_delta, compact_document_history, make_delta, version_content
+
+# Contenus successifs d'un document : fins de ligne CRLF et CR, dernière ligne sans saut de ligne,
+# contenu vide, séparateurs de ligne Unicode (coupés par `splitlines`).
+VERSIONS = [
+    "",
+    "titre\r\nligne 1\r\nligne 2\r\n",
+    "titre\r\nligne 1 modifiée\r\nligne 2",
+    "titre\r\nligne 1 modifiée\nligne 2\nligne 3",
+    "",
+    "a\rb\rc",
+    "a\rb\rc\n",
+    "page 1\x0cpage 2 fin",
+    "\n\n\n",
+    "sans saut de ligne final",
+]
+
+# Historique assez long pour que les deltas soient plus petits que les copies complètes.
+BODY = "".join(f"paragraphe {i} de la politique\r\n" for i in range(40))
+HISTORY = [
+    BODY,
+    BODY + "ajout sans saut de ligne final",
+    BODY.replace("paragraphe 7 ", "paragraphe sept ") + "ajout sans saut de ligne final",
+    "",
+    BODY,
+    BODY.replace("\r\n", "\n", 10),
+    BODY[:-2],
+    BODY + "\r\n",
+    "",
+    "",
+    BODY.replace("\r\n", "\r"),
+    BODY,
+]
+
+
+@pytest.mark.parametrize("old", VERSIONS)
+@pytest.mark.parametrize("new", VERSIONS)
+def test_delta_round_trip(old, new):
+    assert apply_delta(old, make_delta(old, new)) == new
+
+
+@pytest.fixture
+def sess():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine, tables=[Document.__table__, DocumentHistory.__table__])
+    with Session(engine) as s:
+        yield s
+    doc_history._cache.clear()
+
+
+def _document(sess, created_at=None):
+    doc = Document(title="t", content=HISTORY[-1], version=len(HISTORY), created_by="u", team_id=1,
+                   created_at=created_at or datetime.utcnow())
+    sess.add(doc)
+    sess.commit()
+    return doc
+
+
+def test_compact_then_reconstruct_every_version(sess):
+    doc = _document(sess)
+    # historique d'avant les deltas : une copie complète par version
+    for version, content in enumerate(HISTORY, start=1):
+        sess.add(DocumentHistory(document_id=doc.id, title="t", content=content, version=version,
+                                 created_at=doc.created_at, updated_at=doc.created_at, created_by="u"))
+    sess.commit()
+
+    assert compact_document_history(sess, doc.id) > 0
+    sess.commit()
+    assert compact_document_history(sess, doc.id) == 0   # idempotent
+
+    rows = sess.exec(select(DocumentHistory).where(DocumentHistory.document_id == doc.id)).all()
+    assert any(not r.is_keyframe for r in rows)
+    for version, content in enumerate(HISTORY, start=1):
+        assert version_content(sess, doc, version) == content
+    doc_history._cache.clear()
+    for version in range(len(HISTORY), 0, -1):
+        assert version_content(sess, doc, version) == HISTORY[version - 1]
+
+
+def test_cache_not_shared_with_a_reused_document_id(sess):
+    old = _document(sess)
+    sess.add(DocumentHistory(document_id=old.id, title="t", content="ancien contenu", version=1,
+                             created_at=old.created_at, updated_at=old.created_at, created_by="u"))
+    sess.commit()
+    assert version_content(sess, old, 1) == "ancien contenu"
+
+    # Suppression sans `forget_document` (autre worker), puis nouveau document avec le même id.
+    doc_id = old.id
+    sess.exec(DocumentHistory.__table__.delete())
+    sess.delete(old)
+    sess.commit()
+    new = Document(id=doc_id, title="t", content="", created_by="u", team_id=2,
+                   created_at=old.created_at + timedelta(seconds=1))
+    sess.add(new)
+    sess.add(DocumentHistory(document_id=doc_id, title="t", content="nouveau contenu", version=1,
+                             created_at=new.created_at, updated_at=new.created_at, created_by="u"))
+    sess.commit()
+    assert version_content(sess, new, 1) == "nouveau contenu"
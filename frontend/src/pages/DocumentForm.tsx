@@ -72,9 +72,21 @@ export default function DocumentForm() {
       headers: { Authorization: `Bearer ${token}` },
       body: form,
     });
-    setUploading(false);
-    if (!res.ok) return alert("Upload failed: " + (await res.text()));
+    if (!res.ok) {
+      setUploading(false);
+      return alert("Upload failed: " + (await res.text()));
+    }
     const d = await res.json();
+    // L'import se poursuit en arrière-plan : on attend la fin avant d'ouvrir le document
+    let job = { status: "running", error: null as string | null };
+    while (job.status !== "done" && job.status !== "error") {
+      await new Promise((r) => setTimeout(r, 1000));
+      const poll = await api(`/documents/${d.id}/import`);
+      if (!poll.ok) break;
+      job = await poll.json();
+    }
+    setUploading(false);
+    if (job.status === "error") alert("Import failed: " + job.error);
     nav(`/documents/${d.id}`);
   };
 
@@ -19,7 +19,7 @@ interface HistoryEntry {
   updated_at:  string
   created_by:  string
   title:       string
-  content:     string
+  content?:    string   // chargé à la demande (GET /documents/:id/history/:version)
 }
 
 export default function DocumentHistory() {
@@ -32,6 +32,17 @@ export default function DocumentHistory() {
   const [sel, setSel]         = useState<HistoryEntry | null>(null)
   const api = useApi()
 
+  const showVersion = (h: HistoryEntry) => {
+    setSel(h)
+    setOpen(true)
+    api(`/documents/${id}/history/${h.version}`, {
+      headers: { Authorization: `Bearer ${token}` }
+    })
+      .then(r => r.ok ? r.json() : Promise.reject(r.statusText))
+      .then((v: HistoryEntry) => setSel(cur => cur?.version === v.version ? v : cur))
+      .catch(e => setError(e as string))
+  }
+
   useEffect(() => {
     if (!id) return
     setLoading(true)
@@ -77,7 +88,7 @@ export default function DocumentHistory() {
                 <TableCell>{h.created_by}</TableCell>
                 <TableCell>{h.title}</TableCell>
                 <TableCell align="right">
-                  <IconButton onClick={() => { setSel(h); setOpen(true) }}>
+                  <IconButton onClick={() => showVersion(h)}>
                     <Eye />
                   </IconButton>
                 </TableCell>
@@ -92,6 +103,7 @@ export default function DocumentHistory() {
           Version {sel?.version} — {sel?.title}
         </DialogTitle>
         <DialogContent dividers>
+        {sel && sel.content === undefined ? <Box textAlign="center"><CircularProgress/></Box> : (
         <ReactMarkdown
   remarkPlugins={[remarkGfm]}
     skipHtml
@@ -107,6 +119,7 @@ export default function DocumentHistory() {
 >
   {sel?.content || ""}
 </ReactMarkdown>
+        )}
 </DialogContent>
         <DialogActions>
           <Button onClick={() => setOpen(false)}>Fermer</Button>
@@ -13,24 +13,35 @@ interface Document {
   created_at: string
   updated_at: string
   created_by: string
+  size: number        // nombre de caractères du contenu (la liste ne renvoie pas le contenu)
+}
+
+interface DocumentPage {
+  items: Document[]
+  next_cursor: string | null
 }
 
 export default function DocumentsList() {
   const [docs, setDocs] = useState<Document[]>([])
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState<string>()
+  const [cursor, setCursor] = useState<string | null>(null)
   const { token } = useAuth()
   const { teamId } = useTeam()
   const nav = useNavigate()
   const api = useApi()
-  const load = async () => {
+  // Liste paginée par curseur : `after` absent = première page, sinon page suivante ajoutée à la liste.
+  const load = async (after?: string) => {
     setLoading(true)
     try {
-      const res = await api('/documents/', {
+      const qs = after ? `?cursor=${encodeURIComponent(after)}` : ''
+      const res = await api(`/documents/${qs}`, {
         headers: { Authorization: `Bearer ${token}` }
       })
       if (!res.ok) throw new Error(await res.text())
-      setDocs(await res.json())
+      const page: DocumentPage = await res.json()
+      setDocs(prev => after ? [...prev, ...page.items] : page.items)
+      setCursor(page.next_cursor)
     } catch (err: any) {
       setError(err.message)
     } finally {
@@ -62,7 +73,7 @@ export default function DocumentsList() {
     )
   }
 
-  if (loading) return <Box textAlign="center" mt={4}><CircularProgress/></Box> 
+  if (loading && docs.length === 0) return <Box textAlign="center" mt={4}><CircularProgress/></Box> 
   if (error)   return <Typography color="error">{error}</Typography>
 
   return (
@@ -117,6 +128,14 @@ export default function DocumentsList() {
           </TableBody>
         </Table>
       </TableContainer>
+
+      {cursor && (
+        <Box textAlign="center" mt={2}>
+          <Button onClick={() => load(cursor)} disabled={loading}>
+            {loading ? <CircularProgress size={20}/> : 'Charger plus'}
+          </Button>
+        </Box>
+      )}
     </Box>
   )
 }
@@ -1047,17 +1047,38 @@ const saveConfigYaml = async () => {
   startIcon={<Download size={18} />}
   onClick={async () => {
     try {
-      const res = await api(
-        `/reports/${id}/audit-risk-report.pdf`,
-        {
-          headers: { Authorization: `Bearer ${token}` }
-        }
-      )
-      if (res.status === 401) {
+      // 1. Création de la tâche de génération (immédiatement terminée si le rapport est à jour)
+      const base = `/reports/${id}/audit-risk-report/jobs`
+      const start = await api(base, {
+        method: 'POST',
+        headers: { Authorization: `Bearer ${token}` }
+      })
+      if (start.status === 401) {
         alert('Session expirée, veuillez vous reconnecter.')
         logout()
         return
       }
+      if (!start.ok) {
+        alert(`Erreur ${start.status} lors de la génération du rapport.`)
+        return
+      }
+      let job = await start.json()
+      // 2. Suivi de la progression jusqu'à la fin de la génération
+      while (job.status !== 'done' && job.status !== 'error') {
+        await new Promise(r => setTimeout(r, 1000))
+        const poll = await api(`${base}/${job.job_id}`)
+        if (!poll.ok) {
+          alert(`Erreur ${poll.status} lors de la génération du rapport.`)
+          return
+        }
+        job = await poll.json()
+      }
+      if (job.status === 'error') {
+        alert(`Échec de la génération du rapport : ${job.error}`)
+        return
+      }
+      // 3. Téléchargement du PDF
+      const res = await api(`${base}/${job.job_id}/download`)
       if (!res.ok) {
         alert(`Erreur ${res.status} lors du téléchargement du rapport.`)
         return
@@ -12,7 +12,7 @@ interface UserProfile { username: string }
 
 export default function Settings() {
   const api = useApi()
-  const { logout } = useAuth()
+  const { login, logout } = useAuth()
 
   const [profile, setProfile] = useState<UserProfile>({ username: '' })
   const [password, setPassword] = useState('')
@@ -60,6 +60,9 @@ export default function Settings() {
         body: JSON.stringify(body),
       })
       if (!res.ok) throw new Error(`Update failed (${res.status})`)
+      // A password or username change revokes previous tokens: keep the session with the fresh one
+      const fresh = res.headers.get('X-Access-Token')
+      if (fresh) login(fresh)
       setSuccess(true)
     } catch (e: any) {
       setError(e.message)